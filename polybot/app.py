@@ -1,13 +1,37 @@
+import functools
+import signal
+import sys
+import threading
 import flask
 from flask import request
 import os
+from loguru import logger
 from bot import ObjectDetectionBot
+from metrics import instrument
+from workers import MessageWorkerPool
 
 
 app = flask.Flask(__name__)
+# /metrics, with the stage metrics of the bot (merged from the worker processes) and of the HTTP requests
+instrument(app)
 
 TELEGRAM_TOKEN = os.environ['TELEGRAM_TOKEN']
 TELEGRAM_APP_URL = os.environ['TELEGRAM_APP_URL']
+WORKERS = int(os.environ.get('POLYBOT_WORKERS', os.cpu_count()))
+MAX_PENDING_MESSAGES = int(os.environ.get('POLYBOT_MAX_PENDING_MESSAGES', 100))
+SHUTDOWN_TIMEOUT = float(os.environ.get('POLYBOT_SHUTDOWN_TIMEOUT', 30))
+# handle messages as asyncio tasks in this process instead of on the worker pool
+ASYNC_BOT = os.environ.get('POLYBOT_ASYNC') == '1'
+ASYNC_MAX_CONCURRENCY = int(os.environ.get('POLYBOT_ASYNC_MAX_CONCURRENCY', 32))
+# send prediction jobs to yolo5 through this queue (e.g. sqlite:////shared/jobs.db) instead of calling it
+JOB_QUEUE_URL = os.environ.get('JOB_QUEUE_URL')
+# photos scoring below this are answered "no objects" without a prediction (see prefilter.py). 0, the default, turns
+# it off, calibrate a threshold on a labeled sample of real photos before setting it
+PREFILTER_THRESHOLD = float(os.environ.get('POLYBOT_PREFILTER_THRESHOLD', 0))
+
+
+# set once the bot (and its worker pool) is created, the webhook answers 503 before that so Telegram retries
+ready = threading.Event()
 
 
 @app.route('/', methods=['GET'])
@@ -15,15 +39,69 @@ def index():
     return 'Ok'
 
 
+@app.route('/ready', methods=['GET'])
+def readiness():
+    if not ready.is_set():
+        return 'Starting', 503
+    return 'Ok'
+
+
 @app.route(f'/{TELEGRAM_TOKEN}/', methods=['POST'])
 def webhook():
+    if not ready.is_set():
+        return 'Starting', 503
     req = request.get_json()
     if 'message' in req:
-        bot.handle_message(req['message'])
+        # acknowledge right away, the message is handled by the event loop or the worker pool
+        accepted = bot.submit(req['message']) if ASYNC_BOT else workers.submit(req['message'])
+        if not accepted:
+            bot.send_text(req['message']['chat']['id'], 'The bot is busy right now, please try again in a minute.')
     return 'Ok'
 
 
+def warm_up():
+    """
+    Creates the bot, importing what only it needs (boto3, aiohttp), while the server is already listening.
+    """
+    global bot, workers
+    try:
+        if ASYNC_BOT:
+            from async_bot import AsyncObjectDetectionBot
+            bot = AsyncObjectDetectionBot(TELEGRAM_TOKEN, TELEGRAM_APP_URL, max_concurrency=ASYNC_MAX_CONCURRENCY,
+                                          max_pending=MAX_PENDING_MESSAGES, job_queue_url=JOB_QUEUE_URL,
+                                          prefilter_threshold=PREFILTER_THRESHOLD)
+        else:
+            bot = ObjectDetectionBot(TELEGRAM_TOKEN, TELEGRAM_APP_URL, job_queue_url=JOB_QUEUE_URL,
+                                     prefilter_threshold=PREFILTER_THRESHOLD)
+            workers = MessageWorkerPool(
+                functools.partial(ObjectDetectionBot, TELEGRAM_TOKEN, TELEGRAM_APP_URL, set_webhook=False,
+                                  job_queue_url=JOB_QUEUE_URL, prefilter_threshold=PREFILTER_THRESHOLD),
+                max_workers=WORKERS,
+                max_pending=MAX_PENDING_MESSAGES
+            )
+        if JOB_QUEUE_URL:
+            threading.Thread(target=bot.consume_results, name='results-consumer', daemon=True).start()
+    except Exception:
+        logger.exception('Failed to start the bot')
+        os._exit(1)
+
+    ready.set()
+    logger.info('Bot ready')
+
+
+def shutdown(signum, frame):
+    # finish the accepted messages before exiting (docker stop sends SIGTERM)
+    if ready.is_set():
+        if ASYNC_BOT:
+            bot.close(timeout=SHUTDOWN_TIMEOUT)
+        else:
+            workers.shutdown(timeout=SHUTDOWN_TIMEOUT)
+    sys.exit(0)
+
+
 if __name__ == "__main__":
-    bot = ObjectDetectionBot(TELEGRAM_TOKEN, TELEGRAM_APP_URL)
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
 
-    app.run(host='0.0.0.0', port=8443)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=8443)
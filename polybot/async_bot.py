@@ -0,0 +1,190 @@
+import asyncio
+import io
+import json
+import random
+import threading
+
+import aiohttp
+from loguru import logger
+
+try:
+    from polybot.bot import ObjectDetectionBot
+    from polybot.metrics import TRACE_HEADER, new_trace_id, stage
+    from polybot.s3_transfer import transfer_config
+except ImportError:
+    # running from within the polybot directory (the service container)
+    from bot import ObjectDetectionBot
+    from metrics import TRACE_HEADER, new_trace_id, stage
+    from s3_transfer import transfer_config
+
+TELEGRAM_API_URL = 'https://api.telegram.org'
+
+
+class AsyncObjectDetectionBot(ObjectDetectionBot):
+    """
+    `ObjectDetectionBot` handling messages as asyncio tasks on a single event loop thread.
+
+    Telegram and yolo5 are called through one shared aiohttp connection pool, with at most `max_concurrency`
+    messages in flight, a `timeout` per HTTP call and `retries` (with exponential backoff and full jitter) for
+    failed yolo5 calls. At most `max_pending` messages are queued or in flight, `submit` turns away the others.
+    The job queue and the pre-filter work as in `ObjectDetectionBot`. The photo is downloaded from Telegram into
+    memory, then uploaded to S3 by boto3 on the loop's executor.
+    """
+
+    def __init__(self, token, telegram_chat_url=None, set_webhook=True, max_concurrency=32, max_pending=100,
+                 timeout=30, retries=3, backoff=0.5, telegram_api_url=TELEGRAM_API_URL, job_queue_url=None,
+                 prefilter_threshold=None):
+        super().__init__(token, telegram_chat_url, set_webhook, job_queue_url=job_queue_url,
+                         prefilter_threshold=prefilter_threshold)
+        self.token = token
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.telegram_api_url = telegram_api_url
+
+        self._lock = threading.RLock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._accepting = True
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='async-bot', daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._open(), self.loop).result()
+
+    async def _open(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def close(self, timeout=None):
+        """
+        Stops accepting messages, waits (up to `timeout` seconds) for the ones in flight, then closes the connection
+        pool and stops the event loop. Messages still in flight after the timeout are dropped.
+        """
+        with self._lock:
+            self._accepting = False
+            if not self._idle.wait_for(lambda: not self._pending, timeout):
+                logger.warning(f'{self._pending} messages still in flight after {timeout}s, dropping them')
+
+        asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+    def submit(self, msg):
+        """
+        Schedules `msg` on the event loop. Returns False if the bot is full or closing.
+        """
+        with self._lock:
+            if not self._accepting or self._pending >= self.max_pending:
+                return False
+            self.handle_message(msg)
+        return True
+
+    def handle_message(self, msg):
+        """
+        Schedules the message on the event loop and returns right away, with a `concurrent.futures.Future`.
+        """
+        with self._lock:
+            self._pending += 1
+        future = asyncio.run_coroutine_threadsafe(self.handle_message_async(msg), self.loop)
+        future.add_done_callback(self._message_done)
+        return future
+
+    def _message_done(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.opt(exception=future.exception()).error('Failed to handle message')
+        with self._lock:
+            self._pending -= 1
+            if not self._pending:
+                self._idle.notify_all()
+
+    async def handle_message_async(self, msg):
+        trace_id = new_trace_id()
+        logger.info(f'trace: {trace_id}. photo message {msg["message_id"]} of chat {msg["chat"]["id"]}')
+
+        with stage('semaphore_wait', trace_id):
+            await self.semaphore.acquire()
+        try:
+            with stage('handle_message', trace_id):
+                with stage('telegram_download', trace_id):
+                    photo_path, data = await self.get_user_photo_async(msg)
+                if self.prefilter:
+                    with stage('prefilter', trace_id):
+                        skip = await self.loop.run_in_executor(None, self.prefilter.should_skip, data)
+                    if skip:
+                        logger.info(f'trace: {trace_id}. nothing to detect, prediction skipped. '
+                                    f'{self.prefilter.stats()}')
+                        with stage('send_summary', trace_id):
+                            await self.loop.run_in_executor(None, self.send_summary_to_user, msg['chat']['id'], {})
+                        return
+                img_name = photo_path.split('/')[-1]
+                with stage('s3_upload', trace_id):
+                    await self.loop.run_in_executor(None, lambda: self.s3_client.upload_fileobj(
+                        io.BytesIO(data), self.S3_BUCKET, img_name, Config=transfer_config()))
+
+                if self.broker:
+                    with stage('job_send', trace_id):
+                        await self.loop.run_in_executor(None, self.send_prediction_job, msg['chat']['id'], img_name,
+                                                        trace_id)
+                    return
+                with stage('yolo5_request', trace_id):
+                    yolo_summary = await self.yolo5_request_async(img_name, trace_id)
+                with stage('send_summary', trace_id):
+                    await self.loop.run_in_executor(None, self.send_summary_to_user, msg['chat']['id'], yolo_summary)
+        finally:
+            self.semaphore.release()
+
+    async def get_user_photo_async(self, msg):
+        """
+        Downloads the photo of the message from Telegram, returns its Telegram file path and its bytes.
+
+        The whole photo is read into memory before its S3 upload: boto3 buffers a non-seekable stream up to
+        the multipart threshold before uploading anything, and photos are well below it, so streaming one into
+        the upload wouldn't overlap the two.
+        """
+        if not self.is_current_msg_photo(msg):
+            raise RuntimeError(f'Message content of type \'photo\' expected')
+
+        async with self.session.get(f'{self.telegram_api_url}/bot{self.token}/getFile',
+                                    params={'file_id': self.select_photo_size(msg)['file_id']}) as response:
+            response.raise_for_status()
+            file_info = await response.json()
+        if not file_info.get('ok'):
+            raise RuntimeError(f'Telegram getFile failed: {file_info.get("description")}')
+        file_path = file_info['result']['file_path']
+        async with self.session.get(f'{self.telegram_api_url}/file/bot{self.token}/{file_path}') as response:
+            response.raise_for_status()
+            return file_path, await response.read()
+
+    async def yolo5_request_async(self, s3_photo_path, trace_id=None):
+        headers = {TRACE_HEADER: trace_id} if trace_id else {}
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.session.post(self.YOLO5_URL, params={'imgName': s3_photo_path},
+                                             headers=headers) as response:
+                    if response.status == 200:
+                        try:
+                            return await response.json(content_type=None)
+                        except json.JSONDecodeError as e:
+                            logger.error(f'Failed to decode JSON response: {e}')
+                            return {"error": "Invalid JSON response from YOLOv5 API"}
+                    if response.status < 500:
+                        # 404 means nothing was detected, retrying wouldn't change that
+                        logger.error(f'Error response from YOLOv5 API: {response.status} - {await response.text()}')
+                        return {"error": f"Error response from YOLOv5 API: {response.status}"}
+                    error = f'status {response.status}'
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = repr(e)
+
+            if attempt < self.retries:
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                logger.warning(f'YOLOv5 API call failed ({error}), retrying in {delay:.2f}s')
+                await asyncio.sleep(delay)
+
+        logger.error(f'YOLOv5 API call failed after {self.retries + 1} attempts ({error})')
+        return {"error": f"YOLOv5 API unavailable: {error}"}
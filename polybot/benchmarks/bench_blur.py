@@ -0,0 +1,51 @@
+"""
+Compares Img.blur (running-sum box blur) with the original nested lists implementation.
+
+Run from the repo root:
+    python -m polybot.benchmarks.bench_blur [--size 200]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from polybot.img_proc import box_blur
+
+
+def list_blur(data, blur_level):
+    filter_sum = blur_level ** 2
+    result = []
+    for i in range(len(data) - blur_level + 1):
+        row_result = []
+        for j in range(len(data[0]) - blur_level + 1):
+            sub_matrix = [row[j:j + blur_level] for row in data[i:i + blur_level]]
+            row_result.append(sum(sum(sub_row) for sub_row in sub_matrix) // filter_sum)
+        result.append(row_result)
+    return result
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=200, help='side of the square test image')
+    parser.add_argument('--levels', type=int, nargs='+', default=[3, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    pixels = np.random.default_rng(0).uniform(0, 255, (args.size, args.size))
+    data = pixels.tolist()
+
+    print(f'{"k":>4} {"lists [s]":>12} {"running sum [s]":>16} {"speedup":>9}')
+    for blur_level in args.levels:
+        list_time, expected = timed(list_blur, data, blur_level)
+        fast_time, actual = timed(box_blur, pixels, blur_level)
+        assert actual.tolist() == expected, f'blur mismatch for k={blur_level}'
+        print(f'{blur_level:>4} {list_time:>12.4f} {fast_time:>16.5f} {list_time / fast_time:>8.0f}x')
+
+
+if __name__ == '__main__':
+    main()
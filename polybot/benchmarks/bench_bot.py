@@ -0,0 +1,85 @@
+"""
+Benchmarks of the bots' `handle_message`, from the webhook message to the reply, with in-process stand-ins
+for Telegram (mocked client), S3 (moto) and yolo5 (canned summary). See conftest.py for how to run them.
+"""
+import itertools
+from unittest.mock import Mock, patch
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from polybot.bot import ImageProcessingBot, ObjectDetectionBot
+
+YOLO_SUMMARY = {
+    'detections': {'class_ids': [0, 0, 16], 'boxes': [0.5, 0.5, 0.2, 0.4] * 3, 'confidences': [0.9, 0.8, 0.7]},
+    'classes': {'person': {'count': 2}, 'dog': {'count': 1}},
+}
+
+_file_ids = itertools.count()
+
+
+def photo_message(caption=None):
+    """
+    A photo message with a new file id, so the filter results cache never answers it.
+    """
+    file_id = next(_file_ids)
+    msg = {
+        'message_id': file_id,
+        'chat': {'id': 1243002838, 'type': 'private'},
+        'photo': [{'file_id': f'file_{file_id}', 'file_unique_id': f'unique_{file_id}'}],
+    }
+    if caption:
+        msg['caption'] = caption
+    return msg
+
+
+def telegram_stand_in(bot, photo):
+    with open(photo.path, 'rb') as f:
+        data = f.read()
+    bot.telegram_bot_client.get_file.side_effect = lambda file_id: Mock(file_path=f'photos/{file_id}.jpeg')
+    bot.telegram_bot_client.download_file.return_value = data
+
+
+@pytest.fixture
+def image_processing_bot(photo, tmp_path, monkeypatch):
+    # the bot downloads photos to photos/ under the working directory
+    monkeypatch.chdir(tmp_path)
+    with patch('telebot.TeleBot'):
+        bot = ImageProcessingBot(token='bot_token', telegram_chat_url='webhook_url')
+    telegram_stand_in(bot, photo)
+    return bot
+
+
+@pytest.fixture
+def object_detection_bot(photo):
+    with mock_aws():
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=ObjectDetectionBot.S3_BUCKET)
+        with patch('telebot.TeleBot'):
+            bot = ObjectDetectionBot(token='bot_token', telegram_chat_url='webhook_url')
+        telegram_stand_in(bot, photo)
+        with patch.object(bot, 'yolo5_request', return_value=YOLO_SUMMARY):
+            yield bot
+
+
+@pytest.mark.parametrize('caption', ['Blur', 'Segment, Rotate'])
+def test_image_processing_bot(benchmark, photo, image_processing_bot, caption):
+    benchmark.group = f'ImageProcessingBot {caption}'
+    benchmark.pedantic(image_processing_bot.handle_message, setup=lambda: ((photo_message(caption),), {}),
+                       rounds=photo.rounds)
+    image_processing_bot.telegram_bot_client.send_photo.assert_called()
+
+
+@pytest.mark.parametrize('caption', ['Blur', 'Segment, Rotate'])
+def test_image_processing_bot_memory(image_processing_bot, peak_memory, caption):
+    # the first message imports matplotlib, which isn't what's measured
+    image_processing_bot.handle_message(photo_message(caption))
+    peak_memory(image_processing_bot.handle_message, photo_message(caption))
+
+
+def test_object_detection_bot(benchmark, photo, object_detection_bot):
+    benchmark.group = 'ObjectDetectionBot'
+    benchmark.pedantic(object_detection_bot.handle_message, setup=lambda: ((photo_message(),), {}),
+                       rounds=photo.rounds)
+    object_detection_bot.telegram_bot_client.send_message.assert_called_with(
+        1243002838, 'Objects detected:\nperson: 2\ndog: 1\n')
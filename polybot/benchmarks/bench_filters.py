@@ -0,0 +1,101 @@
+"""
+Benchmarks of `Img` loading, filters and saving, per photo size. See conftest.py for how to run them.
+"""
+import copy
+
+import numpy as np
+import pytest
+
+from polybot.img_proc import Img, correlate
+
+FILTERS = ['blur', 'contour', 'edges', 'gaussian_blur', 'rotate', 'salt_n_pepper', 'segment', 'sharpen']
+
+
+@pytest.fixture
+def img(photo):
+    return Img(photo.path)
+
+
+def fresh(img):
+    """
+    A copy of `img` to filter, leaving the original pixels for the next round.
+    """
+    img = copy.copy(img)
+    img.pixels = img.pixels.copy()
+    return img
+
+
+@pytest.mark.parametrize('name', FILTERS)
+def test_filter(benchmark, photo, img, name):
+    benchmark.group = name
+    benchmark.pedantic(lambda filtered: getattr(filtered, name)(), setup=lambda: ((fresh(img),), {}),
+                       rounds=photo.rounds)
+
+
+@pytest.mark.parametrize('name', FILTERS)
+def test_filter_memory(photo, img, peak_memory, name):
+    peak_memory(getattr(fresh(img), name))
+
+
+@pytest.mark.parametrize('density', [0.01, 0.4, 1.0])
+def test_salt_n_pepper_density(benchmark, photo, img, density):
+    # half salt, half pepper, seeded so every round draws the same noise
+    benchmark.group = f'salt_n_pepper density {density}'
+    benchmark.pedantic(lambda filtered: filtered.salt_n_pepper(salt=density / 2, pepper=density / 2, seed=0),
+                       setup=lambda: ((fresh(img),), {}), rounds=photo.rounds)
+
+
+@pytest.mark.parametrize('method', ['direct', 'fft'])
+@pytest.mark.parametrize('kernel_size', [3, 5, 7, 11, 15])
+def test_correlate_method(benchmark, photo, img, kernel_size, method):
+    # where FFT overtakes tap by tap correlation, which sets _FFT_MIN_TAPS
+    benchmark.group = f'correlate {kernel_size}x{kernel_size}'
+    kernel = np.random.default_rng(0).random((kernel_size, kernel_size))
+    benchmark.pedantic(correlate, args=(img.pixels, kernel), kwargs={'method': method}, rounds=photo.rounds)
+
+
+@pytest.mark.parametrize('threads', [1, 2, 4, 8])
+@pytest.mark.parametrize('name', ['blur', 'edges', 'segment'])
+def test_threads(benchmark, photos, name, threads):
+    # scaling of the row band threads on the largest photo, flat beyond the machine's cores
+    benchmark.group = f'{name} threads'
+    img = Img(photos['3840x2160'])
+    img.threads = threads
+    benchmark.pedantic(lambda filtered: getattr(filtered, name)(), setup=lambda: ((fresh(img),), {}), rounds=5)
+
+
+def test_pipeline(benchmark, photo, img):
+    benchmark.group = 'pipeline'
+    benchmark.pedantic(lambda filtered: filtered.pipeline().segment().contour().rotate().run(),
+                       setup=lambda: ((fresh(img),), {}), rounds=photo.rounds)
+
+
+def test_load(benchmark, photo):
+    benchmark.group = 'load'
+    benchmark.pedantic(Img, args=(photo.path,), rounds=photo.rounds)
+
+
+def test_load_memory(photo, peak_memory):
+    # the first load imports matplotlib, which isn't what's measured
+    Img(photo.path)
+    peak_memory(Img, photo.path)
+
+
+def test_save(benchmark, photo, img):
+    benchmark.group = 'save'
+    benchmark.pedantic(img.save_img, rounds=photo.rounds)
+    benchmark.extra_info['bytes'] = img.save_img().stat().st_size
+
+
+@pytest.mark.parametrize('format', ['png', 'jpeg'])
+def test_encode(benchmark, photo, img, format):
+    # against test_save, what the bot used to send: time, and bytes sent (in the extra info of --benchmark-json)
+    benchmark.group = 'save'
+    encoded = benchmark.pedantic(img.encode, args=(format,), rounds=photo.rounds)
+    benchmark.extra_info['bytes'] = len(encoded)
+
+
+def test_concat(benchmark, photo, img):
+    benchmark.group = 'concat'
+    benchmark.pedantic(lambda joined: joined.concat(img, img, img, direction='grid'), setup=lambda: ((fresh(img),), {}),
+                       rounds=photo.rounds)
@@ -0,0 +1,84 @@
+"""
+Compares the photo's S3 round trip between polybot and yolo5 through disk files (upload_file / download_file
+and the predicted_ rename) with the in-memory one (upload_fileobj / download_fileobj), against moto's S3.
+
+Run from the repo root (requires moto):
+    python -m polybot.benchmarks.bench_s3_transfer [--requests 50]
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import boto3
+from moto import mock_aws
+
+from polybot.s3_transfer import transfer_config
+
+BUCKET = 'benchmark'
+PHOTO_PATH = os.path.join(os.path.dirname(__file__), '..', 'test', 'beatles.jpeg')
+
+
+def disk_round_trip(s3, data, work_dir, name):
+    """
+    Returns the bytes written to and read from the disk.
+    """
+    # polybot saves the Telegram photo and uploads the file
+    photo_path = os.path.join(work_dir, name)
+    with open(photo_path, 'wb') as f:
+        f.write(data)
+    s3.upload_file(photo_path, BUCKET, name)
+
+    # yolo5 downloads it, reads it and writes the predicted image, renamed around its upload
+    downloaded_path = os.path.join(work_dir, f'downloaded_{name}')
+    s3.download_file(BUCKET, name, downloaded_path)
+    with open(downloaded_path, 'rb') as f:
+        img = f.read()
+    predicted_path = os.path.join(work_dir, name + '.out')
+    with open(predicted_path, 'wb') as f:
+        f.write(img)
+    renamed_path = os.path.join(work_dir, f'predicted_{name}')
+    os.rename(predicted_path, renamed_path)
+    s3.upload_file(renamed_path, BUCKET, f'predicted_{name}')
+    os.rename(renamed_path, predicted_path)
+
+    return 3 * len(data), 3 * len(data)
+
+
+def memory_round_trip(s3, data, work_dir, name):
+    s3.upload_fileobj(io.BytesIO(data), BUCKET, name, Config=transfer_config())
+
+    buffer = io.BytesIO()
+    s3.download_fileobj(BUCKET, name, buffer, Config=transfer_config())
+    s3.upload_fileobj(io.BytesIO(buffer.getbuffer()), BUCKET, f'predicted_{name}', Config=transfer_config())
+
+    return 0, 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    with open(PHOTO_PATH, 'rb') as f:
+        data = f.read()
+
+    print(f'{"path":>8} {"ms/request":>11} {"disk written":>13} {"disk read":>10}')
+    with mock_aws(), tempfile.TemporaryDirectory() as work_dir:
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BUCKET)
+
+        for label, round_trip in [('disk', disk_round_trip), ('memory', memory_round_trip)]:
+            written = read = 0
+            start = time.perf_counter()
+            for i in range(args.requests):
+                request_written, request_read = round_trip(s3, data, work_dir, f'file_{i}.jpg')
+                written += request_written
+                read += request_read
+            elapsed = (time.perf_counter() - start) / args.requests
+            print(f'{label:>8} {elapsed * 1000:>11.2f} {written / 2 ** 20:>10.1f}MiB {read / 2 ** 20:>7.1f}MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+pytest-benchmark suite of the `Img` filters and of the bots' `handle_message` path.
+
+Run from the repo root (bench_*.py files are only collected when given explicitly, so `pytest polybot` skips
+them):
+    python -m pytest polybot/benchmarks/bench_filters.py polybot/benchmarks/bench_bot.py
+
+Timing baselines are kept by pytest-benchmark. Save one on the machine that checks for regressions, then
+compare against it, failing when a median is more than 20% slower:
+    python -m pytest polybot/benchmarks/bench_*.py --benchmark-storage=polybot/benchmarks/.benchmarks \
+        --benchmark-autosave
+    python -m pytest polybot/benchmarks/bench_*.py --benchmark-storage=polybot/benchmarks/.benchmarks \
+        --benchmark-compare --benchmark-compare-fail=median:20%
+
+Peak memory (tracemalloc) doesn't depend on the machine, its baselines are committed in memory_baselines.json
+and checked on every run, failing above MEMORY_REGRESSION_THRESHOLD. Rewrite them with --save-memory-baselines.
+"""
+import collections
+import json
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+MEMORY_BASELINES = Path(__file__).with_name('memory_baselines.json')
+MEMORY_REGRESSION_THRESHOLD = 0.25
+# on top of the threshold, for measurements of a few bytes (e.g. rotate, which returns a view)
+MEMORY_REGRESSION_SLACK = 64 * 1024
+
+# (width, height) from a Telegram thumbnail to 4K
+SIZES = {
+    '90x90': (90, 90),
+    '640x480': (640, 480),
+    '1920x1080': (1920, 1080),
+    '3840x2160': (3840, 2160),
+}
+
+
+def pytest_addoption(parser):
+    parser.addoption('--save-memory-baselines', action='store_true',
+                     help=f'write the measured memory peaks to {MEMORY_BASELINES.name}')
+
+
+def pytest_configure(config):
+    config.memory_baselines = json.loads(MEMORY_BASELINES.read_text()) if MEMORY_BASELINES.exists() else {}
+
+
+def pytest_sessionfinish(session):
+    if session.config.getoption('--save-memory-baselines', default=False):
+        baselines = dict(sorted(session.config.memory_baselines.items()))
+        MEMORY_BASELINES.write_text(json.dumps(baselines, indent=2) + '\n')
+
+
+Photo = collections.namedtuple('Photo', 'path width height rounds')
+
+
+@pytest.fixture(scope='session')
+def photos(tmp_path_factory):
+    """
+    Path of a random RGB JPEG per size name.
+    """
+    directory = tmp_path_factory.mktemp('photos')
+    rng = np.random.default_rng(0)
+    paths = {}
+    for size, (width, height) in SIZES.items():
+        # smooth noise, so the JPEG compresses like a photo rather than like static
+        small = rng.integers(0, 256, (max(1, height // 8), max(1, width // 8), 3), dtype=np.uint8)
+        image = Image.fromarray(small).resize((width, height), Image.BILINEAR)
+        paths[size] = directory / f'{size}.jpeg'
+        image.save(paths[size], quality=90)
+    return paths
+
+
+@pytest.fixture(params=list(SIZES))
+def photo(request, photos):
+    """
+    Parametrizes a benchmark over the photo sizes.
+    """
+    width, height = SIZES[request.param]
+    # enough rounds for a stable median, without spending minutes on 4K images
+    rounds = max(3, min(50, 2_000_000 // (width * height)))
+    return Photo(photos[request.param], width, height, rounds)
+
+
+@pytest.fixture
+def peak_memory(request):
+    """
+    Runs a function under tracemalloc and checks its peak allocation against the stored baseline.
+    """
+    config = request.config
+
+    def measure(func, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            func(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        name = request.node.name
+        if config.getoption('--save-memory-baselines', default=False):
+            config.memory_baselines[name] = peak
+        elif name in config.memory_baselines:
+            baseline = config.memory_baselines[name]
+            assert peak <= baseline * (1 + MEMORY_REGRESSION_THRESHOLD) + MEMORY_REGRESSION_SLACK, \
+                f'peak memory {peak / 2 ** 20:.1f}MiB, baseline {baseline / 2 ** 20:.1f}MiB'
+        return peak
+
+    return measure
@@ -1,23 +1,47 @@
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import telebot
 from loguru import logger
 import os
 import time
 from telebot.types import InputFile
 import requests
-import boto3
 import json
 
+try:
+    from polybot.cache import FilterResultCache
+    from polybot.img_proc import Img
+    from polybot.job_queue import PREDICTION_QUEUE, RESULT_QUEUE, create_broker
+    from polybot.metrics import STAGE_DURATION, TRACE_HEADER, new_trace_id, stage
+    from polybot.prefilter import PreFilter
+    from polybot.s3_transfer import create_s3_client, transfer_config
+except ImportError:
+    # running from within the polybot directory (the service container)
+    from cache import FilterResultCache
+    from img_proc import Img
+    from job_queue import PREDICTION_QUEUE, RESULT_QUEUE, create_broker
+    from metrics import STAGE_DURATION, TRACE_HEADER, new_trace_id, stage
+    from prefilter import PreFilter
+    from s3_transfer import create_s3_client, transfer_config
 
 # from botcore.exceptions import ClientError
 
 
 class Bot:
+    # longer side (in pixels) the bot needs photos to have, the smallest Telegram rendition of the photo with it
+    # is downloaded. None downloads the largest rendition
+    PHOTO_MIN_SIDE = None
 
-    def __init__(self, token, telegram_chat_url):
+    def __init__(self, token, telegram_chat_url, set_webhook=True):
         # create a new instance of the TeleBot class.
         # all communication with Telegram servers are done using self.telegram_bot_client
         self.telegram_bot_client = telebot.TeleBot(token)
 
+        # bots running in worker processes only send messages, the webhook belongs to the main process
+        if not set_webhook:
+            return
+
         # remove any existing webhooks configured in Telegram servers
         self.telegram_bot_client.remove_webhook()
         time.sleep(0.5)
@@ -36,33 +60,59 @@ class Bot:
     def is_current_msg_photo(self, msg):
         return 'photo' in msg
 
-    def download_user_photo(self, msg):
+    def select_photo_size(self, msg):
         """
-        Downloads the photos that sent to the Bot to `photos` directory (should be existed)
-        :return:
+        The rendition (one of `msg['photo']`, the `PhotoSize`s Telegram lists from small to large) to download:
+        the smallest with a longer side of at least `PHOTO_MIN_SIDE`, or the largest if none is as large.
+        """
+        sizes = msg['photo']
+        if self.PHOTO_MIN_SIDE:
+            for size in sorted(sizes, key=lambda size: size.get('width', 0) * size.get('height', 0)):
+                if max(size.get('width', 0), size.get('height', 0)) >= self.PHOTO_MIN_SIDE:
+                    return size
+        return sizes[-1]
+
+    def get_user_photo(self, msg):
+        """
+        Downloads the photo that sent to the Bot into memory
+        :return: the Telegram file path of the photo and its content
         """
         if not self.is_current_msg_photo(msg):
             raise RuntimeError(f'Message content of type \'photo\' expected')
 
-        file_info = self.telegram_bot_client.get_file(msg['photo'][-1]['file_id'])
-        data = self.telegram_bot_client.download_file(file_info.file_path)
-        folder_name = file_info.file_path.split('/')[0]
+        file_info = self.telegram_bot_client.get_file(self.select_photo_size(msg)['file_id'])
+        return file_info.file_path, self.telegram_bot_client.download_file(file_info.file_path)
+
+    def download_user_photo(self, msg):
+        """
+        Downloads the photos that sent to the Bot to `photos` directory (should be existed)
+        :return:
+        """
+        file_path, data = self.get_user_photo(msg)
+        folder_name = file_path.split('/')[0]
 
         if not os.path.exists(folder_name):
             os.makedirs(folder_name)
 
-        with open(file_info.file_path, 'wb') as photo:
+        with open(file_path, 'wb') as photo:
             photo.write(data)
 
-        return file_info.file_path
+        return file_path
 
     def send_photo(self, chat_id, img_path):
-        if not os.path.exists(img_path):
+        """
+        Sends the image file at `img_path`, or the encoded image if `img_path` is bytes.
+        """
+        if isinstance(img_path, bytes):
+            photo = InputFile(io.BytesIO(img_path))
+        elif not os.path.exists(img_path):
             raise RuntimeError("Image path doesn't exist")
+        else:
+            photo = InputFile(img_path)
 
         self.telegram_bot_client.send_photo(
             chat_id,
-            InputFile(img_path)
+            photo
         )
 
     def handle_message(self, msg):
@@ -79,23 +129,245 @@ class QuoteBot(Bot):
             self.send_text_with_quote(msg['chat']['id'], msg["text"], quoted_msg_id=msg["message_id"])
 
 
+class ImageProcessingBot(Bot):
+    # photo captions, in lower case, and the `Img` filter each one applies
+    FILTERS = {
+        'blur': 'blur',
+        'contour': 'contour',
+        'edges': 'edges',
+        'gaussian blur': 'gaussian_blur',
+        'rotate': 'rotate',
+        'salt and pepper': 'salt_n_pepper',
+        'segment': 'segment',
+        'sharpen': 'sharpen',
+    }
+    # album captions joining the album's photos into one, and the `Img.concat` direction of each
+    JOINS = {
+        'concat': 'horizontal',
+        'concat vertical': 'vertical',
+        'collage': 'grid',
+    }
+
+    def __init__(self, token, telegram_chat_url=None, set_webhook=True, cache_size=256, cache_dir=None,
+                 photo_min_side=None, album_wait=1.0, img_threads=1, photo_format='jpeg', photo_quality=75):
+        super().__init__(token, telegram_chat_url, set_webhook)
+        self.cache = FilterResultCache(max_entries=cache_size, cache_dir=cache_dir)
+        # the filtered photo is sent back, by default it's filtered in full resolution
+        self.PHOTO_MIN_SIDE = photo_min_side
+        # threads filtering each photo (`Img.threads`), for large photos on otherwise idle cores
+        self.img_threads = img_threads
+        # filtered photos are sent encoded in memory as 8-bit gray, see `Img.encode`. JPEG at matplotlib's default
+        # quality is what `save_img` used to send, 'png' suits segmented (black and white) photos better
+        self.photo_format = photo_format
+        self.photo_quality = photo_quality
+        self.album_wait = album_wait
+        self._albums = {}
+        self._albums_lock = threading.Lock()
+
+    def parse_filters(self, caption):
+        """
+        Translates a caption like 'Segment, Rotate' to the list of filters to apply, in order.
+        """
+        filters = []
+        for name in caption.split(','):
+            name = name.strip().lower()
+            if name in self.JOINS:
+                raise ValueError(f'\'{name}\' joins the photos of an album, send it as the caption of an album')
+            if name not in self.FILTERS:
+                raise ValueError(f'Unknown filter \'{name}\'')
+            filters.append(self.FILTERS[name])
+        return filters
+
+    def handle_message(self, msg):
+        logger.info(f'Incoming message: {msg}')
+        chat_id = msg['chat']['id']
+
+        if not self.is_current_msg_photo(msg):
+            self.send_text(chat_id, 'Please send a photo with a caption naming the filters to apply, e.g. Rotate')
+            return
+
+        if 'media_group_id' in msg:
+            self.collect_album_message(msg)
+            return
+
+        try:
+            filters = self.parse_filters(msg.get('caption', ''))
+        except ValueError as e:
+            self.send_text(chat_id, f'{e}. Available filters: {", ".join(name.capitalize() for name in self.FILTERS)}')
+            return
+
+        file_unique_id = self.select_photo_size(msg)['file_unique_id']
+        filtered_path = self.cache.get(file_unique_id, filters)
+        if filtered_path is None:
+            img = self.load_img(msg)
+            for name in filters:
+                getattr(img, name)()
+            filtered_path = self.cache.put(file_unique_id, filters, self.encode_img(img), f'.{self.photo_format}')
+
+        logger.info(f'Filters {filters} cache stats: {self.cache.stats()}')
+        self.send_photo(chat_id, filtered_path)
+
+    def load_img(self, msg):
+        # read in memory, the original photo is never written to disk
+        file_path, data = self.get_user_photo(msg)
+        img = Img(file_path, encoded=data)
+        img.threads = self.img_threads
+        return img
+
+    def encode_img(self, img):
+        return img.encode(self.photo_format, self.photo_quality)
+
+    def collect_album_message(self, msg):
+        """
+        Telegram sends each photo of an album as a message of its own, with the album's `media_group_id`. They're
+        collected until none came for `album_wait` seconds, then handled together by `handle_album`.
+        """
+        group_id = msg['media_group_id']
+        with self._albums_lock:
+            messages, timer = self._albums.get(group_id, ([], None))
+            if timer is not None:
+                timer.cancel()
+            messages.append(msg)
+
+            timer = threading.Timer(self.album_wait, self._handle_collected_album, args=(group_id,))
+            timer.daemon = True
+            self._albums[group_id] = (messages, timer)
+            timer.start()
+
+    def _handle_collected_album(self, group_id):
+        with self._albums_lock:
+            # a photo arriving as the timer fired joined the album handled by this timer, the new timer finds none
+            messages, _ = self._albums.pop(group_id, (None, None))
+        if messages is None:
+            return
+        try:
+            self.handle_album(messages)
+        except Exception:
+            logger.exception(f'Failed to handle album {group_id}')
+
+    def handle_album(self, messages):
+        """
+        Applies the caption's filters to every photo of an album, then joins them as the caption says (side by
+        side by default), resizing them to line up. The photos are downloaded in parallel.
+        """
+        messages = sorted(messages, key=lambda msg: msg['message_id'])
+        chat_id = messages[0]['chat']['id']
+        caption = next((msg['caption'] for msg in messages if msg.get('caption')), 'Concat')
+        logger.info(f'Incoming album of {len(messages)} photos: {caption}')
+
+        names = [name.strip().lower() for name in caption.split(',')]
+        joins = [name for name in names if name in self.JOINS] or ['concat']
+        try:
+            if len(joins) > 1:
+                raise ValueError(f'Only one of {", ".join(name.capitalize() for name in self.JOINS)} per album')
+            filter_names = [name for name in names if name not in self.JOINS]
+            filters = self.parse_filters(', '.join(filter_names)) if filter_names else []
+        except ValueError as e:
+            self.send_text(chat_id, f'{e}. Available filters: {", ".join(name.capitalize() for name in self.FILTERS)}')
+            return
+
+        file_unique_ids = ','.join(self.select_photo_size(msg)['file_unique_id'] for msg in messages)
+        steps = filters + [joins[0]]
+        filtered_path = self.cache.get(file_unique_ids, steps)
+        if filtered_path is None:
+            with ThreadPoolExecutor(max_workers=len(messages)) as executor:
+                imgs = list(executor.map(self.load_img, messages))
+            for img in imgs:
+                for name in filters:
+                    getattr(img, name)()
+            imgs[0].concat(*imgs[1:], direction=self.JOINS[joins[0]], fit='resize')
+            filtered_path = self.cache.put(file_unique_ids, steps, self.encode_img(imgs[0]), f'.{self.photo_format}')
+
+        logger.info(f'Album {steps} cache stats: {self.cache.stats()}')
+        self.send_photo(chat_id, filtered_path)
+
+
 class ObjectDetectionBot(Bot):
-    def __init__(self, token, telegram_chat_url=None):
-        super().__init__(token, telegram_chat_url)
-        self.s3_client = boto3.client('s3')
+    S3_BUCKET = "sherman3"
+    YOLO5_URL = os.environ.get('YOLO5_URL', "http://amircontaineryolo:8081/predict")
+    # yolo5 letterboxes photos to its input size, a larger rendition would only cost bandwidth and decoding time
+    PHOTO_MIN_SIDE = int(os.environ.get('YOLO5_IMG_SIZE', 640))
+
+    def __init__(self, token, telegram_chat_url=None, set_webhook=True, job_queue_url=None, prefilter_threshold=None):
+        super().__init__(token, telegram_chat_url, set_webhook)
+        self.s3_client = create_s3_client()
+        # with a job queue, predictions are requested as jobs and their results come back through `consume_results`
+        self.broker = create_broker(job_queue_url) if job_queue_url else None
+        # photos scoring below the threshold are answered without a prediction, see prefilter.py
+        self.prefilter = PreFilter(prefilter_threshold) if prefilter_threshold else None
 
     def handle_message(self, msg):
-        photo_download = self.download_user_photo(msg)
-        s3_bucket = "sherman3"
-        img_name = photo_download.split('/')[-1]
-        self.s3_client.upload_file(photo_download, s3_bucket, img_name)
-        yolo_summary = self.yolo5_request(img_name)
-        print(yolo_summary)
-        self.send_summary_to_user(msg['chat']['id'], yolo_summary)
-
-    def yolo5_request(self, s3_photo_path):
-        yolo5_api = "http://amircontaineryolo:8081/predict"
-        response = requests.post(f"{yolo5_api}?imgName={s3_photo_path}")
+        # the prediction id of this photo in yolo5 too, its stages are logged with it by both services
+        trace_id = new_trace_id()
+        logger.info(f'trace: {trace_id}. photo message {msg["message_id"]} of chat {msg["chat"]["id"]}')
+
+        with stage('handle_message', trace_id):
+            # the photo goes from Telegram to S3 in memory, without touching the disk
+            with stage('telegram_download', trace_id):
+                photo_path, data = self.get_user_photo(msg)
+            if self.prefilter:
+                with stage('prefilter', trace_id):
+                    skip = self.prefilter.should_skip(data)
+                if skip:
+                    logger.info(f'trace: {trace_id}. nothing to detect, prediction skipped. {self.prefilter.stats()}')
+                    with stage('send_summary', trace_id):
+                        self.send_summary_to_user(msg['chat']['id'], {})
+                    return
+            img_name = photo_path.split('/')[-1]
+            with stage('s3_upload', trace_id):
+                self.s3_client.upload_fileobj(io.BytesIO(data), self.S3_BUCKET, img_name, Config=transfer_config())
+
+            if self.broker:
+                with stage('job_send', trace_id):
+                    self.send_prediction_job(msg['chat']['id'], img_name, trace_id)
+                return
+
+            with stage('yolo5_request', trace_id):
+                yolo_summary = self.yolo5_request(img_name, trace_id)
+            print(yolo_summary)
+            with stage('send_summary', trace_id):
+                self.send_summary_to_user(msg['chat']['id'], yolo_summary)
+
+    def send_prediction_job(self, chat_id, img_name, trace_id):
+        self.broker.send(PREDICTION_QUEUE, {'chat_id': chat_id, 'imgName': img_name, 'trace_id': trace_id,
+                                            'sent_at': time.time()})
+
+    def consume_results(self, stop=None, wait_time=1, visibility_timeout=30):
+        """
+        Sends the users the prediction results yolo5 puts in the result queue, until `stop` (an Event) is set.
+
+        Errors never end the loop: a result that fails to be sent stays in the queue and comes back after the
+        visibility timeout, a failed receive (e.g. a locked SQLite database) is retried after `wait_time`.
+        """
+        while stop is None or not stop.is_set():
+            try:
+                messages = self.broker.receive(RESULT_QUEUE, visibility_timeout=visibility_timeout,
+                                               wait_time=wait_time)
+            except Exception:
+                logger.exception('Failed to receive prediction results')
+                time.sleep(wait_time)
+                continue
+
+            for message in messages:
+                try:
+                    self.handle_prediction_result(message.body)
+                except Exception:
+                    logger.exception(f'Failed to send prediction result {message.body} '
+                                     f'(attempt {message.receive_count})')
+                    continue
+                self.broker.delete(RESULT_QUEUE, message.receipt)
+
+    def handle_prediction_result(self, result):
+        logger.info(f'Prediction result: {result}')
+        if 'sent_at' in result:
+            # from the job sent to its result received, through the queues and yolo5
+            STAGE_DURATION.observe(time.time() - result['sent_at'], stage='job_round_trip')
+        with stage('send_summary', result.get('trace_id')):
+            self.send_summary_to_user(result['chat_id'], result['summary'])
+
+    def yolo5_request(self, s3_photo_path, trace_id=None):
+        headers = {TRACE_HEADER: trace_id} if trace_id else {}
+        response = requests.post(f"{self.YOLO5_URL}?imgName={s3_photo_path}", headers=headers)
 
         if response.status_code == 200:
             try:
@@ -108,22 +380,11 @@ class ObjectDetectionBot(Bot):
             return {"error": f"Error response from YOLOv5 API: {response.status_code}"}
 
     def send_summary_to_user(self, chat_id, yolo_summary):
-        if isinstance(yolo_summary, dict) and "labels" in yolo_summary:
-            labels = yolo_summary["labels"]
-            summary_dict = {}
-
-            for label in labels:
-                object_class = label['class']
-
-                if object_class in summary_dict:
-                    summary_dict[object_class]['count'] += 1
-                else:
-                    summary_dict[object_class] = {'count': 1}
-
+        # yolo5 sends the detections already aggregated per class, most detected first
+        if isinstance(yolo_summary, dict) and yolo_summary.get("classes"):
             summary_str = "Objects detected:\n"
-            for object_class, info in summary_dict.items():
-                count = info['count']
-                summary_str += f"{object_class}: {count}\n"
+            for object_class, info in yolo_summary["classes"].items():
+                summary_str += f"{object_class}: {info['count']}\n"
 
             self.send_text(chat_id, summary_str)
         else:
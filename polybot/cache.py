@@ -0,0 +1,98 @@
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+class FilterResultCache:
+    """
+    LRU cache of filtered images, keyed by Telegram's `file_unique_id` of the photo and the chain of
+    filters applied to it, so a repeated request skips both the download and the filtering.
+
+    Cached files are renamed after their key, next to where the filters saved them, and live as long as the
+    process. With `cache_dir` they are moved there instead, and the cache survives restarts and is shared by
+    processes using the same directory. Encoded images (bytes) are kept in memory, or written to `cache_dir`.
+    The cache is thread safe (album photos are filtered on a thread pool).
+    """
+
+    def __init__(self, max_entries=256, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            for path in sorted(self.cache_dir.iterdir(), key=os.path.getmtime):
+                self._entries[path.stem] = path
+            self._evict()
+
+    @staticmethod
+    def key(file_unique_id, filters):
+        return hashlib.sha1(f'{file_unique_id}:{",".join(filters)}'.encode()).hexdigest()
+
+    def get(self, file_unique_id, filters):
+        """
+        Returns the cached result (a path, or bytes), or None.
+        """
+        key = self.key(file_unique_id, filters)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self.cache_dir:
+                # may have been added by another process
+                entry = next(self.cache_dir.glob(f'{key}.*'), None)
+
+            if entry is None or (isinstance(entry, Path) and not entry.exists()):
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, file_unique_id, filters, result, suffix=''):
+        """
+        Caches a result and returns it. A file saved at `result` is moved into the cache and its new path is
+        returned. Encoded image bytes (`suffix` being their file extension, e.g. '.png') are returned as is, and kept
+        in memory, or written to `cache_dir`.
+        """
+        key = self.key(file_unique_id, filters)
+        with self._lock:
+            if isinstance(result, bytes):
+                entry = result
+                if self.cache_dir:
+                    entry = self.cache_dir / f'{key}{suffix}'
+                    entry.write_bytes(result)
+            else:
+                result = Path(result)
+                cache_dir = self.cache_dir or result.parent
+                result = entry = Path(shutil.move(result, cache_dir / f'{key}{result.suffix}'))
+
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict()
+        return result
+
+    def _evict(self):
+        # called with the lock held, or before the cache is shared
+        while len(self._entries) > self.max_entries:
+            _, entry = self._entries.popitem(last=False)
+            if isinstance(entry, Path):
+                entry.unlink(missing_ok=True)
+
+    def stats(self):
+        with self._lock:
+            hits, misses, entries = self.hits, self.misses, len(self._entries)
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'entries': entries,
+            'hit_ratio': hits / lookups if lookups else 0.0,
+        }
@@ -1,7 +1,15 @@
-from random import random
+import functools
+import io
+import math
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
-import boto3
-import pymongo
+import numpy as np
+from PIL import Image
+
+# matplotlib is imported where images are read and written, not with the module: it's most of its import
+# time and processes that only import `Img` (e.g. the object detection bot) never need it
 
 
 def rgb2gray(rgb):
@@ -10,79 +18,816 @@ def rgb2gray(rgb):
     return gray
 
 
+def _gamma(n):
+    # worst-case relative error bound of a sequential float64 sum of n terms
+    u = np.finfo(np.float64).eps / 2
+    return n * u / (1 - n * u)
+
+
+def _window_sums(pixels, window_height, window_width):
+    """
+    Sums of every `window_height x window_width` window over the valid region of `pixels`.
+
+    Uses a separable running sum (row prefix sums, then column prefix sums), so the cost per
+    window is O(1) regardless of the window size. Integer valued images are summed in int64, which is exact.
+    """
+    height, width = pixels.shape
+    integral = np.all(pixels == np.floor(pixels)) and np.abs(pixels).sum() < 2 ** 53
+    dtype = np.int64 if integral else np.float64
+    values = pixels.astype(dtype, copy=False)
+
+    row_prefix = np.zeros((height, width + 1), dtype=dtype)
+    np.cumsum(values, axis=1, out=row_prefix[:, 1:])
+    row_sums = row_prefix[:, window_width:] - row_prefix[:, :-window_width]
+
+    col_prefix = np.zeros((height + 1, row_sums.shape[1]), dtype=dtype)
+    np.cumsum(row_sums, axis=0, out=col_prefix[1:])
+    return col_prefix[window_height:] - col_prefix[:-window_height], integral
+
+
+# the smallest band of rows worth a thread of its own
+_MIN_BAND_PIXELS = 1 << 16
+
+
+def _row_bands(height, width, threads):
+    """
+    Splits `height` rows into up to `threads` bands (start, stop) of similar size, fewer for small images.
+    """
+    count = max(1, min(threads, height * width // _MIN_BAND_PIXELS, height))
+    bounds = [height * i // count for i in range(count + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _run_bands(bands, band_task):
+    """
+    Runs `band_task(start, stop)` for every band on a thread of its own. numpy releases the GIL in its array
+    operations, so the bands run on as many cores.
+    """
+    with ThreadPoolExecutor(len(bands), thread_name_prefix='img-band') as executor:
+        # consumed, so an exception in a band is raised here
+        list(executor.map(lambda band: band_task(*band), bands))
+
+
+def box_blur(pixels, size, threads=1):
+    """
+    Floor-divided mean of every `size x size` window (valid region only).
+
+    The result is bit for bit the one of summing each window with Python's `sum` row by row, which is
+    how `Img.blur` used to work: float windows whose running sum lies within the rounding error bound
+    of a multiple of `size ** 2` are re-summed that way, every other window has the same floor anyway.
+    Every window being exact, blurring bands of rows on `threads` threads gives the same result.
+    """
+    height, width = pixels.shape
+    if height < size or width < size:
+        return np.empty((max(height - size + 1, 0), max(width - size + 1, 0)))
+
+    bands = _row_bands(height - size + 1, width - size + 1, threads)
+    if len(bands) > 1:
+        out = np.empty((height - size + 1, width - size + 1))
+
+        def blur_band(start, stop):
+            # the band and the `size - 1` rows below it
+            out[start:stop] = box_blur(pixels[start:stop + size - 1], size)
+
+        _run_bands(bands, blur_band)
+        return out
+
+    area = size ** 2
+    sums, integral = _window_sums(pixels, size, size)
+    result = (sums // area).astype(np.float64)
+    if integral:
+        return result
+
+    magnitude = float(np.abs(pixels).max())
+    row_error = 2 * _gamma(width) * width * magnitude + _gamma(1) * size * magnitude
+    tolerance = (size * row_error
+                 + 2 * _gamma(height) * height * size * magnitude
+                 + _gamma(1) * area * magnitude
+                 + 2 * _gamma(size) * area * magnitude)
+    distance = np.abs(sums - area * np.round(sums / area))
+    ambiguous = distance <= 2 * tolerance + 4 * np.spacing(np.abs(sums))
+
+    for i, j in zip(*np.nonzero(ambiguous)):
+        sub_matrix = pixels[i:i + size, j:j + size].tolist()
+        result[i, j] = sum(sum(sub_row) for sub_row in sub_matrix) // area
+
+    return result
+
+
+# The kernel filters correlate the pixels with a kernel (like cv2.filter2D, i.e. the kernel is not flipped)
+BORDERS = ('valid', 'constant', 'edge', 'reflect', 'symmetric', 'wrap')
+CONTOUR_KERNEL = np.array([[-1, 1]], dtype=np.float64)
+SHARPEN_KERNEL = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]], dtype=np.float64)
+# horizontal gradients, their transposes are the vertical ones
+GRADIENT_KERNELS = {
+    'sobel': np.array([[-1, 0, 1], [-2, 0, 2], [-1, 0, 1]], dtype=np.float64),
+    'scharr': np.array([[-3, 0, 3], [-10, 0, 10], [-3, 0, 3]], dtype=np.float64),
+}
+# multiply-adds per pixel above which a kernel is applied by FFT rather than tap by tap
+_FFT_MIN_TAPS = 32
+
+
+def gaussian_kernel(sigma, radius=None):
+    """
+    Normalized 2D Gaussian of standard deviation `sigma`, `2 * radius + 1` wide (by default 3 sigmas each side).
+    """
+    if sigma <= 0:
+        raise ValueError(f'sigma must be positive, got {sigma}')
+    radius = math.ceil(3 * sigma) if radius is None else radius
+    x = np.arange(-radius, radius + 1)
+    weights = np.exp(-x ** 2 / (2 * sigma ** 2))
+    weights /= weights.sum()
+    return np.outer(weights, weights)
+
+
+def _border_padding(kernel_shape, border):
+    # rows above/below and columns left/right of the image a kernel reads, centered (rounded up-left)
+    if border == 'valid':
+        return (0, 0), (0, 0)
+    kernel_height, kernel_width = kernel_shape
+    return ((kernel_height - 1) // 2, kernel_height // 2), ((kernel_width - 1) // 2, kernel_width // 2)
+
+
+def _border_indices(size, before, after, border):
+    """
+    For an axis of `size` pixels padded with `before` and `after` pixels, the index of the pixel each padded
+    position reads, and whether the position is inside the image (outside ones are the fill with 'constant').
+    The border modes are numpy.pad's.
+    """
+    if border not in BORDERS:
+        raise ValueError(f'Unknown border \'{border}\', expected one of {", ".join(BORDERS)}')
+    positions = np.arange(-before, size + after)
+    inside = (positions >= 0) & (positions < size)
+    if border == 'wrap':
+        indices = positions % size
+    elif border == 'symmetric':
+        indices = positions % (2 * size)
+        indices = np.where(indices >= size, 2 * size - 1 - indices, indices)
+    elif border == 'reflect':
+        period = max(2 * size - 2, 1)
+        indices = positions % period
+        indices = np.where(indices >= size, period - indices, indices)
+    else:
+        indices = np.clip(positions, 0, size - 1)
+    return indices, inside
+
+
+def _take_padded(pixels, rows, cols, border, fill=0.0):
+    # `rows` and `cols` are `_border_indices` results, the rows are read first so a memmap only reads those
+    (row_indices, rows_inside), (col_indices, cols_inside) = rows, cols
+    padded = np.asarray(pixels[row_indices])[:, col_indices]
+    if border == 'constant':
+        padded[~rows_inside] = fill
+        padded[:, ~cols_inside] = fill
+    return padded
+
+
+def _pad(pixels, kernel_shape, border, fill=0.0):
+    (top, bottom), (left, right) = _border_padding(kernel_shape, border)
+    if not (top or bottom or left or right):
+        return pixels
+    height, width = pixels.shape
+    return _take_padded(pixels, _border_indices(height, top, bottom, border),
+                        _border_indices(width, left, right, border), border, fill)
+
+
+def _separate(kernel):
+    """
+    Returns the column and the row whose outer product is `kernel`, or None if it isn't separable.
+    """
+    i, j = np.unravel_index(np.argmax(np.abs(kernel)), kernel.shape)
+    pivot = kernel[i, j]
+    if pivot == 0:
+        return None
+    column, row = kernel[:, j] / pivot, kernel[i]
+    if np.allclose(np.outer(column, row), kernel, rtol=0, atol=1e-12 * abs(pivot)):
+        return column, row
+    return None
+
+
+def _fft_size(n):
+    # the smallest 2^a * 3^b * 5^c >= n, the sizes FFTs are fastest on
+    size = n
+    while True:
+        m = size
+        for factor in (2, 3, 5):
+            while m % factor == 0:
+                m //= factor
+        if m == 1:
+            return size
+        size += 1
+
+
+def _correlate_direct(pixels, kernel):
+    # one shifted multiply-add per non zero tap
+    kernel_height, kernel_width = kernel.shape
+    out_height, out_width = pixels.shape[0] - kernel_height + 1, pixels.shape[1] - kernel_width + 1
+    out = np.zeros((out_height, out_width))
+    term = np.empty_like(out)
+    for (i, j), weight in np.ndenumerate(kernel):
+        if weight:
+            np.multiply(pixels[i:i + out_height, j:j + out_width], weight, out=term)
+            out += term
+    return out
+
+
+def _correlate_fft(pixels, kernel):
+    # a circular convolution with the flipped kernel, whose valid region doesn't wrap around
+    kernel_height, kernel_width = kernel.shape
+    height, width = pixels.shape
+    shape = (_fft_size(height), _fft_size(width))
+    spectrum = np.fft.rfft2(pixels, shape) * np.fft.rfft2(kernel[::-1, ::-1], shape)
+    return np.ascontiguousarray(np.fft.irfft2(spectrum, shape)[kernel_height - 1:height, kernel_width - 1:width])
+
+
+def _choose_method(kernel):
+    if np.all(kernel == kernel.flat[0]):
+        return 'box'
+    factors = _separate(kernel) if min(kernel.shape) > 1 else None
+    taps = np.count_nonzero(kernel)
+    if factors is not None:
+        taps = min(taps, sum(np.count_nonzero(factor) for factor in factors))
+    if taps > _FFT_MIN_TAPS:
+        return 'fft'
+    return 'separable' if factors is not None and taps < np.count_nonzero(kernel) else 'direct'
+
+
+def correlate(pixels, kernel, border='valid', method='auto', fill=0.0):
+    """
+    Correlates 2D `pixels` with `kernel` (a 2D array, or 1D for a single row).
+
+    `border` is 'valid' (only where the kernel fits in the image, so the result is smaller) or one of the
+    numpy.pad modes the image is extended with to keep its size: 'constant' (with `fill`), 'edge', 'reflect',
+    'symmetric' or 'wrap'.
+
+    `method` 'auto' picks by the cost per pixel: running sums for constant (box) kernels, a pass per
+    factor for separable kernels, tap by tap for small kernels and FFT for large ones. 'box', 'separable',
+    'direct' or 'fft' force a method.
+    """
+    pixels = np.asarray(pixels, dtype=np.float64)
+    kernel = np.atleast_2d(np.asarray(kernel, dtype=np.float64))
+    if kernel.ndim != 2 or kernel.size == 0:
+        raise ValueError(f'Expected a non empty 2D kernel, got shape {kernel.shape}')
+
+    (top, bottom), (left, right) = _border_padding(kernel.shape, border)
+    out_shape = (max(pixels.shape[0] + top + bottom - kernel.shape[0] + 1, 0),
+                 max(pixels.shape[1] + left + right - kernel.shape[1] + 1, 0))
+    if pixels.size == 0 or 0 in out_shape:
+        return np.empty(out_shape)
+    padded = _pad(pixels, kernel.shape, border, fill)
+
+    if method == 'auto':
+        method = _choose_method(kernel)
+    if method == 'box':
+        if not np.all(kernel == kernel.flat[0]):
+            raise ValueError('The box method needs a kernel of equal weights')
+        sums, _ = _window_sums(padded, *kernel.shape)
+        return sums * kernel.flat[0]
+    if method == 'separable':
+        factors = _separate(kernel)
+        if factors is None:
+            raise ValueError('The separable method needs a kernel of rank 1')
+        column, row = factors
+        return _correlate_direct(_correlate_direct(padded, column[:, np.newaxis]), row[np.newaxis])
+    if method == 'direct':
+        return _correlate_direct(padded, kernel)
+    if method == 'fft':
+        return _correlate_fft(padded, kernel)
+    raise ValueError(f'Unknown method \'{method}\', expected \'auto\', \'box\', \'separable\', \'direct\' or \'fft\'')
+
+
+def _apply_kernels(pixels, kernels, border, combine=None, threads=1):
+    """
+    Correlates the pixels with each of `kernels` (all of the same shape), padded once, and returns
+    `combine(*responses)`, or the single response without `combine`.
+
+    With `threads`, bands of output rows are filtered in parallel when the kernels are applied tap by tap
+    (directly or separated), where each output pixel is computed the same way whatever the band. Box sums
+    and FFTs depend on the extent they run over, those kernels are applied to the whole image.
+    """
+    padded = _pad(pixels, np.shape(kernels[0]), border)
+    kernel_height, kernel_width = np.shape(kernels[0])
+    out_shape = (padded.shape[0] - kernel_height + 1, padded.shape[1] - kernel_width + 1)
+    bands = _row_bands(*out_shape, threads) if min(out_shape) > 0 else []
+    if len(bands) > 1 and all(_choose_method(np.asarray(kernel)) in ('direct', 'separable') for kernel in kernels):
+        out = np.empty(out_shape)
+
+        def filter_band(start, stop):
+            out[start:stop] = _apply_kernels(padded[start:stop + kernel_height - 1], kernels, 'valid', combine)
+
+        _run_bands(bands, filter_band)
+        return out
+
+    responses = [correlate(padded, kernel) for kernel in kernels]
+    return responses[0] if combine is None else combine(*responses)
+
+
+def _clip_intensity(pixels):
+    # back to the 0-255 range of the loaded images, so sharpening overshoots don't rescale the saved image
+    return np.clip(pixels, 0, 255, out=pixels)
+
+
+# the filters built on `_apply_kernels`, by name
+_KERNEL_FILTERS = ('contour', 'edges', 'sharpen', 'gaussian_blur')
+
+
+def _kernel_filter(name, **kwargs):
+    """
+    The `_apply_kernels` arguments (kernels, border and combine) of a kernel filter.
+    """
+    if name == 'contour':
+        return [CONTOUR_KERNEL], 'valid', np.abs
+    if name == 'edges':
+        if kwargs['operator'] not in GRADIENT_KERNELS:
+            raise ValueError(f'Unknown operator \'{kwargs["operator"]}\', expected one of '
+                             f'{", ".join(GRADIENT_KERNELS)}')
+        kernel = GRADIENT_KERNELS[kwargs['operator']]
+        return [kernel, kernel.T], kwargs['border'], np.hypot
+    if name == 'sharpen':
+        return [SHARPEN_KERNEL], kwargs['border'], _clip_intensity
+    if name == 'gaussian_blur':
+        return [gaussian_kernel(kwargs['sigma'])], kwargs['border'], None
+    raise ValueError(f'Unknown kernel filter \'{name}\'')
+
+
+# 8-bit intensities of matplotlib's 'gray' colormap, the one `Img.save_img` renders with: a linear ramp, so
+# encoding never has to import matplotlib
+_GRAY_LUT = (np.linspace(0, 1, 256) * 255).astype(np.uint8)
+
+
+def _to_gray8(pixels, vmin, vmax):
+    """
+    Maps pixels to the 8-bit intensities the 'gray' colormap gives them over [vmin, vmax].
+    """
+    if vmax == vmin:
+        return np.full(pixels.shape, _GRAY_LUT[0], dtype=np.uint8)
+    # in place on a single temporary, the same operations as floor((pixels - vmin) / (vmax - vmin) * 256)
+    levels = np.subtract(pixels, vmin, dtype=np.float64)
+    levels /= vmax - vmin
+    levels *= 256
+    np.floor(levels, out=levels)
+    np.clip(levels, 0, 255, out=levels)
+    return _GRAY_LUT[levels.astype(np.uint8)]
+
+
+# `Img.encode` formats, by name, and the PIL encoder options of each
+_ENCODINGS = {
+    # zlib level 1: most of the size of the default level 6 at a fraction of the time, gray images compress well
+    'png': ('PNG', lambda quality: {'compress_level': 1}),
+    'jpeg': ('JPEG', lambda quality: {'quality': quality}),
+}
+
+
+def _encode_gray8(gray, format, quality):
+    """
+    Encodes 8-bit grayscale pixels as a single channel PNG or JPEG, in memory.
+    """
+    if format not in _ENCODINGS:
+        raise ValueError(f'Unknown format \'{format}\', expected one of {", ".join(_ENCODINGS)}')
+    pil_format, options = _ENCODINGS[format]
+    buffer = io.BytesIO()
+    Image.fromarray(gray, mode='L').save(buffer, pil_format, **options(quality))
+    return buffer.getvalue()
+
+
+# rows per block when fusing pointwise filters, sized so a block stays in the CPU cache
+_FUSED_BLOCK_BYTES = 1 << 18
+
+
+def _segment(pixels):
+    mask = pixels > 100
+    pixels[mask] = 255
+    pixels[~mask] = 0
+
+
+def _salt_n_pepper(pixels, salt=0.2, pepper=0.2, rng=None):
+    """
+    Turns a `salt` fraction of the pixels white and a `pepper` fraction black, from one uniform draw per pixel.
+    Drawing row block after row block from the same `rng` gives the same noise as a single draw, so the result
+    only depends on the seed, not on how the image is split.
+    """
+    random_values = (np.random if rng is None else rng).random(pixels.shape)
+    pixels[random_values < salt] = 255  # Salt
+    pixels[random_values > 1 - pepper] = 0  # Pepper
+
+
+def _noise_rng(salt, pepper, seed):
+    if not (0 <= salt and 0 <= pepper and salt + pepper <= 1):
+        raise ValueError(f'Salt and pepper densities must be fractions adding up to at most 1, got {salt} and {pepper}')
+    return np.random.default_rng(seed)
+
+
+def _apply_pointwise(pixels, filters, threads=1):
+    """
+    Applies a run of pointwise filters in place, block of rows by block of rows,
+    so the whole run is a single pass over the image memory. With `threads`, bands of rows run in parallel.
+    """
+    if pixels.size == 0:
+        return
+    bands = _row_bands(*pixels.shape, threads)
+    if len(bands) > 1:
+        _run_bands(bands, lambda start, stop: _apply_pointwise(pixels[start:stop], filters))
+        return
+    rows = max(1, _FUSED_BLOCK_BYTES // (pixels.shape[1] * pixels.itemsize))
+    for start in range(0, pixels.shape[0], rows):
+        block = pixels[start:start + rows]
+        for pointwise_filter in filters:
+            pointwise_filter(block)
+
+
+def _resize(pixels, height, width):
+    # bilinear, in float32 (PIL's 'F' mode)
+    resized = Image.fromarray(np.asarray(pixels, dtype=np.float32)).resize((width, height), Image.BILINEAR)
+    return np.asarray(resized, dtype=np.float64)
+
+
+def collage(images, columns, fit='pad', fill=0.0):
+    """
+    Joins 2D pixel arrays into a grid of `columns` columns, row by row, in one preallocated buffer.
+
+    Rows are as high as their highest image and columns as wide as their widest one. With `fit='pad'` smaller
+    images are centered in their cell on a `fill` background. With `fit='resize'` they're first scaled, keeping
+    their aspect ratio: a single row to a common height, a single column to a common width, a grid to fit the
+    largest cell.
+    """
+    if fit not in ('pad', 'resize'):
+        raise ValueError(f'Unknown fit \'{fit}\', expected \'pad\' or \'resize\'')
+    images = [np.asarray(image, dtype=np.float64) for image in images]
+    if not images:
+        raise ValueError('Nothing to join')
+    columns = max(1, min(columns, len(images)))
+    rows = math.ceil(len(images) / columns)
+
+    if fit == 'resize':
+        max_height = max(image.shape[0] for image in images)
+        max_width = max(image.shape[1] for image in images)
+        resized = []
+        for image in images:
+            height, width = image.shape
+            if rows == 1:
+                scale = max_height / height
+            elif columns == 1:
+                scale = max_width / width
+            else:
+                scale = min(max_height / height, max_width / width)
+            target = (max(1, round(height * scale)), max(1, round(width * scale)))
+            resized.append(image if target == image.shape else _resize(image, *target))
+        images = resized
+
+    cells = [images[row * columns:(row + 1) * columns] for row in range(rows)]
+    row_heights = [max(image.shape[0] for image in row) for row in cells]
+    column_widths = [max(image.shape[1] for image in images[column::columns]) for column in range(columns)]
+
+    out = np.full((sum(row_heights), sum(column_widths)), fill, dtype=np.float64)
+    top = 0
+    for row, row_height in zip(cells, row_heights):
+        left = 0
+        for image, column_width in zip(row, column_widths):
+            height, width = image.shape
+            y, x = top + (row_height - height) // 2, left + (column_width - width) // 2
+            out[y:y + height, x:x + width] = image
+            left += column_width
+        top += row_height
+    return out
+
+
 class Img:
+    # threads filtering bands of rows in parallel (blur, segment and the kernel filters), set it per image
+    # e.g. `img.threads = 8`. The results are the same as with a single thread
+    threads = 1
 
-    def __init__(self, path):
+    def __init__(self, path, encoded=None):
         """
-        Do not change the constructor implementation
+        The grayscale pixels are kept in `self.pixels`, a 2D float64 numpy array.
+        `self.data` is still available as a nested-lists view of the same pixels.
+
+        With `encoded`, the bytes of the image file (e.g. a photo downloaded into memory), the image is read from
+        them instead of from `path`, which still names it: its suffix gives the format.
         """
+        from matplotlib.image import imread
+
         self.path = Path(path)
-        self.data = rgb2gray(imread(path)).tolist()
+        if encoded is not None:
+            path = io.BytesIO(encoded)
+        self.pixels = np.asarray(rgb2gray(imread(path, format=self.path.suffix[1:] or None)), dtype=np.float64)
+
+    @property
+    def data(self):
+        """
+        Compatibility view: the pixels as a list of rows (lists of floats).
+        The lists are a snapshot, mutating them does not change the image - assign `self.data` instead.
+        """
+        return self.pixels.tolist()
+
+    @data.setter
+    def data(self, value):
+        self.pixels = np.asarray(value, dtype=np.float64)
+
+    def pipeline(self):
+        """
+        Starts a lazy chain of filters on this image, e.g. `img.pipeline().segment().contour().rotate().run()`
+        """
+        return Pipeline(self)
 
     def save_img(self):
         """
         Do not change the below implementation
         """
+        from matplotlib.image import imsave
+
         new_path = self.path.with_name(self.path.stem + '_filtered' + self.path.suffix)
-        imsave(new_path, self.data, cmap='gray')
+        imsave(new_path, self.pixels, cmap='gray')
         return new_path
 
+    def encode(self, format='png', quality=75):
+        """
+        The image as PNG or JPEG (of JPEG `quality`) bytes, with the intensities of `save_img` in a single 8-bit
+        gray channel rather than the RGBA colors matplotlib renders. Nothing is written to disk.
+        """
+        return _encode_gray8(self._gray8(), format, quality)
+
+    def _gray8(self):
+        if self.pixels.size == 0:
+            return np.zeros(self.pixels.shape, dtype=np.uint8)
+        return _to_gray8(self.pixels, self.pixels.min(), self.pixels.max())
+
     def blur(self, blur_level=16):
+        self.pixels = box_blur(self.pixels, blur_level, self.threads)
+
+    def contour(self):
+        self._apply_kernels(*_kernel_filter('contour'))
+
+    def edges(self, operator='sobel', border='reflect'):
+        """
+        Gradient magnitude by the 'sobel' or 'scharr' operator.
+        """
+        self._apply_kernels(*_kernel_filter('edges', operator=operator, border=border))
 
-        height = len(self.data)
-        width = len(self.data[0])
-        filter_sum = blur_level ** 2
+    def sharpen(self, border='reflect'):
+        self._apply_kernels(*_kernel_filter('sharpen', border=border))
 
-        result = []
-        for i in range(height - blur_level + 1):
-            row_result = []
-            for j in range(width - blur_level + 1):
-                sub_matrix = [row[j:j + blur_level] for row in self.data[i:i + blur_level]]
-                average = sum(sum(sub_row) for sub_row in sub_matrix) // filter_sum
-                row_result.append(average)
-            result.append(row_result)
+    def gaussian_blur(self, sigma=2.0, border='reflect'):
+        self._apply_kernels(*_kernel_filter('gaussian_blur', sigma=sigma, border=border))
 
-        self.data = result
+    def _apply_kernels(self, kernels, border, combine=None):
+        self.pixels = _apply_kernels(self.pixels, kernels, border, combine, self.threads)
+
+    def rotate(self):
+        # counter-clockwise, returns a view so no pixels are copied
+        self.pixels = np.rot90(self.pixels)
+
+    def salt_n_pepper(self, salt=0.2, pepper=0.2, seed=None):
+        """
+        `seed` (an int or a `numpy.random.Generator`) makes the noise reproducible, the same seed gives the same
+        pixels here, in a `Pipeline` and in a `TiledImg`.
+        """
+        rng = _noise_rng(salt, pepper, seed)
+        _apply_pointwise(self.pixels, [functools.partial(_salt_n_pepper, salt=salt, pepper=pepper, rng=rng)])
+
+    def concat(self, *other_imgs, direction='horizontal', fit=None, columns=None):
+        """
+        Joins this image with `other_imgs`, in order: side by side ('horizontal'), one above the other ('vertical')
+        or in a 'grid' of `columns` columns (by default as square as possible).
+
+        Without `fit` the images must line up (same heights side by side, same widths one above the other),
+        otherwise a RuntimeError is raised. `fit='pad'` or `fit='resize'` joins any sizes, see `collage`.
+        """
+        images = [self.pixels] + [img.pixels for img in other_imgs]
+        if direction == 'horizontal':
+            columns, matching = len(images), 0
+        elif direction == 'vertical':
+            columns, matching = 1, 1
+        elif direction == 'grid':
+            columns, matching = columns or math.ceil(math.sqrt(len(images))), None
+        else:
+            raise ValueError(f'Unknown direction \'{direction}\', expected \'horizontal\', \'vertical\' or \'grid\'')
+
+        if fit is None:
+            sizes = {image.shape if matching is None else image.shape[matching] for image in images}
+            if len(sizes) > 1:
+                raise RuntimeError(f'Cannot concatenate images of sizes {[image.shape for image in images]} '
+                                   f'({direction}), pass fit=\'pad\' or fit=\'resize\' to join them anyway')
+        self.pixels = collage(images, columns, fit=fit or 'pad')
+
+    def segment(self):
+        _apply_pointwise(self.pixels, [_segment], self.threads)
+
+
+class Pipeline:
+    """
+    Records `Img` filters and applies them only on `run()`, `compute()` or `save_img()`.
+
+    Consecutive pointwise filters (segment, salt_n_pepper) are fused into one pass over the pixels.
+    Rotations never move pixels: the pipeline keeps the buffer in its original orientation, tracks
+    the number of quarter turns, turns the kernels of the kernel filters (contour, edges...) to match
+    (blur is rotation invariant) and returns a rotated view at the end.
+    """
+
+    def __init__(self, img):
+        self.img = img
+        self.steps = []
+
+    def _add(self, name, **kwargs):
+        self.steps.append((name, kwargs))
+        return self
+
+    def blur(self, blur_level=16):
+        return self._add('blur', blur_level=blur_level)
 
     def contour(self):
-        for i, row in enumerate(self.data):
-            res = []
-            for j in range(1, len(row)):
-                res.append(abs(row[j-1] - row[j]))
+        return self._add('contour')
+
+    def edges(self, operator='sobel', border='reflect'):
+        _kernel_filter('edges', operator=operator, border=border)
+        return self._add('edges', operator=operator, border=border)
+
+    def sharpen(self, border='reflect'):
+        return self._add('sharpen', border=border)
 
-            self.data[i] = res
+    def gaussian_blur(self, sigma=2.0, border='reflect'):
+        _kernel_filter('gaussian_blur', sigma=sigma, border=border)
+        return self._add('gaussian_blur', sigma=sigma, border=border)
 
     def rotate(self):
-        height = len(self.data)
-        width = len(self.data[0])
-        rotated_data = [[0] * height for _ in range(width)]
-        for y in range(height):
-            for x in range(width):
-                rotated_data[x][y] = self.data[y][width - x - 1]
-        self.data = rotated_data
-
-    def salt_n_pepper(self):
-        height = len(self.data)
-        width = len(self.data[0])
-        for y in range(height):
-            for x in range(width):
-                random_value = random.random()
-                if random_value < 0.2:
-                    self.data[y][x] = 255  # Salt
-                elif random_value > 0.8:
-                    self.data[y][x] = 0    # Pepper
-
-    def concat(self, other_img):
-        # TODO remove the `raise` below, and write your implementation
-        raise NotImplementedError()
+        return self._add('rotate')
+
+    def salt_n_pepper(self, salt=0.2, pepper=0.2, seed=None):
+        _noise_rng(salt, pepper, seed)
+        return self._add('salt_n_pepper', salt=salt, pepper=pepper, seed=seed)
+
+    def segment(self):
+        return self._add('segment')
+
+    def compute(self):
+        """
+        Returns the filtered pixels without changing the image.
+        When only rotations are queued, the result is a view on `img.pixels`.
+        """
+        return self._evaluate(self.img.pixels, owned=False)
+
+    def run(self):
+        """
+        Applies the queued filters to the image (reusing its buffer where possible) and returns it.
+        """
+        self.img.pixels = self._evaluate(self.img.pixels, owned=True)
+        self.steps = []
+        return self.img
+
+    def save_img(self):
+        return self.run().save_img()
+
+    def _evaluate(self, pixels, owned):
+        quarter_turns = 0
+        pending = []
+
+        for name, kwargs in self.steps + [(None, {})]:
+            if name == 'salt_n_pepper':
+                # a generator per evaluation, so evaluating the pipeline again gives the same noise
+                rng = _noise_rng(kwargs['salt'], kwargs['pepper'], kwargs['seed'])
+                pending.append(functools.partial(_salt_n_pepper, salt=kwargs['salt'], pepper=kwargs['pepper'],
+                                                 rng=rng))
+                continue
+            if name == 'segment':
+                # segmenting twice in a row is the same as segmenting once
+                if not (pending and pending[-1] is _segment):
+                    pending.append(_segment)
+                continue
+
+            if pending:
+                if not owned:
+                    pixels = pixels.copy()
+                    owned = True
+                # the noise is drawn in row order, so only runs without it are split in bands
+                threads = self.img.threads if all(f is _segment for f in pending) else 1
+                _apply_pointwise(pixels, pending, threads)
+                pending = []
+
+            if name == 'rotate':
+                quarter_turns += 1
+            elif name == 'blur':
+                pixels = box_blur(pixels, kwargs['blur_level'], self.img.threads)
+                owned = True
+            elif name in _KERNEL_FILTERS:
+                # a kernel after the quarter turns is the kernel turned back by them before the turns
+                kernels, border, combine = _kernel_filter(name, **kwargs)
+                kernels = [np.rot90(kernel, -quarter_turns) for kernel in kernels]
+                pixels = _apply_kernels(pixels, kernels, border, combine, self.img.threads)
+                owned = True
+
+        return np.rot90(pixels, quarter_turns % 4)
+
+
+def _new_buffer(shape, workdir=None):
+    # float64 pixels in an anonymous temporary file, the file is removed once the memmap is released
+    return np.memmap(tempfile.TemporaryFile(dir=workdir), dtype=np.float64, mode='w+', shape=shape)
+
+
+def _map_strips(pixels, out_shape, strip_filter, halo, tile_rows, workdir=None):
+    """
+    Runs `strip_filter` over strips of `tile_rows` output rows, each read with `halo` extra input rows
+    below it, and writes the results into a new memory mapped buffer of `out_shape`.
+    """
+    out = _new_buffer(out_shape, workdir)
+    for start in range(0, out_shape[0], tile_rows):
+        stop = min(start + tile_rows, out_shape[0])
+        out[start:stop] = strip_filter(pixels[start:stop + halo])
+    out.flush()
+    return out
+
+
+class TiledImg(Img):
+    """
+    `Img` for images too large to process in memory.
+
+    The pixels live in a memory mapped temporary file and every filter streams over strips of
+    `tile_rows` rows (plus the halo rows that blur needs) from one buffer to the next, so the
+    memory the filters work in is bounded by the strip size rather than by the image size.
+    Decoding and encoding are not: the constructor decodes the whole image before copying it into the buffer
+    strip by strip, and `save_img` and `encode` build the whole 8-bit gray image (1 byte per pixel, the buffer
+    holds 8) for PIL to encode.
+    Filters give exactly the same pixels as `Img`, on a single thread (`threads` is ignored). `data` and
+    `pipeline()` still load the whole image.
+    """
+
+    def __init__(self, path, tile_rows=256, workdir=None):
+        from matplotlib.image import imread
+
+        self.path = Path(path)
+        self.tile_rows = tile_rows
+        self.workdir = workdir
+
+        rgb = imread(path)
+        self.pixels = _new_buffer(rgb.shape[:2], workdir)
+        for start in range(0, rgb.shape[0], tile_rows):
+            self.pixels[start:start + tile_rows] = rgb2gray(rgb[start:start + tile_rows])
+        self.pixels.flush()
+
+    def _strips(self):
+        for start in range(0, self.pixels.shape[0], self.tile_rows):
+            yield self.pixels[start:start + self.tile_rows]
+
+    def save_img(self):
+        """
+        Writes an 8-bit grayscale image with the same intensities as `Img.save_img` (matplotlib's gray
+        colormap over the pixels range), converting one strip at a time.
+        """
+        new_path = self.path.with_name(self.path.stem + '_filtered' + self.path.suffix)
+        Image.fromarray(self._gray8(), mode='L').save(new_path)
+        return new_path
+
+    def _gray8(self):
+        vmin = min((strip.min() for strip in self._strips()), default=0)
+        vmax = max((strip.max() for strip in self._strips()), default=0)
+
+        gray = np.empty(self.pixels.shape, dtype=np.uint8)
+        for start in range(0, self.pixels.shape[0], self.tile_rows):
+            strip = self.pixels[start:start + self.tile_rows]
+            gray[start:start + self.tile_rows] = _to_gray8(strip, vmin, vmax)
+        return gray
+
+    def blur(self, blur_level=16):
+        height, width = self.pixels.shape
+        out_shape = (max(height - blur_level + 1, 0), max(width - blur_level + 1, 0))
+        self.pixels = _map_strips(self.pixels, out_shape, lambda strip: box_blur(strip, blur_level),
+                                  blur_level - 1, self.tile_rows, self.workdir)
+
+    def _apply_kernels(self, kernels, border, combine=None):
+        # each strip of output rows reads the padded input rows under it, padding included
+        kernel_height, kernel_width = np.shape(kernels[0])
+        (top, bottom), (left, right) = _border_padding((kernel_height, kernel_width), border)
+        height, width = self.pixels.shape
+        row_indices, rows_inside = _border_indices(height, top, bottom, border)
+        cols = _border_indices(width, left, right, border)
+        out_shape = (max(height + top + bottom - kernel_height + 1, 0),
+                     max(width + left + right - kernel_width + 1, 0))
+
+        out = _new_buffer(out_shape, self.workdir)
+        if 0 not in out_shape:
+            for start in range(0, out_shape[0], self.tile_rows):
+                stop = min(start + self.tile_rows, out_shape[0])
+                band = slice(start, stop + kernel_height - 1)
+                strip = _take_padded(self.pixels, (row_indices[band], rows_inside[band]), cols, border)
+                out[start:stop] = _apply_kernels(strip, kernels, 'valid', combine)
+        out.flush()
+        self.pixels = out
+
+    def rotate(self):
+        # output rows are input columns, so each strip reads a band of `tile_rows` columns
+        height, width = self.pixels.shape
+        out = _new_buffer((width, height), self.workdir)
+        for start in range(0, width, self.tile_rows):
+            stop = min(start + self.tile_rows, width)
+            out[start:stop] = np.rot90(self.pixels[:, width - stop:width - start])
+        out.flush()
+        self.pixels = out
+
+    def salt_n_pepper(self, salt=0.2, pepper=0.2, seed=None):
+        rng = _noise_rng(salt, pepper, seed)
+        for strip in self._strips():
+            _salt_n_pepper(strip, salt, pepper, rng)
+        self.pixels.flush()
 
     def segment(self):
-        height = len(self.data)
-        width = len(self.data[0])
-
-        for y in range(height):
-            for x in range(width):
-                if self.data[y][x] > 100:
-                    self.data[y][x] = 255
-                else:
-                    self.data[y][x] = 0
+        for strip in self._strips():
+            _segment(strip)
+        self.pixels.flush()
@@ -0,0 +1,33 @@
+import functools
+import os
+
+# boto3 takes a while to import, it's imported when the first client or transfer config is created
+
+
+@functools.lru_cache(maxsize=None)
+def transfer_config():
+    """
+    Transfer settings shared by all uploads and downloads. Telegram photos are far below the multipart
+    threshold, so each transfer is a single request.
+    """
+    from boto3.s3.transfer import TransferConfig
+
+    return TransferConfig(
+        multipart_threshold=16 * 1024 * 1024,
+        multipart_chunksize=16 * 1024 * 1024,
+        max_concurrency=4,
+    )
+
+
+def create_s3_client():
+    """
+    S3 client to share between threads (boto3 clients are thread safe), with a connection pool sized
+    by S3_MAX_POOL_CONNECTIONS.
+    """
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client('s3', config=Config(
+        max_pool_connections=int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 20)),
+        retries={'max_attempts': 3, 'mode': 'standard'},
+    ))
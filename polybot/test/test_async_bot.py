@@ -0,0 +1,186 @@
+import io
+import unittest
+import asyncio
+import time
+from unittest.mock import patch
+import aiohttp
+import boto3
+from aiohttp import web
+from moto import mock_aws
+from PIL import Image
+from polybot.async_bot import AsyncObjectDetectionBot
+from polybot.job_queue import PREDICTION_QUEUE, InMemoryBroker
+from polybot.metrics import TRACE_HEADER
+from polybot.prefilter import PreFilter
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+mock_msg = {
+    'message_id': 349,
+    'chat': {'id': 1243002838, 'type': 'private'},
+    'photo': [{'file_id': 'file_1',
+               'file_unique_id': 'AQADAb8xG8e94FF9', 'width': 660, 'height': 660}]
+}
+
+
+class TestAsyncObjectDetectionBot(unittest.TestCase):
+
+    @patch('telebot.TeleBot')
+    def setUp(self, mock_telebot):
+        self.aws = mock_aws()
+        self.aws.start()
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket=AsyncObjectDetectionBot.S3_BUCKET)
+
+        with open(img_path, 'rb') as f:
+            self.photo = f.read()
+        self.predict_statuses = []
+        self.trace_ids = []
+        self.download_delay = 0
+        # (status, body) of getFile instead of the file path
+        self.get_file_error = None
+
+        self.bot = AsyncObjectDetectionBot(token='bot_token', telegram_chat_url='webhook_url', backoff=0.01)
+        self.bot.telegram_bot_client = mock_telebot.return_value
+        url = asyncio.run_coroutine_threadsafe(self.start_server(), self.bot.loop).result()
+        self.bot.telegram_api_url = url
+        self.bot.YOLO5_URL = f'{url}/predict'
+
+    def tearDown(self):
+        # some tests close the bot, and its loop with the server
+        if self.bot.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.bot.loop).result()
+            self.bot.close()
+        self.aws.stop()
+
+    async def start_server(self):
+        async def get_file(request):
+            if self.get_file_error:
+                status, body = self.get_file_error
+                return web.json_response(body, status=status)
+            return web.json_response({'ok': True, 'result': {'file_path': f'photos/{request.query["file_id"]}.jpg'}})
+
+        async def download_file(request):
+            await asyncio.sleep(self.download_delay)
+            return web.Response(body=self.photo)
+
+        async def predict(request):
+            self.trace_ids.append(request.headers.get(TRACE_HEADER))
+            status = self.predict_statuses.pop(0) if self.predict_statuses else 200
+            if status != 200:
+                return web.Response(status=status)
+            return web.json_response({
+                'detections': {'class_ids': [0, 0, 16], 'boxes': [0.5, 0.5, 0.2, 0.4] * 3, 'confidences': [0.9, 0.8, 0.7]},
+                'classes': {'person': {'count': 2}, 'dog': {'count': 1}},
+            })
+
+        app = web.Application()
+        app.router.add_get('/botbot_token/getFile', get_file)
+        app.router.add_get('/file/botbot_token/photos/{name}', download_file)
+        app.router.add_post('/predict', predict)
+
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f'http://127.0.0.1:{port}'
+
+    def test_handle_message(self):
+        self.bot.handle_message(mock_msg).result(timeout=10)
+
+        uploaded = self.s3.get_object(Bucket=AsyncObjectDetectionBot.S3_BUCKET, Key='file_1.jpg')['Body'].read()
+        self.assertEqual(uploaded, self.photo)
+        self.bot.telegram_bot_client.send_message.assert_called_once_with(
+            mock_msg['chat']['id'], 'Objects detected:\nperson: 2\ndog: 1\n')
+        # yolo5 gets a trace id to use as the prediction id
+        self.assertEqual(len(self.trace_ids), 1)
+        self.assertTrue(self.trace_ids[0])
+
+    def test_get_file_errors(self):
+        self.get_file_error = (400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: invalid file_id'})
+        with self.assertRaises(aiohttp.ClientResponseError):
+            asyncio.run_coroutine_threadsafe(self.bot.get_user_photo_async(mock_msg), self.bot.loop).result()
+
+        self.get_file_error = (200, {'ok': False, 'description': 'file is too big'})
+        with self.assertRaisesRegex(RuntimeError, 'file is too big'):
+            asyncio.run_coroutine_threadsafe(self.bot.get_user_photo_async(mock_msg), self.bot.loop).result()
+
+    def test_yolo5_retries(self):
+        self.predict_statuses = [503, 502]
+        summary = asyncio.run_coroutine_threadsafe(self.bot.yolo5_request_async('file_1.jpg'), self.bot.loop).result()
+        self.assertEqual(summary['detections']['class_ids'], [0, 0, 16])
+
+    def test_yolo5_gives_up(self):
+        self.predict_statuses = [503] * 4
+        summary = asyncio.run_coroutine_threadsafe(self.bot.yolo5_request_async('file_1.jpg'), self.bot.loop).result()
+        self.assertIn('error', summary)
+
+    def test_yolo5_no_retry_on_not_found(self):
+        self.predict_statuses = [404, 503]
+        summary = asyncio.run_coroutine_threadsafe(self.bot.yolo5_request_async('file_1.jpg'), self.bot.loop).result()
+        self.assertIn('error', summary)
+        self.assertEqual(self.predict_statuses, [503])
+
+    def test_concurrent_messages(self):
+        messages = [{**mock_msg, 'chat': {'id': chat_id}, 'photo': [{'file_id': f'file_{chat_id}'}]} for chat_id in range(20)]
+        futures = [self.bot.handle_message(msg) for msg in messages]
+        for future in futures:
+            future.result(timeout=10)
+
+        self.assertEqual(self.bot.telegram_bot_client.send_message.call_count, 20)
+        self.assertEqual(self.s3.list_objects_v2(Bucket=AsyncObjectDetectionBot.S3_BUCKET)['KeyCount'], 20)
+
+    def test_busy_above_max_pending(self):
+        self.bot.max_pending = 2
+        self.download_delay = 0.5
+        messages = [{**mock_msg, 'chat': {'id': chat_id}, 'photo': [{'file_id': f'file_{chat_id}'}]} for chat_id in range(4)]
+        self.assertTrue(self.bot.submit(messages[0]))
+        self.assertTrue(self.bot.submit(messages[1]))
+        self.assertFalse(self.bot.submit(messages[2]))
+
+        self.bot.close()
+        self.assertEqual(self.bot.telegram_bot_client.send_message.call_count, 2)
+        self.assertFalse(self.bot.submit(messages[3]))
+
+    def test_close_waits_for_messages_in_flight(self):
+        self.download_delay = 0.5
+        future = self.bot.handle_message(mock_msg)
+        self.bot.close(timeout=10)
+        self.assertTrue(future.done())
+        self.bot.telegram_bot_client.send_message.assert_called_once()
+
+    def test_close_timeout(self):
+        self.download_delay = 5
+        self.bot.handle_message(mock_msg)
+        start = time.monotonic()
+        self.bot.close(timeout=0.2)
+        self.assertLess(time.monotonic() - start, 2)
+        self.bot.telegram_bot_client.send_message.assert_not_called()
+
+    def test_photo_becomes_job(self):
+        self.bot.broker = InMemoryBroker()
+        self.bot.handle_message(mock_msg).result(timeout=10)
+
+        self.assertEqual(self.trace_ids, [])
+        self.bot.telegram_bot_client.send_message.assert_not_called()
+        jobs = self.bot.broker.receive(PREDICTION_QUEUE)
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual((jobs[0].body['chat_id'], jobs[0].body['imgName']), (1243002838, 'file_1.jpg'))
+
+    def test_prefilter_skips_empty_photo(self):
+        self.bot.prefilter = PreFilter()
+        white = io.BytesIO()
+        Image.new('RGB', (640, 480), (255, 255, 255)).save(white, 'JPEG')
+        self.photo = white.getvalue()
+        self.bot.handle_message(mock_msg).result(timeout=10)
+
+        self.assertEqual(self.trace_ids, [])
+        self.assertEqual(self.s3.list_objects_v2(Bucket=AsyncObjectDetectionBot.S3_BUCKET)['KeyCount'], 0)
+        self.bot.telegram_bot_client.send_message.assert_called_once_with(
+            mock_msg['chat']['id'], 'No objects detected in the image.')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from polybot.img_proc import Img
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+def list_blur(data, blur_level):
+    # the original nested lists implementation of Img.blur, used as a reference
+    filter_sum = blur_level ** 2
+    result = []
+    for i in range(len(data) - blur_level + 1):
+        row_result = []
+        for j in range(len(data[0]) - blur_level + 1):
+            sub_matrix = [row[j:j + blur_level] for row in data[i:i + blur_level]]
+            row_result.append(sum(sum(sub_row) for sub_row in sub_matrix) // filter_sum)
+        result.append(row_result)
+    return result
+
+
+class TestImgBlur(unittest.TestCase):
+
+    def setUp(self):
+        self.img = Img(img_path)
+        self.img.data = [row[:90] for row in self.img.data[:80]]
+        self.original_data = self.img.data
+
+    def test_blur_dimension(self):
+        self.img.blur(blur_level=5)
+        self.assertEqual((len(self.img.data), len(self.img.data[0])), (76, 86))
+
+    def test_blur_matches_list_implementation(self):
+        for blur_level in (1, 3, 4, 16, 33):
+            self.img.data = self.original_data
+            self.img.blur(blur_level)
+            self.assertEqual(list_blur(self.original_data, blur_level), self.img.data)
+
+    def test_blur_window_mean_on_integer(self):
+        # every window averages to exactly 2, so the floor depends on the summation rounding
+        checkerboard = [[1.9 if (x + y) % 2 else 2.1 for x in range(30)] for y in range(30)]
+        for blur_level in (2, 4, 10):
+            self.img.data = checkerboard
+            self.img.blur(blur_level)
+            self.assertEqual(list_blur(checkerboard, blur_level), self.img.data)
+
+    def test_blur_bigger_than_image(self):
+        self.img.blur(blur_level=100)
+        self.assertEqual(self.img.data, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
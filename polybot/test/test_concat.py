@@ -1,5 +1,6 @@
 import unittest
-from polybot.img_proc import Img
+import numpy as np
+from polybot.img_proc import Img, collage
 import os
 
 img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
@@ -37,5 +38,52 @@ class TestImgConcat(unittest.TestCase):
         self.assertEqual(left_half, right_half)
 
 
+class TestImgConcatDirections(unittest.TestCase):
+
+    def setUp(self):
+        self.img = Img(img_path)
+        self.other_img = Img(img_path)
+        self.pixels = self.img.pixels.copy()
+
+    def test_vertical(self):
+        self.img.concat(self.other_img, direction='vertical')
+        np.testing.assert_array_equal(self.img.pixels, np.vstack([self.pixels, self.pixels]))
+
+    def test_grid(self):
+        self.img.concat(self.other_img, self.other_img, self.other_img, direction='grid')
+        np.testing.assert_array_equal(self.img.pixels, np.tile(self.pixels, (2, 2)))
+
+    def test_mismatched_sizes(self):
+        self.other_img.pixels = self.other_img.pixels[:100]
+        with self.assertRaises(RuntimeError):
+            self.img.concat(self.other_img)
+
+    def test_pad(self):
+        self.other_img.pixels = np.full((10, 20), 7.0)
+        self.img.concat(self.other_img, fit='pad')
+
+        height = self.pixels.shape[0]
+        self.assertEqual(self.img.pixels.shape, (height, self.pixels.shape[1] + 20))
+        right = self.img.pixels[:, self.pixels.shape[1]:]
+        top = (height - 10) // 2
+        np.testing.assert_array_equal(right[top:top + 10], 7.0)
+        self.assertEqual(right.sum(), 7.0 * 200)
+
+    def test_resize(self):
+        self.other_img.pixels = self.other_img.pixels[::2, ::2]
+        self.img.concat(self.other_img, fit='resize')
+
+        # scaled back to the same height, keeping its aspect ratio
+        self.assertEqual(self.img.pixels.shape, (self.pixels.shape[0], 2 * self.pixels.shape[1]))
+
+    def test_collage_cells(self):
+        images = [np.ones((2, 3)), np.ones((4, 1)), np.ones((1, 1))]
+        out = collage(images, columns=2, fill=-1)
+
+        # rows as high as their highest image, columns as wide as their widest one
+        self.assertEqual(out.shape, (4 + 1, 3 + 1))
+        self.assertEqual((out == 1).sum(), 6 + 4 + 1)
+
+
 if __name__ == '__main__':
     unittest.main()
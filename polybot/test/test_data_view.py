@@ -0,0 +1,44 @@
+import unittest
+from polybot.img_proc import Img
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+class TestImgDataView(unittest.TestCase):
+
+    def setUp(self):
+        self.img = Img(img_path)
+        self.original_data = self.img.data
+
+    def test_data_is_nested_lists(self):
+        self.assertIsInstance(self.original_data, list)
+        self.assertIsInstance(self.original_data[0], list)
+        self.assertIsInstance(self.original_data[0][0], float)
+        self.assertEqual((len(self.original_data), len(self.original_data[0])), self.img.pixels.shape)
+
+    def test_data_assignment(self):
+        self.img.data = [[1, 2, 3], [4, 5, 6]]
+        self.assertEqual(self.img.pixels.shape, (2, 3))
+        self.assertEqual(self.img.data, [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+
+    def test_read_from_memory(self):
+        with open(img_path, 'rb') as f:
+            img = Img('photos/beatles.jpeg', encoded=f.read())
+        self.assertEqual(img.data, self.original_data)
+        self.assertEqual(img.path.name, 'beatles.jpeg')
+
+    def test_contour_matches_list_implementation(self):
+        expected = [[abs(row[j - 1] - row[j]) for j in range(1, len(row))] for row in self.original_data]
+        self.img.contour()
+        self.assertEqual(expected, self.img.data)
+
+    def test_rotate_matches_list_implementation(self):
+        width = len(self.original_data[0])
+        expected = [[row[width - x - 1] for row in self.original_data] for x in range(width)]
+        self.img.rotate()
+        self.assertEqual(expected, self.img.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
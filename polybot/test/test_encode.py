@@ -0,0 +1,69 @@
+import io
+import subprocess
+import sys
+import unittest
+import tempfile
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from matplotlib.image import imread
+from polybot.img_proc import Img, TiledImg
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+class TestImgEncode(unittest.TestCase):
+
+    def setUp(self):
+        self.img = Img(img_path)
+        self.img.contour()
+
+    def test_png_matches_save_img(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # a PNG path, so save_img is lossless too
+            self.img.path = Path(directory) / 'beatles.png'
+            expected = np.round(imread(self.img.save_img())[:, :, 0] * 255)
+
+        encoded = Image.open(io.BytesIO(self.img.encode('png')))
+        self.assertEqual(encoded.mode, 'L')
+        np.testing.assert_array_equal(np.asarray(encoded), expected)
+
+    def test_jpeg_quality(self):
+        low, high = self.img.encode('jpeg', quality=30), self.img.encode('jpeg', quality=95)
+        self.assertLess(len(low), len(high))
+        encoded = Image.open(io.BytesIO(high))
+        self.assertEqual((encoded.format, encoded.mode, encoded.size), ('JPEG', 'L', (659, 660)))
+
+    def test_tiled_matches_img(self):
+        tiled_img = TiledImg(img_path, tile_rows=64)
+        tiled_img.contour()
+        self.assertEqual(tiled_img.encode('png'), self.img.encode('png'))
+
+    def test_flat_image(self):
+        self.img.data = [[3.0] * 5] * 4
+        encoded = Image.open(io.BytesIO(self.img.encode('png')))
+        self.assertEqual(encoded.size, (5, 4))
+        np.testing.assert_array_equal(np.asarray(encoded), 0)
+
+    def test_encode_does_not_import_matplotlib(self):
+        # Img() reads with matplotlib, the pixels are set without it
+        script = ('import sys\n'
+                  'import numpy as np\n'
+                  'from polybot.img_proc import Img\n'
+                  'img = Img.__new__(Img)\n'
+                  'img.data = np.arange(64.0).reshape(8, 8)\n'
+                  'img.encode("png"), img.encode("jpeg")\n'
+                  'print(any(name.startswith("matplotlib") for name in sys.modules))\n')
+        cwd = Path(__file__).parent.parent.parent
+        result = subprocess.run([sys.executable, '-c', script], cwd=cwd, stdout=subprocess.PIPE,
+                                universal_newlines=True, check=True)
+        self.assertEqual(result.stdout.strip(), 'False')
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            self.img.encode('gif')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import io
+import unittest
+import threading
+from unittest.mock import patch, Mock
+import boto3
+from moto import mock_aws
+from PIL import Image
+from polybot.bot import ObjectDetectionBot
+from polybot.job_queue import PREDICTION_QUEUE, RESULT_QUEUE, InMemoryBroker
+from polybot.prefilter import PreFilter
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+mock_msg = {
+    'message_id': 349,
+    'chat': {'id': 1243002838, 'type': 'private'},
+    'photo': [{'file_id': 'file_1',
+               'file_unique_id': 'AQADAb8xG8e94FF9', 'width': 660, 'height': 660}]
+}
+
+
+class TestJobQueueObjectDetectionBot(unittest.TestCase):
+
+    @patch('telebot.TeleBot')
+    def setUp(self, mock_telebot):
+        self.aws = mock_aws()
+        self.aws.start()
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket=ObjectDetectionBot.S3_BUCKET)
+
+        self.bot = ObjectDetectionBot(token='bot_token', telegram_chat_url='webhook_url', job_queue_url='memory://')
+        self.bot.broker = InMemoryBroker()
+        self.bot.telegram_bot_client = mock_telebot.return_value
+
+        mock_file = Mock()
+        mock_file.file_path = 'photos/file_1.jpg'
+        self.bot.telegram_bot_client.get_file.return_value = mock_file
+        with open(img_path, 'rb') as f:
+            self.bot.telegram_bot_client.download_file.return_value = f.read()
+
+    def tearDown(self):
+        self.aws.stop()
+
+    def test_photo_becomes_job(self):
+        with patch.object(self.bot, 'yolo5_request') as yolo5_request:
+            self.bot.handle_message(mock_msg)
+
+        yolo5_request.assert_not_called()
+        self.s3.head_object(Bucket=ObjectDetectionBot.S3_BUCKET, Key='file_1.jpg')
+        jobs = self.bot.broker.receive(PREDICTION_QUEUE)
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0].body['chat_id'], 1243002838)
+        self.assertEqual(jobs[0].body['imgName'], 'file_1.jpg')
+        self.assertIn('trace_id', jobs[0].body)
+
+    def test_prefilter_skips_empty_photo(self):
+        self.bot.prefilter = PreFilter()
+        white = io.BytesIO()
+        Image.new('RGB', (640, 480), (255, 255, 255)).save(white, 'JPEG')
+        self.bot.telegram_bot_client.download_file.return_value = white.getvalue()
+
+        self.bot.handle_message(mock_msg)
+
+        self.assertEqual(self.bot.broker.depth(PREDICTION_QUEUE), (0, 0))
+        self.assertNotIn('Contents', self.s3.list_objects_v2(Bucket=ObjectDetectionBot.S3_BUCKET))
+        self.bot.telegram_bot_client.send_message.assert_called_once_with(1243002838, 'No objects detected in the image.')
+        self.assertEqual(self.bot.prefilter.stats()['skipped'], 1)
+
+    def test_prefilter_passes_photo(self):
+        self.bot.prefilter = PreFilter()
+
+        self.bot.handle_message(mock_msg)
+
+        self.assertEqual(self.bot.broker.depth(PREDICTION_QUEUE), (1, 0))
+        self.assertEqual(self.bot.prefilter.stats()['skipped'], 0)
+
+    def test_results_are_sent(self):
+        summary = {'classes': {'person': {'count': 1}}}
+        self.bot.broker.send(RESULT_QUEUE, {'chat_id': 1243002838, 'imgName': 'file_1.jpg', 'summary': summary})
+
+        stop = threading.Event()
+        with patch.object(self.bot, 'send_summary_to_user', side_effect=lambda *args: stop.set()) as send_summary:
+            self.bot.consume_results(stop, wait_time=0.1)
+
+        send_summary.assert_called_once_with(1243002838, summary)
+        self.assertEqual(self.bot.broker.depth(RESULT_QUEUE), (0, 0))
+
+    def test_failed_result_comes_back(self):
+        summary = {'classes': {'person': {'count': 1}}}
+        self.bot.broker.send(RESULT_QUEUE, {'chat_id': 1, 'imgName': 'file_1.jpg', 'summary': summary})
+        self.bot.broker.send(RESULT_QUEUE, {'chat_id': 2, 'imgName': 'file_2.jpg', 'summary': summary})
+
+        stop = threading.Event()
+        sent = []
+        failures = [RuntimeError('Too Many Requests: retry after 1')]
+
+        def send_summary(chat_id, summary):
+            if failures:
+                raise failures.pop()
+            sent.append(chat_id)
+            if sorted(sent) == [1, 2]:
+                stop.set()
+
+        consumer = threading.Thread(target=self.bot.consume_results, args=(stop,),
+                                    kwargs={'wait_time': 0.05, 'visibility_timeout': 0.2})
+        with patch.object(self.bot, 'send_summary_to_user', side_effect=send_summary):
+            consumer.start()
+            consumer.join(timeout=5)
+
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(sorted(sent), [1, 2])
+        self.assertEqual(self.bot.broker.depth(RESULT_QUEUE), (0, 0))
+
+    def test_receive_error_is_retried(self):
+        stop = threading.Event()
+        calls = []
+
+        def receive(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError('database is locked')
+            stop.set()
+            return []
+
+        with patch.object(self.bot.broker, 'receive', side_effect=receive):
+            self.bot.consume_results(stop, wait_time=0.01)
+
+        self.assertEqual(len(calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
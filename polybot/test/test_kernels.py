@@ -0,0 +1,129 @@
+import unittest
+import numpy as np
+from polybot.img_proc import BORDERS, GRADIENT_KERNELS, Img, TiledImg, correlate, gaussian_kernel
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+def loop_correlate(pixels, kernel):
+    # the valid correlation, pixel by pixel, used as a reference
+    kernel_height, kernel_width = kernel.shape
+    out = np.zeros((pixels.shape[0] - kernel_height + 1, pixels.shape[1] - kernel_width + 1))
+    for i in range(out.shape[0]):
+        for j in range(out.shape[1]):
+            out[i, j] = np.sum(pixels[i:i + kernel_height, j:j + kernel_width] * kernel)
+    return out
+
+
+class TestCorrelate(unittest.TestCase):
+
+    def setUp(self):
+        self.pixels = np.random.default_rng(0).integers(0, 256, (23, 31)).astype(np.float64)
+
+    def test_methods_match_reference(self):
+        kernels = {
+            'box': np.full((4, 3), 0.5),
+            'separable': GRADIENT_KERNELS['sobel'],
+            'direct': np.random.default_rng(1).random((3, 5)),
+            'fft': np.random.default_rng(2).random((7, 6)),
+        }
+        for method, kernel in kernels.items():
+            expected = loop_correlate(self.pixels, kernel)
+            np.testing.assert_allclose(correlate(self.pixels, kernel, method=method), expected, atol=1e-9,
+                                       err_msg=method)
+            np.testing.assert_allclose(correlate(self.pixels, kernel), expected, atol=1e-9, err_msg=method)
+
+    def test_borders_match_numpy_pad(self):
+        kernel = np.random.default_rng(3).random((4, 5))
+        for border in BORDERS[1:]:
+            # wider than the image, so the padding reflects/wraps more than once
+            for pixels in (self.pixels, self.pixels[:3, :2]):
+                padded = np.pad(pixels, ((1, 2), (2, 2)), mode=border)
+                np.testing.assert_allclose(correlate(pixels, kernel, border=border), loop_correlate(padded, kernel),
+                                           atol=1e-9, err_msg=border)
+
+    def test_constant_fill(self):
+        result = correlate(np.zeros((4, 4)), np.ones((3, 3)), border='constant', fill=1)
+        self.assertEqual(result[0, 0], 5)
+        self.assertEqual(result[1, 1], 0)
+
+    def test_valid_shape(self):
+        self.assertEqual(correlate(self.pixels, np.ones((5, 2))).shape, (19, 30))
+        self.assertEqual(correlate(self.pixels, np.ones((40, 2))).shape, (0, 30))
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            correlate(self.pixels, np.ones((3, 3)), border='mirror')
+        with self.assertRaises(ValueError):
+            correlate(self.pixels, np.eye(3), method='separable')
+        with self.assertRaises(ValueError):
+            correlate(self.pixels, np.eye(3), method='box')
+
+    def test_gaussian_kernel(self):
+        kernel = gaussian_kernel(1.5)
+        self.assertEqual(kernel.shape, (11, 11))
+        self.assertAlmostEqual(kernel.sum(), 1)
+        np.testing.assert_array_equal(kernel, kernel.T)
+
+
+class TestKernelFilters(unittest.TestCase):
+
+    def setUp(self):
+        self.img = Img(img_path)
+        self.img.data = [row[:120] for row in self.img.data[:100]]
+        self.original_pixels = self.img.pixels.copy()
+
+    def test_contour_is_horizontal_difference(self):
+        self.img.contour()
+        np.testing.assert_array_equal(self.img.pixels, np.abs(np.diff(self.original_pixels, axis=1)))
+
+    def test_edges(self):
+        self.img.pixels = np.zeros((10, 10))
+        self.img.pixels[:, 5:] = 100
+        self.img.edges()
+        self.assertEqual(self.img.pixels.shape, (10, 10))
+        np.testing.assert_array_equal(self.img.pixels[:, [4, 5]], 400)
+        np.testing.assert_array_equal(np.delete(self.img.pixels, [4, 5], axis=1), 0)
+
+    def test_sharpen_keeps_range(self):
+        self.img.sharpen()
+        self.assertEqual(self.img.pixels.shape, self.original_pixels.shape)
+        self.assertGreaterEqual(self.img.pixels.min(), 0)
+        self.assertLessEqual(self.img.pixels.max(), 255)
+
+    def test_gaussian_blur_keeps_flat_image(self):
+        self.img.pixels = np.full((30, 40), 7.0)
+        self.img.gaussian_blur(sigma=3)
+        np.testing.assert_allclose(self.img.pixels, 7)
+
+    def test_unknown_operator(self):
+        with self.assertRaises(ValueError):
+            self.img.edges(operator='prewitt')
+
+    def test_pipeline_matches_eager(self):
+        chains = [
+            [('rotate', {}), ('edges', {'operator': 'scharr', 'border': 'wrap'})],
+            [('rotate', {}), ('rotate', {}), ('rotate', {}), ('gaussian_blur', {'sigma': 1})],
+            [('rotate', {}), ('sharpen', {'border': 'constant'}), ('rotate', {}), ('contour', {})],
+        ]
+        for chain in chains:
+            eager = Img(img_path)
+            eager.pixels = self.original_pixels.copy()
+            pipeline = self.img.pipeline()
+            for name, kwargs in chain:
+                getattr(eager, name)(**kwargs)
+                getattr(pipeline, name)(**kwargs)
+            np.testing.assert_allclose(pipeline.compute(), eager.pixels, atol=1e-9, err_msg=str(chain))
+
+    def test_tiled_matches_img(self):
+        for border in BORDERS:
+            img, tiled_img = Img(img_path), TiledImg(img_path, tile_rows=7)
+            for target in (img, tiled_img):
+                target.edges(border=border)
+                target.gaussian_blur(sigma=2, border=border)
+            np.testing.assert_allclose(tiled_img.pixels, img.pixels, atol=1e-9, err_msg=border)
+
+
+if __name__ == '__main__':
+    unittest.main()
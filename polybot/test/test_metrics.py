@@ -0,0 +1,126 @@
+import unittest
+from unittest.mock import patch
+import flask
+from polybot.metrics import REGISTRY, Registry, instrument, stage
+
+
+def sample(text, line_start):
+    """
+    The value of the first sample line starting with `line_start`.
+    """
+    for line in text.splitlines():
+        if line.startswith(line_start):
+            return float(line.rsplit(' ', 1)[1])
+    raise AssertionError(f'No sample {line_start} in:\n{text}')
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+        self.latency = self.registry.histogram('latency_seconds', 'Latency', ['stage'], buckets=[0.1, 1])
+        self.errors = self.registry.counter('errors_total', 'Errors', ['stage'])
+        self.in_flight = self.registry.gauge('in_flight', 'In flight')
+
+    def test_render(self):
+        for value in (0.05, 0.5, 5):
+            self.latency.observe(value, stage='s3_upload')
+        self.errors.inc(stage='s3_upload')
+        self.in_flight.inc()
+        text = self.registry.render()
+
+        self.assertIn('# TYPE latency_seconds histogram', text)
+        self.assertEqual(sample(text, 'latency_seconds_bucket{stage="s3_upload",le="0.1"}'), 1)
+        self.assertEqual(sample(text, 'latency_seconds_bucket{stage="s3_upload",le="1"}'), 2)
+        self.assertEqual(sample(text, 'latency_seconds_bucket{stage="s3_upload",le="+Inf"}'), 3)
+        self.assertEqual(sample(text, 'latency_seconds_count{stage="s3_upload"}'), 3)
+        self.assertAlmostEqual(sample(text, 'latency_seconds_sum{stage="s3_upload"}'), 5.55)
+        self.assertEqual(sample(text, 'errors_total{stage="s3_upload"}'), 1)
+        self.assertEqual(sample(text, 'in_flight '), 1)
+
+    def test_histogram_snapshot(self):
+        for value in (0.05, 0.5, 5):
+            self.latency.observe(value, stage='s3_upload')
+
+        snapshot = self.latency.snapshot(stage='s3_upload')
+        self.assertEqual(snapshot['buckets'], {'0.1': 1, '1': 2, '+Inf': 3})
+        self.assertEqual(snapshot['count'], 3)
+        self.assertAlmostEqual(snapshot['sum'], 5.55)
+        self.assertEqual(self.latency.snapshot(stage='yolo5_request')['count'], 0)
+
+    def test_drain_and_merge(self):
+        # a worker process hands its metrics over to the process serving /metrics
+        worker = Registry()
+        worker.histogram('latency_seconds', 'Latency', ['stage'], buckets=[0.1, 1]).observe(0.5, stage='s3_upload')
+        worker.counter('errors_total', 'Errors', ['stage']).inc(stage='s3_upload')
+        self.latency.observe(0.05, stage='s3_upload')
+
+        self.registry.merge(worker.drain())
+        self.registry.merge(worker.drain())  # drained already, nothing more to merge
+        text = self.registry.render()
+
+        self.assertEqual(sample(text, 'latency_seconds_count{stage="s3_upload"}'), 2)
+        self.assertEqual(sample(text, 'errors_total{stage="s3_upload"}'), 1)
+        self.assertNotIn('latency_seconds_count', worker.render())
+
+    def test_gauge_changes_are_merged(self):
+        # a stage still in flight in a worker process shows up in the process serving /metrics
+        worker = Registry()
+        in_flight = worker.gauge('in_flight', 'In flight')
+        in_flight.inc()
+        self.in_flight.inc()
+
+        self.registry.merge(worker.drain())
+        self.assertEqual(sample(self.registry.render(), 'in_flight '), 2)
+        self.registry.merge(worker.drain())  # no change since
+        self.assertEqual(sample(self.registry.render(), 'in_flight '), 2)
+
+        in_flight.dec()
+        self.registry.merge(worker.drain())
+        self.assertEqual(sample(self.registry.render(), 'in_flight '), 1)
+        self.assertEqual(sample(worker.render(), 'in_flight '), 0)
+
+    def test_open_stage_is_merged(self):
+        # the worker's stages are timed on its registry's metrics
+        worker = Registry()
+        worker_in_flight = worker.gauge('stage_in_flight', 'Requests currently in each stage', ['stage'])
+        self.registry.gauge('stage_in_flight', 'Requests currently in each stage', ['stage'])
+        with patch('polybot.metrics.STAGE_IN_FLIGHT', worker_in_flight):
+            with stage('s3_upload'):
+                self.registry.merge(worker.drain())
+                self.assertEqual(sample(self.registry.render(), 'stage_in_flight{stage="s3_upload"}'), 1)
+
+        self.registry.merge(worker.drain())
+        self.assertEqual(sample(self.registry.render(), 'stage_in_flight{stage="s3_upload"}'), 0)
+
+
+class TestStage(unittest.TestCase):
+
+    def test_error_is_counted(self):
+        with self.assertRaises(RuntimeError):
+            with stage('test_failing_stage', 'trace-1'):
+                raise RuntimeError('S3 is down')
+
+        text = REGISTRY.render()
+        self.assertEqual(sample(text, 'stage_errors_total{stage="test_failing_stage"}'), 1)
+        self.assertEqual(sample(text, 'stage_duration_seconds_count{stage="test_failing_stage"}'), 1)
+        self.assertEqual(sample(text, 'stage_in_flight{stage="test_failing_stage"}'), 0)
+
+    def test_instrument(self):
+        app = flask.Flask(__name__)
+        instrument(app)
+
+        @app.route('/secret_token/', methods=['POST'])
+        def webhook():
+            return 'Ok'
+
+        client = app.test_client()
+        client.post('/secret_token/')
+        text = client.get('/metrics').get_data(as_text=True)
+
+        self.assertEqual(sample(text, 'http_responses_total{route="webhook",status="200"}'), 1)
+        self.assertNotIn('secret_token', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import numpy as np
+from polybot.img_proc import Img
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+CHAINS = [
+    ['segment', 'contour', 'rotate'],
+    ['rotate', 'contour'],
+    ['rotate', 'rotate', 'contour', 'segment', 'segment'],
+    ['rotate', 'rotate', 'rotate', 'contour', 'blur', 'rotate'],
+    ['contour', 'rotate', 'blur', 'segment', 'rotate', 'contour'],
+]
+
+
+class TestImgPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.img = Img(img_path)
+        self.img.data = [row[:120] for row in self.img.data[:100]]
+        self.original_pixels = self.img.pixels.copy()
+
+    def test_pipeline_matches_eager_filters(self):
+        for chain in CHAINS:
+            eager = Img(img_path)
+            eager.pixels = self.original_pixels.copy()
+            pipeline = self.img.pipeline()
+            for name in chain:
+                getattr(eager, name)()
+                getattr(pipeline, name)()
+
+            self.assertEqual(eager.data, pipeline.compute().tolist(), chain)
+
+    def test_pipeline_is_lazy(self):
+        pipeline = self.img.pipeline().segment().contour().rotate()
+        np.testing.assert_array_equal(self.img.pixels, self.original_pixels)
+
+        pipeline.compute()
+        np.testing.assert_array_equal(self.img.pixels, self.original_pixels)
+
+        img = pipeline.run()
+        self.assertIs(img, self.img)
+        self.assertEqual((len(img.data), len(img.data[0])), (119, 100))
+
+    def test_pipeline_fused_salt_n_pepper(self):
+        pixels = self.img.pipeline().segment().salt_n_pepper().segment().compute()
+        self.assertEqual(pixels.shape, self.original_pixels.shape)
+        self.assertTrue(np.isin(pixels, [0, 255]).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import io
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from polybot.metrics import REGISTRY
+from polybot.prefilter import PreFilter, evaluate, objectness
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+# photos users sent, all with people or objects in them
+photos_dir = Path(img_path).parent.parent / 'photos'
+
+
+def counted(decision):
+    name = f'prefilter_images_total{{decision="{decision}"}} '
+    return next((float(line[len(name):]) for line in REGISTRY.render().splitlines() if line.startswith(name)), 0)
+
+
+def encode(image, quality=85):
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def text_image(background, color, rng):
+    image = Image.new('RGB', (720, 1280), background)
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.load_default(size=28)
+    except TypeError:
+        # Pillow < 10.1, a fixed size bitmap font
+        font = ImageFont.load_default()
+    for y in range(40, 1240, 40):
+        words = (''.join(chr(ord('a') + c) for c in rng.integers(0, 26, rng.integers(2, 9))) for _ in range(6))
+        draw.text((30, y), ' '.join(words), fill=color, font=font)
+    return image
+
+
+def empty_photos():
+    """
+    Photos with nothing to detect: plain and gradient backgrounds, text and a chat screenshot.
+    """
+    rng = np.random.default_rng(0)
+    gradient = np.tile(np.linspace(0, 255, 1280), (720, 1))
+    images = [
+        Image.new('RGB', (1280, 720), (240, 240, 240)),
+        Image.new('RGB', (1280, 720), (30, 60, 200)),
+        Image.fromarray(np.stack([gradient, gradient * 0.8, gradient * 0.5], axis=2).astype(np.uint8)),
+        text_image((255, 255, 255), (0, 0, 0), rng),
+        text_image((30, 30, 30), (220, 220, 220), rng),
+    ]
+    screenshot = Image.new('RGB', (720, 1280), (255, 255, 255))
+    draw = ImageDraw.Draw(screenshot)
+    draw.rectangle((0, 0, 720, 120), fill=(0, 136, 204))
+    for y in range(160, 1200, 130):
+        draw.rectangle((20, y, 700, y + 110), fill=(230, 240, 250))
+        draw.text((40, y + 30), 'message text here ' * 2, fill=(0, 0, 0))
+    images.append(screenshot)
+    return [encode(image) for image in images]
+
+
+def on_plain_background(data, background, fraction, size=(1280, 960)):
+    """
+    The photo `data` scaled down to cover `fraction` of a plain `background` frame, centered.
+    """
+    photo = Image.open(io.BytesIO(data)).convert('RGB')
+    scale = (fraction * size[0] * size[1] / (photo.width * photo.height)) ** 0.5
+    photo = photo.resize((round(photo.width * scale), round(photo.height * scale)))
+    frame = Image.new('RGB', size, background)
+    frame.paste(photo, ((size[0] - photo.width) // 2, (size[1] - photo.height) // 2))
+    return encode(frame)
+
+
+class TestPreFilter(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.empty = empty_photos()
+        photos = [path.read_bytes() for path in sorted(photos_dir.iterdir())] + [Path(img_path).read_bytes()]
+        # an object on a plain background, over small and large parts of the frame
+        cls.on_plain_background = [
+            on_plain_background(data, background, fraction)
+            for data in photos[::8] + photos[-1:]
+            for background in ((200, 200, 200), (255, 255, 255), (120, 90, 60))
+            for fraction in (0.05, 0.1, 0.2, 0.3, 0.4)
+        ]
+        cls.with_objects = photos + cls.on_plain_background
+
+    def test_labeled_sample(self):
+        samples = [(data, True) for data in self.with_objects] + [(data, False) for data in self.empty]
+        report = evaluate(samples)
+
+        self.assertEqual(report['photos'], len(samples))
+        self.assertEqual(report['false_skip_rate'], 0.0)
+        self.assertEqual(report['skipped'], len(self.empty))
+
+    def test_scores(self):
+        self.assertLess(max(objectness(data) for data in self.empty), 0.45)
+        self.assertGreater(min(objectness(data) for data in self.with_objects), 0.55)
+
+    def test_score_does_not_depend_on_frame_coverage(self):
+        for data in self.on_plain_background:
+            self.assertFalse(PreFilter().should_skip(data))
+
+    def test_zero_threshold_skips_nothing(self):
+        prefilter = PreFilter(threshold=0)
+        self.assertFalse(any(prefilter.should_skip(data) for data in self.empty))
+
+    def test_scored_on_threads(self):
+        prefilter = PreFilter()
+        with ThreadPoolExecutor(4) as executor:
+            skips = list(executor.map(prefilter.should_skip, self.empty * 4))
+
+        self.assertTrue(all(skips))
+        self.assertEqual(prefilter.stats()['scored'], 4 * len(self.empty))
+        self.assertEqual(prefilter.stats()['skipped'], 4 * len(self.empty))
+
+    def test_unreadable_photo_is_not_skipped(self):
+        prefilter = PreFilter()
+        self.assertFalse(prefilter.should_skip(b'not an image'))
+        self.assertEqual(prefilter.stats()['scored'], 0)
+
+    def test_skips_are_counted(self):
+        before = {decision: counted(decision) for decision in ('skipped', 'passed')}
+        prefilter = PreFilter()
+        prefilter.should_skip(self.empty[0])
+        prefilter.should_skip(self.with_objects[0])
+
+        self.assertEqual(prefilter.stats(), {'scored': 2, 'skipped': 1, 'skip_ratio': 0.5})
+        self.assertEqual(counted('skipped'), before['skipped'] + 1)
+        self.assertEqual(counted('passed'), before['passed'] + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
-from polybot.img_proc import Img
+import numpy as np
+from polybot.img_proc import Img, TiledImg
 import os
 
 img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
@@ -37,5 +38,51 @@ class TestImgConcat(unittest.TestCase):
         self.assertGreaterEqual(untouched_pixel_percentage, 0.70)
 
 
+class TestSeededSaltNPepper(unittest.TestCase):
+
+    def setUp(self):
+        self.img = Img(img_path)
+        self.other_img = Img(img_path)
+
+    def test_same_seed_same_noise(self):
+        self.img.salt_n_pepper(seed=42)
+        self.other_img.salt_n_pepper(seed=42)
+        np.testing.assert_array_equal(self.img.pixels, self.other_img.pixels)
+
+    def test_other_seed_other_noise(self):
+        self.img.salt_n_pepper(seed=1)
+        self.other_img.salt_n_pepper(seed=2)
+        self.assertFalse(np.array_equal(self.img.pixels, self.other_img.pixels))
+
+    def test_generator_seed(self):
+        self.img.salt_n_pepper(seed=np.random.default_rng(7))
+        self.other_img.salt_n_pepper(seed=7)
+        np.testing.assert_array_equal(self.img.pixels, self.other_img.pixels)
+
+    def test_pipeline_and_tiled_match(self):
+        tiled_img = TiledImg(img_path, tile_rows=50)
+        self.img.salt_n_pepper(salt=0.1, pepper=0.3, seed=3)
+        tiled_img.salt_n_pepper(salt=0.1, pepper=0.3, seed=3)
+        pipeline_pixels = self.other_img.pipeline().salt_n_pepper(salt=0.1, pepper=0.3, seed=3).compute()
+        np.testing.assert_array_equal(self.img.pixels, tiled_img.pixels)
+        np.testing.assert_array_equal(self.img.pixels, pipeline_pixels)
+
+    def test_densities(self):
+        self.img.pixels[:] = 128
+        self.img.salt_n_pepper(salt=0.05, pepper=0.3, seed=0)
+        self.assertAlmostEqual(np.mean(self.img.pixels == 255), 0.05, delta=0.01)
+        self.assertAlmostEqual(np.mean(self.img.pixels == 0), 0.3, delta=0.01)
+
+    def test_no_noise(self):
+        self.img.salt_n_pepper(salt=0, pepper=0)
+        np.testing.assert_array_equal(self.img.pixels, self.other_img.pixels)
+
+    def test_invalid_densities(self):
+        with self.assertRaises(ValueError):
+            self.img.salt_n_pepper(salt=0.6, pepper=0.6)
+        with self.assertRaises(ValueError):
+            self.img.pipeline().salt_n_pepper(salt=-0.1)
+
+
 if __name__ == '__main__':
     unittest.main()
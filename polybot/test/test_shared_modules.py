@@ -0,0 +1,35 @@
+import ast
+import unittest
+from pathlib import Path
+
+repo_dir = Path(__file__).resolve().parent.parent.parent
+# modules polybot and yolo5 both ship a copy of, each service is built from its own directory
+SHARED_MODULES = ('metrics.py', 'job_queue.py', 's3_transfer.py')
+# test helpers both services' test suites have a copy of, as (polybot test file, yolo5 test file, function)
+SHARED_TEST_HELPERS = (('test_startup.py', 'test_app_startup.py', 'import_profile'),)
+
+
+def function_source(path, name):
+    source = path.read_text()
+    node = next(node for node in ast.parse(source).body if isinstance(node, ast.FunctionDef) and node.name == name)
+    return ast.get_source_segment(source, node)
+
+
+class TestSharedModules(unittest.TestCase):
+
+    def test_copies_are_identical(self):
+        for name in SHARED_MODULES:
+            with self.subTest(module=name):
+                self.assertEqual((repo_dir / 'polybot' / name).read_text(), (repo_dir / 'yolo5' / name).read_text(),
+                                 f'polybot/{name} and yolo5/{name} differ, change both copies')
+
+    def test_test_helper_copies_are_identical(self):
+        for polybot_file, yolo5_file, name in SHARED_TEST_HELPERS:
+            with self.subTest(helper=name):
+                self.assertEqual(function_source(repo_dir / 'polybot' / 'test' / polybot_file, name),
+                                 function_source(repo_dir / 'yolo5' / 'test' / yolo5_file, name),
+                                 f'{name} differs in polybot/test/{polybot_file} and yolo5/test/{yolo5_file}')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+import unittest
+
+polybot_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# generous for slow CI machines, the app imported in about 0.4s when this was written (1.1s before the heavy
+# imports were made lazy)
+IMPORT_TIME_BUDGET = 1.5
+LAZY_MODULES = {'matplotlib', 'boto3', 'botocore', 'aiohttp'}
+
+
+def import_profile(module, cwd, env):
+    """
+    Imports `module` in a new interpreter with `-X importtime`, returns the total import time in seconds
+    and the names of all the modules it imported.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=cwd,
+                            env={**os.environ, **env}, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    total, modules = 0, set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue  # the header
+        modules.add(name.strip())
+        if not name.startswith('  '):
+            total += int(cumulative)
+    return total / 1e6, modules
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_import_time(self):
+        total, modules = import_profile('app', polybot_dir, {'TELEGRAM_TOKEN': 'bot_token',
+                                                             'TELEGRAM_APP_URL': 'webhook_url'})
+
+        self.assertFalse({name.split('.')[0] for name in modules} & LAZY_MODULES)
+        self.assertLess(total, IMPORT_TIME_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,10 @@
+import io
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import time
 import unittest
 from unittest.mock import patch, Mock
+from matplotlib.image import imread
 from polybot.bot import ImageProcessingBot
 import os
 
@@ -46,6 +51,16 @@ mock_msg = {
 }
 
 
+def chdir_to_temp_dir(test):
+    """
+    Runs the rest of `test` in a temporary working directory, removed with anything the bot wrote there.
+    """
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    test.addCleanup(os.chdir, os.getcwd())
+    os.chdir(directory.name)
+
+
 class TestBot(unittest.TestCase):
 
     @patch('telebot.TeleBot')
@@ -61,6 +76,7 @@ class TestBot(unittest.TestCase):
             bot.telegram_bot_client.download_file.return_value = f.read()
 
         self.bot = bot
+        chdir_to_temp_dir(self)
 
     def test_rotate(self):
         mock_msg['caption'] = 'Rotate'
@@ -89,6 +105,161 @@ class TestBot(unittest.TestCase):
             mock_method.assert_called_once()
             self.bot.telegram_bot_client.send_photo.assert_called_once()
 
+    def test_cached_result(self):
+        mock_msg['caption'] = 'Segment, Rotate'
+
+        self.bot.handle_message(mock_msg)
+        with patch('polybot.img_proc.Img.segment') as mock_method:
+            self.bot.handle_message(mock_msg)
+            mock_method.assert_not_called()
+
+        self.bot.telegram_bot_client.download_file.assert_called_once()
+        self.assertEqual(self.bot.telegram_bot_client.send_photo.call_count, 2)
+        self.assertEqual((self.bot.cache.hits, self.bot.cache.misses), (1, 1))
+
+    def test_photo_sent_from_memory(self):
+        mock_msg['caption'] = 'Segment'
+        self.bot.photo_format = 'png'
+
+        self.bot.handle_message(mock_msg)
+
+        (_, photo), _ = self.bot.telegram_bot_client.send_photo.call_args
+        filtered = imread(photo.file)
+        self.assertEqual(filtered.shape, (660, 660))
+        self.assertEqual(set(filtered.ravel().tolist()), {0.0, 1.0})
+        # neither the original nor the filtered photo touched the disk
+        self.assertEqual(os.listdir(), [])
+
+    def test_cache_shared_by_threads(self):
+        cache = self.bot.cache
+        cache.max_entries = 8
+
+        def lookups(thread):
+            for index in range(500):
+                file_unique_id = f'photo_{(thread + index) % 16}'
+                if cache.get(file_unique_id, ['rotate']) is None:
+                    cache.put(file_unique_id, ['rotate'], b'filtered', '.jpeg')
+
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(lookups, range(4)))
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'] + stats['misses'], 4 * 500)
+        self.assertEqual(stats['entries'], 8)
+
+    def test_unknown_filter(self):
+        mock_msg['caption'] = 'Sepia'
+
+        self.bot.handle_message(mock_msg)
+
+        self.bot.telegram_bot_client.send_message.assert_called_once()
+        self.bot.telegram_bot_client.send_photo.assert_not_called()
+
+    def test_photo_size_selection(self):
+        # the largest rendition by default
+        self.assertEqual(self.bot.select_photo_size(mock_msg), mock_msg['photo'][2])
+
+        # the smallest at least as large as needed
+        self.bot.PHOTO_MIN_SIDE = 300
+        self.assertEqual(self.bot.select_photo_size(mock_msg), mock_msg['photo'][1])
+        self.bot.PHOTO_MIN_SIDE = 320
+        self.assertEqual(self.bot.select_photo_size(mock_msg), mock_msg['photo'][1])
+
+        # the largest if none is large enough
+        self.bot.PHOTO_MIN_SIDE = 1280
+        self.assertEqual(self.bot.select_photo_size(mock_msg), mock_msg['photo'][2])
+
+    def test_downloads_selected_size(self):
+        mock_msg['caption'] = 'Rotate'
+        self.bot.PHOTO_MIN_SIDE = 300
+
+        self.bot.handle_message(mock_msg)
+
+        self.bot.telegram_bot_client.get_file.assert_called_once_with(mock_msg['photo'][1]['file_id'])
+
+
+class TestAlbum(unittest.TestCase):
+
+    @patch('telebot.TeleBot')
+    def setUp(self, mock_telebot):
+        self.bot = ImageProcessingBot(token='bot_token', telegram_chat_url='webhook_url', album_wait=0.05)
+        self.bot.telegram_bot_client = mock_telebot.return_value
+        self.bot.telegram_bot_client.get_file.side_effect = lambda file_id: Mock(file_path=f'photos/{file_id}.jpeg')
+
+        with open(img_path, 'rb') as f:
+            photo = f.read()
+
+        # (start, end) of each download
+        self.downloads = []
+
+        def download_file(file_path):
+            start = time.perf_counter()
+            time.sleep(0.2)
+            self.downloads.append((start, time.perf_counter()))
+            return photo
+        self.bot.telegram_bot_client.download_file.side_effect = download_file
+        chdir_to_temp_dir(self)
+
+    def album(self, caption, count=3):
+        messages = []
+        for index in range(count):
+            messages.append({
+                'message_id': 400 + index,
+                'media_group_id': '13573',
+                'chat': mock_msg['chat'],
+                'photo': [{'file_id': f'album_{index}', 'file_unique_id': f'album_unique_{index}',
+                           'width': 660, 'height': 660}],
+            })
+        messages[0]['caption'] = caption
+        return messages
+
+    def wait_for_reply(self):
+        for _ in range(100):
+            if self.bot.telegram_bot_client.send_photo.called or self.bot.telegram_bot_client.send_message.called:
+                return
+            time.sleep(0.05)
+
+    def test_concat_album(self):
+        for msg in self.album('Concat'):
+            self.bot.handle_message(msg)
+        self.wait_for_reply()
+
+        self.bot.telegram_bot_client.send_photo.assert_called_once()
+        # the three downloads ran in parallel: each one started before all the others ended
+        self.assertEqual(len(self.downloads), 3)
+        self.assertLess(max(start for start, _ in self.downloads), min(end for _, end in self.downloads))
+        filtered = imread(io.BytesIO(self.bot.cache.get('album_unique_0,album_unique_1,album_unique_2', ['concat'])),
+                          format='jpeg')
+        self.assertEqual(filtered.shape[:2], (660, 3 * 660))
+
+    def test_album_handled_once(self):
+        # a photo arriving as the timer fires joins the album being handled, its own timer then finds nothing
+        for msg in self.album('Concat'):
+            self.bot.handle_message(msg)
+        self.bot._handle_collected_album('13573')
+        self.bot._handle_collected_album('13573')
+        time.sleep(0.2)
+
+        self.bot.telegram_bot_client.send_photo.assert_called_once()
+
+    def test_album_filters(self):
+        with patch('polybot.img_proc.Img.segment') as mock_method:
+            for msg in self.album('Segment, Collage', count=4):
+                self.bot.handle_message(msg)
+            self.wait_for_reply()
+
+        self.assertEqual(mock_method.call_count, 4)
+        self.bot.telegram_bot_client.send_photo.assert_called_once()
+
+    def test_concat_single_photo(self):
+        msg = dict(mock_msg, caption='Concat')
+        self.bot.telegram_bot_client.download_file.side_effect = None
+
+        self.bot.handle_message(msg)
+
+        self.bot.telegram_bot_client.send_message.assert_called_once()
+        self.bot.telegram_bot_client.send_photo.assert_not_called()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import numpy as np
+from polybot.img_proc import Img
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+FILTERS = [
+    ('blur', {'blur_level': 7}),
+    ('contour', {}),
+    ('edges', {'operator': 'scharr', 'border': 'symmetric'}),
+    ('sharpen', {'border': 'constant'}),
+    ('gaussian_blur', {'sigma': 1}),
+    # applied by FFT, on the whole image
+    ('gaussian_blur', {'sigma': 4}),
+    ('segment', {}),
+    ('salt_n_pepper', {'seed': 0}),
+]
+
+
+class TestThreadedFilters(unittest.TestCase):
+
+    def setUp(self):
+        self.img = Img(img_path)
+        self.threaded_img = Img(img_path)
+        self.threaded_img.threads = 4
+
+    def test_filters_match_serial(self):
+        for name, kwargs in FILTERS:
+            getattr(self.img, name)(**kwargs)
+            getattr(self.threaded_img, name)(**kwargs)
+            np.testing.assert_array_equal(self.img.pixels, self.threaded_img.pixels, name)
+
+    def test_pipeline_matches_serial(self):
+        for target in (self.img, self.threaded_img):
+            target.pipeline().rotate().blur(5).segment().edges().rotate().sharpen().contour().run()
+        np.testing.assert_array_equal(self.img.pixels, self.threaded_img.pixels)
+
+    def test_small_image_single_band(self):
+        self.img.data = [row[:20] for row in self.img.data[:20]]
+        self.threaded_img.data = self.img.data
+        self.img.blur(3)
+        self.threaded_img.blur(3)
+        np.testing.assert_array_equal(self.img.pixels, self.threaded_img.pixels)
+
+    def test_invalid_border(self):
+        with self.assertRaises(ValueError):
+            self.threaded_img.edges(border='mirror')
+
+
+if __name__ == '__main__':
+    unittest.main()
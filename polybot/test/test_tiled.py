@@ -0,0 +1,59 @@
+import unittest
+import tempfile
+import tracemalloc
+from pathlib import Path
+import numpy as np
+from matplotlib.image import imread
+from polybot.img_proc import Img, TiledImg
+import os
+
+img_path = 'polybot/test/beatles.jpeg' if '/polybot/test' not in os.getcwd() else 'beatles.jpeg'
+
+
+class TestTiledImg(unittest.TestCase):
+
+    def setUp(self):
+        self.img = Img(img_path)
+        self.tiled_img = TiledImg(img_path, tile_rows=50)
+
+    def test_loaded_pixels(self):
+        self.assertEqual(self.img.data, self.tiled_img.data)
+
+    def test_filters_match_img(self):
+        for name, kwargs in [('blur', {'blur_level': 7}), ('contour', {}), ('rotate', {}), ('segment', {}),
+                             ('rotate', {}), ('blur', {'blur_level': 64}), ('contour', {})]:
+            getattr(self.img, name)(**kwargs)
+            getattr(self.tiled_img, name)(**kwargs)
+            np.testing.assert_array_equal(self.img.pixels, self.tiled_img.pixels, name)
+
+    def test_salt_n_pepper_dimension(self):
+        self.tiled_img.salt_n_pepper()
+        self.assertEqual(self.tiled_img.pixels.shape, self.img.pixels.shape)
+
+    def test_filter_working_memory_bounded_by_tile(self):
+        # tracemalloc sees the strips and temporaries the filters allocate, not the pages of the memory mapped
+        # buffers nor the image decoder and encoder, which hold the whole image
+        image_bytes = self.tiled_img.pixels.nbytes
+
+        tracemalloc.start()
+        self.tiled_img.blur(blur_level=16)
+        self.tiled_img.contour()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.assertLess(peak, image_bytes / 2)
+
+    def test_save_img_matches_gray_colormap(self):
+        self.img.contour()
+        self.tiled_img.contour()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.img.path = Path(tmp_dir, 'img.png')
+            self.tiled_img.path = Path(tmp_dir, 'tiled.png')
+            expected = imread(self.img.save_img())
+            actual = imread(self.tiled_img.save_img())
+
+        np.testing.assert_array_equal(np.round(expected[:, :, 0] * 255), np.round(actual * 255))
+
+
+if __name__ == '__main__':
+    unittest.main()
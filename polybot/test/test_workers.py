@@ -0,0 +1,156 @@
+import os
+import tempfile
+import unittest
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from polybot.metrics import REGISTRY, stage
+from polybot.workers import MessageWorkerPool
+
+handled = []
+release = threading.Event()
+
+
+class MockBot:
+
+    def handle_message(self, msg):
+        if msg.get('text') == 'block':
+            release.wait(5)
+        time.sleep(0.01)
+        handled.append((msg['chat']['id'], msg['message_id']))
+
+
+class TelegramError(Exception):
+    """
+    Like telebot's `ApiTelegramException`: pickles, but can't be unpickled (its __init__ takes more arguments).
+    """
+
+    def __init__(self, description, result):
+        super().__init__(description)
+        self.result = result
+
+
+class FailingBot:
+    """
+    Handles messages in worker processes, writes a file named after the message id in the directory of its text.
+    """
+
+    def handle_message(self, msg):
+        if msg['message_id'] == 0:
+            raise TelegramError('Forbidden: bot was blocked by the user', result=None)
+        open(os.path.join(msg['text'], str(msg['message_id'])), 'w').close()
+
+
+class SlowStageBot:
+    """
+    Stays in a stage until the file named by the message's text exists.
+    """
+
+    def handle_message(self, msg):
+        with stage('test_worker_stage'):
+            for _ in range(500):
+                if os.path.exists(msg['text']):
+                    break
+                time.sleep(0.01)
+
+
+def in_flight(name):
+    line_start = f'stage_in_flight{{stage="{name}"}} '
+    return next((float(line[len(line_start):]) for line in REGISTRY.render().splitlines()
+                 if line.startswith(line_start)), 0)
+
+
+def message(chat_id, message_id, text=''):
+    return {'chat': {'id': chat_id}, 'message_id': message_id, 'text': text}
+
+
+class TestMessageWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        handled.clear()
+        release.clear()
+        self.pool = MessageWorkerPool(MockBot, max_workers=4, max_pending=10, executor_cls=ThreadPoolExecutor)
+
+    def tearDown(self):
+        release.set()
+        self.pool.shutdown(timeout=5)
+
+    def test_per_chat_order(self):
+        for message_id in range(5):
+            for chat_id in (1, 2):
+                self.assertTrue(self.pool.submit(message(chat_id, message_id)))
+        self.pool.shutdown(timeout=5)
+
+        self.assertEqual(len(handled), 10)
+        for chat_id in (1, 2):
+            self.assertEqual([m for c, m in handled if c == chat_id], list(range(5)))
+
+    def test_busy_when_full(self):
+        self.pool.submit(message(1, 0, 'block'))
+        for message_id in range(1, 10):
+            self.assertTrue(self.pool.submit(message(1, message_id)))
+
+        self.assertFalse(self.pool.submit(message(2, 0)))
+        self.assertEqual(self.pool.pending, 10)
+
+        release.set()
+        self.pool.shutdown(timeout=5)
+        self.assertEqual(self.pool.pending, 0)
+        self.assertFalse(self.pool.submit(message(2, 0)))
+
+    def test_chats_run_in_parallel(self):
+        self.pool.submit(message(1, 0, 'block'))
+        self.pool.submit(message(2, 0))
+        for _ in range(100):
+            if handled:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(handled, [(2, 0)])
+
+
+class TestProcessWorkerPool(unittest.TestCase):
+
+    def test_unpicklable_error(self):
+        pool = MessageWorkerPool(FailingBot, max_workers=2, max_pending=10)
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertTrue(pool.submit(message(1, 0, directory)))
+            self.assertTrue(pool.submit(message(1, 1, directory)))
+            self.assertTrue(pool.submit(message(2, 2, directory)))
+            pool.shutdown(timeout=30)
+
+            self.assertEqual(sorted(os.listdir(directory)), ['1', '2'])
+        self.assertEqual(pool.pending, 0)
+
+    def test_stages_in_flight_reach_the_parent(self):
+        pool = MessageWorkerPool(SlowStageBot, max_workers=1, max_pending=10)
+        with tempfile.TemporaryDirectory() as directory:
+            release_file = os.path.join(directory, 'release')
+            pool.submit(message(1, 0, release_file))
+            for _ in range(100):
+                if in_flight('test_worker_stage') == 1:
+                    break
+                time.sleep(0.05)
+            during = in_flight('test_worker_stage')
+
+            open(release_file, 'w').close()
+            pool.shutdown(timeout=30)
+
+        self.assertEqual(during, 1)
+        self.assertEqual(in_flight('test_worker_stage'), 0)
+
+
+class TestBrokenPool(unittest.TestCase):
+
+    def test_failed_submit_is_not_pending(self):
+        pool = MessageWorkerPool(MockBot, max_workers=1, executor_cls=ThreadPoolExecutor)
+        pool.executor.shutdown()
+        with self.assertRaises(RuntimeError):
+            pool.submit(message(1, 0))
+
+        self.assertEqual(pool.pending, 0)
+        self.assertEqual(pool._chat_queues, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
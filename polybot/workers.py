@@ -0,0 +1,163 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from loguru import logger
+
+try:
+    from polybot.metrics import REGISTRY
+except ImportError:
+    # running from within the polybot directory (the service container)
+    from metrics import REGISTRY
+
+MESSAGES_PENDING = REGISTRY.gauge('messages_pending', 'Messages queued or being handled by the worker pool')
+
+# the bot instance of the current worker process, created by `_init_worker`
+_worker_bot = None
+_parent_pid = os.getpid()
+
+
+# seconds between the metrics a worker process hands over while handling a message, its stages in flight
+METRICS_FLUSH_INTERVAL = 1
+
+
+def _init_worker(bot_factory, metrics_queue=None):
+    global _worker_bot
+    if os.getpid() != _parent_pid:
+        # a forked worker starts with a copy of the parent's metrics, which the parent has already
+        REGISTRY.drain()
+    if metrics_queue is not None:
+        threading.Thread(target=_flush_metrics, args=(metrics_queue,), name='metrics-flush', daemon=True).start()
+    _worker_bot = bot_factory()
+
+
+def _flush_metrics(metrics_queue):
+    # an exiting worker doesn't wait for the parent to read its last metrics
+    metrics_queue.cancel_join_thread()
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        metrics_queue.put(REGISTRY.drain())
+
+
+def _handle_message(msg):
+    """
+    Returns the metrics recorded while handling `msg`, for the parent process to merge. Exceptions are logged
+    here, where the traceback is, and not sent back: some can't be unpickled in the parent (e.g. telebot's
+    `ApiTelegramException`), which would break the whole pool.
+    """
+    try:
+        _worker_bot.handle_message(msg)
+    except Exception:
+        logger.exception(f'Failed to handle message of chat {msg["chat"]["id"]}')
+    return REGISTRY.drain()
+
+
+class MessageWorkerPool:
+    """
+    Runs `handle_message` of Telegram messages on a pool of worker processes, so the webhook can
+    acknowledge a message right away and the CPU bound work scales with the number of cores.
+
+    - Every worker builds its own bot with `bot_factory`, a picklable callable (e.g. a `functools.partial`
+      of the bot class with `set_webhook=False`).
+    - Messages of the same chat are handled one at a time, in the order they were submitted.
+      Different chats are handled in parallel.
+    - At most `max_pending` messages may be queued or running, `submit` returns False above it.
+    - `shutdown` stops accepting messages and waits until every accepted message was handled.
+    - The metrics of the workers are merged into this process's registry when a message is handled, and every
+      METRICS_FLUSH_INTERVAL seconds in between, so /metrics shows the stages in flight in the workers.
+    """
+
+    def __init__(self, bot_factory, max_workers=None, max_pending=100, executor_cls=ProcessPoolExecutor):
+        self.max_pending = max_pending
+        # worker processes also hand their metrics over while handling a message, merged by a thread here
+        self._metrics_queue = multiprocessing.Queue() if issubclass(executor_cls, ProcessPoolExecutor) else None
+        self.executor = executor_cls(max_workers=max_workers, initializer=_init_worker,
+                                     initargs=(bot_factory, self._metrics_queue))
+        if self._metrics_queue is not None:
+            threading.Thread(target=self._merge_metrics, name='metrics-merge', daemon=True).start()
+
+        self._lock = threading.RLock()
+        self._idle = threading.Condition(self._lock)
+        self._chat_queues = {}
+        self._pending = 0
+        self._accepting = True
+
+    def _merge_metrics(self):
+        for metrics in iter(self._metrics_queue.get, None):
+            REGISTRY.merge(metrics)
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def submit(self, msg):
+        """
+        Queues `msg` for handling. Returns False if the pool is full or shutting down.
+        """
+        chat_id = msg['chat']['id']
+        with self._lock:
+            if not self._accepting or self._pending >= self.max_pending:
+                return False
+
+            self._pending += 1
+            MESSAGES_PENDING.set(self._pending)
+            if chat_id in self._chat_queues:
+                # a message of this chat is running, this one starts when it's done
+                self._chat_queues[chat_id].append(msg)
+            else:
+                self._chat_queues[chat_id] = deque()
+                try:
+                    self._run(chat_id, msg)
+                except Exception:
+                    # e.g. a broken pool, the message was never accepted
+                    del self._chat_queues[chat_id]
+                    self._pending -= 1
+                    MESSAGES_PENDING.set(self._pending)
+                    raise
+        return True
+
+    def _run(self, chat_id, msg):
+        future = self.executor.submit(_handle_message, msg)
+        future.add_done_callback(lambda done: self._on_done(chat_id, done))
+
+    def _on_done(self, chat_id, future):
+        if future.exception() is not None:
+            # the worker died or the message couldn't be sent to it
+            logger.opt(exception=future.exception()).error(f'Failed to handle message of chat {chat_id}')
+        else:
+            REGISTRY.merge(future.result())
+
+        with self._lock:
+            self._pending -= 1
+            queue = self._chat_queues[chat_id]
+            started = False
+            if queue:
+                try:
+                    self._run(chat_id, queue.popleft())
+                    started = True
+                except Exception:
+                    # e.g. a broken pool, the chat's queued messages can't be handled anymore
+                    logger.exception(f'Failed to submit {len(queue) + 1} messages of chat {chat_id}, dropping them')
+                    self._pending -= len(queue) + 1
+            MESSAGES_PENDING.set(self._pending)
+            if not started:
+                del self._chat_queues[chat_id]
+                if not self._pending:
+                    self._idle.notify_all()
+
+    def shutdown(self, timeout=None):
+        """
+        Stops accepting messages, waits (up to `timeout` seconds) for the accepted ones and stops the workers.
+        """
+        with self._lock:
+            self._accepting = False
+            drained = self._idle.wait_for(lambda: not self._pending, timeout=timeout)
+        if not drained:
+            logger.warning(f'Shutting down with {self._pending} messages not handled')
+
+        self.executor.shutdown(wait=drained)
+        if self._metrics_queue is not None:
+            self._metrics_queue.put(None)
@@ -1,110 +1,249 @@
+import atexit
+import io
+import signal
+import sys
+import threading
 import time
 from pathlib import Path
 from flask import Flask, request, jsonify
-from detect import run
-import uuid
+from detections import Detections
+from batching import BatchScheduler
+from job_queue import create_broker
+from consumers import PredictionConsumerPool
+from metrics import TRACE_HEADER, instrument, new_trace_id, stage
+from s3_transfer import transfer_config
 import yaml
 from loguru import logger
 import os
-import boto3
 import time
-import pymongo
 import json
 
 images_bucket = os.environ['BUCKET_NAME']
 mongo_string = os.environ['MONGOLITE']
+# class id to name table, loaded once, detections are summarized with it
 with open("data/coco128.yaml", "r") as stream:
     names = yaml.safe_load(stream)['names']
 
-# Initialize the S3 client
-s3 = boto3.client('s3')
+# Created by `warm_up`, after the server started listening: torch and the yolov5 code, cv2, boto3 and pymongo
+# are only imported there, and `ready` is set once they're all loaded
+s3 = None
+predictions_writer = None
+engine = None
+prediction_cache = None
+batcher = None
+consumers = None
+ready = threading.Event()
+
+
+def warm_up():
+    global s3, predictions_writer, engine, prediction_cache, batcher, consumers
+
+    import pymongo
+    from engine import InferenceEngine
+    from prediction_cache import PredictionCache
+    from s3_transfer import create_s3_client
+    from storage import PredictionWriter
+
+    # Initialize the S3 client
+    s3 = create_s3_client()
+
+    # One pooled Mongo client for the process, prediction summaries are written in batches of up to
+    # MONGO_BATCH_SIZE, at least every MONGO_FLUSH_INTERVAL seconds, and flushed on shutdown
+    mongo_client = pymongo.MongoClient(mongo_string)
+    predictions_writer = PredictionWriter(
+        mongo_client["mongo1"]["Yolo5"],
+        max_batch=int(os.environ.get('MONGO_BATCH_SIZE', 50)),
+        flush_interval=float(os.environ.get('MONGO_FLUSH_INTERVAL', 1))
+    )
+    atexit.register(predictions_writer.close)
+
+    # Load the model once, every prediction reuses it
+    engine = InferenceEngine(weights='yolov5s.pt', data='data/coco128.yaml')
+
+    # Predictions of images already seen (same bytes, same model) are served from the cache, kept in memory and
+    # in Mongo for PREDICTION_CACHE_TTL seconds
+    prediction_cache = PredictionCache(
+        mongo_client["mongo1"]["Yolo5PredictionCache"],
+        f'{engine.version}-{Detections.FORMAT}',
+        max_entries=int(os.environ.get('PREDICTION_CACHE_SIZE', 1024)),
+        ttl_seconds=int(os.environ.get('PREDICTION_CACHE_TTL', 7 * 24 * 3600))
+    )
+
+    # Concurrent predictions are run together, in batches of up to BATCH_MAX_SIZE images collected for up to
+    # BATCH_MAX_WAIT_MS milliseconds
+    batcher = BatchScheduler(
+        engine.predict_batch,
+        max_batch_size=int(os.environ.get('BATCH_MAX_SIZE', 8)),
+        max_wait_ms=float(os.environ.get('BATCH_MAX_WAIT_MS', 10))
+    )
+
+    # With JOB_QUEUE_URL set, predictions are also pulled as jobs from the queue polybot sends them to. The
+    # number of consumer threads follows the queue depth, between QUEUE_MIN_CONSUMERS and QUEUE_MAX_CONSUMERS
+    if os.environ.get('JOB_QUEUE_URL'):
+        consumers = PredictionConsumerPool(
+            create_broker(os.environ['JOB_QUEUE_URL']),
+            predict_job,
+            min_consumers=int(os.environ.get('QUEUE_MIN_CONSUMERS', 1)),
+            max_consumers=int(os.environ.get('QUEUE_MAX_CONSUMERS', 8)),
+            jobs_per_consumer=int(os.environ.get('QUEUE_JOBS_PER_CONSUMER', 4)),
+            visibility_timeout=int(os.environ.get('QUEUE_VISIBILITY_TIMEOUT', 60))
+        )
+        consumers.start()
+        atexit.register(consumers.stop)
+
+    ready.set()
+    logger.info('yolo5 ready')
+
+
+def start_warm_up():
+    try:
+        warm_up()
+    except Exception:
+        # let the container restart instead of staying up and never ready
+        logger.exception('yolo5 failed to start')
+        os._exit(1)
+
 
 app = Flask(__name__)
+# /metrics, with the stage metrics of the predictions and of the HTTP requests
+instrument(app)
+
+
+@app.before_request
+def wait_for_warm_up():
+    if not ready.is_set() and request.endpoint not in ('index', 'readiness', 'metrics'):
+        return 'Starting', 503
+
+
+@app.route('/', methods=['GET'])
+def index():
+    return 'Ok'
+
+
+@app.route('/ready', methods=['GET'])
+def readiness():
+    if not ready.is_set():
+        return 'Starting', 503
+    return 'Ok'
+
+
+@app.route('/stats/batching', methods=['GET'])
+def batching_stats():
+    return jsonify(batcher.stats())
+
+
+@app.route('/stats/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(prediction_cache.stats())
+
+
+@app.route('/stats/queue', methods=['GET'])
+def queue_stats():
+    if consumers is None:
+        return 'Job queue mode is off (JOB_QUEUE_URL is not set)', 404
+    return jsonify(consumers.stats())
 
 
 @app.route('/predict', methods=['POST'])
 def predict():
-    # Generates a UUID for this current prediction HTTP request. This id can be used as a reference in logs to
-    # identify and track individual prediction requests.
-    prediction_id = str(uuid.uuid4())
-
-    logger.info(f'prediction: {prediction_id}. start processing')
+    # The id of this current prediction HTTP request, used as a reference in logs to identify and track individual
+    # prediction requests. polybot sends it as the trace id of the message, so the logs of both services match.
+    prediction_id = request.headers.get(TRACE_HEADER) or new_trace_id()
 
     # Receives a URL parameter representing the image to download from S3
     img_name = request.args.get('imgName')
 
-    # TODO download img_name from S3, store the local image path in original_img_path
-    #  The bucket name should be provided as an env var BUCKET_NAME.
+    with stage('prediction', prediction_id):
+        prediction_summary = run_prediction(prediction_id, img_name)
+    if prediction_summary is None:
+        return f'prediction: {prediction_id}/{img_name.split("/")[-1]}. prediction result not found', 404
+    return prediction_summary  # Return the JSON response to the client
+
+
+def predict_job(job):
+    """
+    Runs the prediction of a job pulled from the job queue, returns the summary to send back to polybot.
+    """
+    prediction_id = job.get('trace_id') or new_trace_id()
+    with stage('prediction', prediction_id):
+        prediction_summary = run_prediction(prediction_id, job['imgName'])
+    if prediction_summary is None:
+        return {'error': f'prediction: {prediction_id}. prediction result not found'}
+    return prediction_summary
+
+
+def run_prediction(prediction_id, img_name):
+    """
+    Predicts the objects in the S3 image `img_name`, returns the prediction summary or None if nothing was detected.
+    """
+    logger.info(f'prediction: {prediction_id}. start processing')
+
+    # Downloads img_name from S3 (the bucket is given by the BUCKET_NAME env var) into memory
     filename = img_name.split('/')[-1]  # Get the filename alone as srt
-    """local_dir = 'photos/'  # str of dir to save to
-    os.makedirs(local_dir, exist_ok=True)"""  # make sure the dir exists
-    original_img_path = filename  # assign the full path of the file to download
-    s3.download_file(images_bucket, filename, original_img_path)  # download the file
+    original_img_path = filename
+    buffer = io.BytesIO()
+    with stage('s3_download', prediction_id):
+        s3.download_fileobj(images_bucket, filename, buffer, Config=transfer_config())
 
     logger.info(f'prediction id: {prediction_id}, path: \"{original_img_path}\" Download img completed')
 
-    # Predicts the objects in the image
-    result = run(
-        weights='yolov5s.pt',
-        data='data/coco128.yaml',
-        source=original_img_path,
-        project='static/data',
-        name=prediction_id,
-        save_txt=True
-    )
-
-    logger.info(f'prediction: {prediction_id}, path: {original_img_path}. done')
-
-    # This is the path for the predicted image with labels The predicted image typically includes bounding boxes
-    # drawn around the detected objects, along with class labels and possibly confidence scores.
-    # predicted_img_path = Path(f'static/data/{prediction_id}/{original_img_path}')  # get the result path
-
-    # TODO Uploads the predicted image (predicted_img_path) to S3 (be careful not to override the original image).
-
-    predicted_img_name = f'predicted_{filename}'  # assign the new name
-    os.rename(f'/usr/src/app/static/data/{prediction_id}/{filename}',
-              f'/usr/src/app/static/data/{prediction_id}/{predicted_img_name}')  # rename the file before upload
-    s3_path_to_upload_to = predicted_img_name  # assign the path on s3 as str
-    file_to_upload = f'/usr/src/app/static/data/{prediction_id}/{predicted_img_name}'  # assign the path locally as str
-    s3.upload_file(file_to_upload, images_bucket, s3_path_to_upload_to)  # upload the file to same path with new name s3
-    os.rename(f'/usr/src/app/static/data/{prediction_id}/{predicted_img_name}',
-              f'/usr/src/app/static/data/{prediction_id}/{filename}')  # rename the file back after upload
-
-    pred_summary_path = Path(f'/usr/src/app/static/data/{prediction_id}/labels/{original_img_path.split(".")[0]}.txt')
-    logger.info(f'prediction: {prediction_id}, path: {original_img_path}. pred_path: {pred_summary_path} debug!!!')
-    if pred_summary_path.exists():
-        logger.info(f'prediction: {prediction_id}, path: {original_img_path}. pred_path: {pred_summary_path} InnerIF:D')
-        with open(pred_summary_path) as f:
-            labels = f.read().splitlines()
-            labels = [line.split(' ') for line in labels]
-            labels = [{
-                'class': names[int(l[0])],
-                'cx': float(l[1]),
-                'cy': float(l[2]),
-                'width': float(l[3]),
-                'height': float(l[4]),
-            } for l in labels]
-
-        logger.info(f'prediction: {prediction_id}/{original_img_path}. prediction summary:\n\n{labels}')
-        pred_summary_path_str = str(pred_summary_path)
+    with stage('cache_lookup', prediction_id):
+        cache_key = prediction_cache.key(buffer.getbuffer())
+        cached = prediction_cache.get(cache_key)
+    if cached is not None:
+        # Same image already predicted, its predicted image is in S3 already too
+        detections = Detections.from_dict(cached['detections'])
+        predicted_img_name = cached['predicted_img_path']
+        logger.info(f'prediction: {prediction_id}, path: {original_img_path}. served from cache '
+                    f'(saving {cached["inference_time"] * 1000:.1f}ms), cache stats: {prediction_cache.stats()}')
+    else:
+        # Predicts the objects in the image (cv2 is imported with the model, by the warm up)
+        import cv2
+        start = time.perf_counter()
+        with stage('decode', prediction_id):
+            # at the lowest resolution the model input needs, the predicted image is saved at it too
+            img = engine.decode(buffer.getbuffer())
+        with stage('inference', prediction_id):
+            det = batcher.predict(img)
+            detections = engine.detections(det, img.shape)
+        inference_time = time.perf_counter() - start
+
+        logger.info(f'prediction: {prediction_id}, path: {original_img_path}. done in {inference_time * 1000:.1f}ms '
+                    f'(model cold start was {engine.cold_start_time:.2f}s)')
+
+        # Uploads the image with the predicted boxes drawn on it to S3 (be careful not to override the original
+        # image)
+        predicted_img_name = f'predicted_{filename}'
+        with stage('annotate', prediction_id):
+            _, encoded = cv2.imencode(Path(filename).suffix or '.jpg', engine.annotate(img, det))
+        with stage('s3_upload', prediction_id):
+            s3.upload_fileobj(io.BytesIO(encoded), images_bucket, predicted_img_name, Config=transfer_config())
+
+        with stage('cache_store', prediction_id):
+            prediction_cache.put(cache_key, detections.to_dict(), predicted_img_name, inference_time)
+
+    if len(detections):
+        classes = detections.summarize(names)
+        logger.info(f'prediction: {prediction_id}/{original_img_path}. prediction summary:\n\n{classes}')
         prediction_summary = {
             'prediction_id': prediction_id,
             'original_img_path': original_img_path,
-            'predicted_img_path': pred_summary_path_str,
-            'labels': labels,
+            'predicted_img_path': predicted_img_name,
+            'detections': detections.to_dict(),
+            'classes': classes,
             'time': time.time()
         }
 
-        client = pymongo.MongoClient(mongo_string)
-        db = client["mongo1"]
-        collection = db["Yolo5"]
-        collection.insert_one(prediction_summary)
-        prediction_summary.pop("_id")
+        predictions_writer.write(prediction_summary)
+        return prediction_summary
 
-        return prediction_summary  # Return the JSON response to the client
-    else:
-        return f'prediction: {prediction_id}/{original_img_path}. prediction result not found', 404
+    logger.info(f'prediction: {prediction_id}/{original_img_path}. prediction result not found')
+    return None
 
 
 if __name__ == "__main__":
+    # exit normally on docker stop, so the atexit handlers flush the buffered predictions
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    threading.Thread(target=start_warm_up, name='warm-up', daemon=True).start()
+
     app.run(host='0.0.0.0', port=8081)
@@ -0,0 +1,99 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from loguru import logger
+
+try:
+    from yolo5.metrics import REGISTRY
+except ImportError:
+    # running from within the yolo5 directory (the service container)
+    from metrics import REGISTRY
+
+
+BATCH_SIZE = REGISTRY.histogram('prediction_batch_size', 'Images per prediction batch',
+                                buckets=[1, 2, 4, 8, 16, 32, 64])
+BATCH_QUEUE_WAIT = REGISTRY.histogram('prediction_batch_queue_wait_seconds',
+                                      'Time images waited for their prediction batch to start',
+                                      buckets=[0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1])
+
+
+class BatchScheduler:
+    """
+    Coalesces concurrent predictions into batches: requests are collected until `max_batch_size` images are
+    waiting or the oldest one has waited `max_wait_ms`, then `predict_batch` runs once for all of them and
+    each caller gets its own result back.
+
+    `predict_batch` is only ever called from the scheduler thread.
+    """
+
+    def __init__(self, predict_batch, max_batch_size=8, max_wait_ms=10):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name='batch-scheduler', daemon=True)
+        self._thread.start()
+
+    def predict(self, img, timeout=None):
+        """
+        Queues `img` for the next batch and blocks until its result is ready.
+        """
+        future = Future()
+        self._queue.put((img, future, time.perf_counter()))
+        return future.result(timeout)
+
+    def close(self):
+        """
+        Runs the queued requests and stops the scheduler thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _loop(self):
+        closing = False
+        while not closing:
+            first = self._queue.get()
+            if first is None:
+                break
+
+            batch = [first]
+            deadline = first[2] + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    request = self._queue.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    closing = True
+                    break
+                batch.append(request)
+
+            self._run(batch)
+
+    def _run(self, batch):
+        start = time.perf_counter()
+        for _, _, queued_at in batch:
+            BATCH_QUEUE_WAIT.observe(start - queued_at)
+        BATCH_SIZE.observe(len(batch))
+
+        try:
+            results = self.predict_batch([img for img, _, _ in batch])
+        except Exception as e:
+            logger.exception(f'Batch of {len(batch)} images failed')
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
+
+    def stats(self):
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'batch_size': BATCH_SIZE.snapshot(),
+            'queue_wait_seconds': BATCH_QUEUE_WAIT.snapshot(),
+        }
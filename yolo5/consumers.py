@@ -0,0 +1,130 @@
+import math
+import threading
+
+from loguru import logger
+
+try:
+    from yolo5.job_queue import PREDICTION_QUEUE, RESULT_QUEUE
+except ImportError:
+    # running from within the yolo5 directory (the service container)
+    from job_queue import PREDICTION_QUEUE, RESULT_QUEUE
+
+
+class PredictionConsumerPool:
+    """
+    Threads pulling prediction jobs (`{chat_id, imgName}`) from the broker, running `handle_job` on them and
+    sending `{chat_id, imgName, summary}` to the result queue.
+
+    A job is deleted only once its result is sent, so a consumer dying mid-job lets it come back after
+    `visibility_timeout`. Jobs received more than `max_receives` times get an error result instead.
+
+    Every `scale_interval` seconds the number of consumers is set from the queue depth: one consumer per
+    `jobs_per_consumer` queued or in flight jobs, between `min_consumers` and `max_consumers`.
+    """
+
+    def __init__(self, broker, handle_job, min_consumers=1, max_consumers=8, jobs_per_consumer=4,
+                 visibility_timeout=60, max_receives=5, scale_interval=5, wait_time=1):
+        self.broker = broker
+        self.handle_job = handle_job
+        self.min_consumers = min_consumers
+        self.max_consumers = max_consumers
+        self.jobs_per_consumer = jobs_per_consumer
+        self.visibility_timeout = visibility_timeout
+        self.max_receives = max_receives
+        self.scale_interval = scale_interval
+        self.wait_time = wait_time
+
+        self._consumers = []
+        self._stopped = threading.Event()
+        self._scaler = threading.Thread(target=self._scale_loop, name='consumer-scaler', daemon=True)
+
+    def start(self):
+        self.scale()
+        self._scaler.start()
+
+    def stop(self):
+        """
+        Stops the consumers after the jobs they're handling.
+        """
+        self._stopped.set()
+        if self._scaler.is_alive():
+            self._scaler.join()
+        for stop, thread in self._consumers:
+            stop.set()
+        for stop, thread in self._consumers:
+            thread.join()
+        self._consumers = []
+
+    def desired_consumers(self):
+        visible, in_flight = self.broker.depth(PREDICTION_QUEUE)
+        desired = math.ceil((visible + in_flight) / self.jobs_per_consumer)
+        return max(self.min_consumers, min(self.max_consumers, desired))
+
+    def scale(self):
+        desired = self.desired_consumers()
+        self._consumers = [(stop, thread) for stop, thread in self._consumers if thread.is_alive()]
+
+        while len(self._consumers) < desired:
+            stop = threading.Event()
+            thread = threading.Thread(target=self._consume, args=(stop,), name='prediction-consumer', daemon=True)
+            thread.start()
+            self._consumers.append((stop, thread))
+        while len(self._consumers) > desired:
+            stop, _ = self._consumers.pop()
+            stop.set()
+
+        return desired
+
+    def _scale_loop(self):
+        while not self._stopped.wait(self.scale_interval):
+            previous = len(self._consumers)
+            try:
+                desired = self.scale()
+            except Exception:
+                # e.g. a locked SQLite database, the consumers are scaled (and dead ones replaced) next time
+                logger.exception('Failed to scale the prediction consumers')
+                continue
+            if desired != previous:
+                logger.info(f'Prediction consumers scaled from {previous} to {desired}')
+
+    def _consume(self, stop):
+        """
+        Handles jobs until `stop` is set. Broker errors never end the loop: a failed receive is retried after
+        `wait_time`, a job whose result failed to be sent or deleted comes back after the visibility timeout.
+        """
+        while not stop.is_set():
+            try:
+                messages = self.broker.receive(PREDICTION_QUEUE, visibility_timeout=self.visibility_timeout,
+                                               wait_time=self.wait_time)
+            except Exception:
+                logger.exception('Failed to receive prediction jobs')
+                stop.wait(self.wait_time)
+                continue
+
+            for message in messages:
+                job = message.body
+                if message.receive_count > self.max_receives:
+                    logger.error(f'Giving up on job {job} after {self.max_receives} attempts')
+                    summary = {'error': 'Prediction failed'}
+                else:
+                    try:
+                        summary = self.handle_job(job)
+                    except Exception:
+                        # the job comes back after the visibility timeout
+                        logger.exception(f'Job {job} failed (attempt {message.receive_count})')
+                        continue
+
+                try:
+                    self.broker.send(RESULT_QUEUE, {**job, 'summary': summary})
+                    self.broker.delete(PREDICTION_QUEUE, message.receipt)
+                except Exception:
+                    logger.exception(f'Failed to send the result of job {job} (attempt {message.receive_count})')
+
+    def stats(self):
+        visible, in_flight = self.broker.depth(PREDICTION_QUEUE)
+        return {
+            'queued': visible,
+            'in_flight': in_flight,
+            'consumers': len(self._consumers),
+            'desired_consumers': self.desired_consumers(),
+        }
@@ -0,0 +1,77 @@
+import numpy as np
+
+
+class Detections:
+    """
+    Detections of one image as columns: `class_ids` (N,), `boxes` (N, 4) of normalized center/size
+    (cx, cy, width, height) and `confidences` (N,).
+
+    Class names are not stored, they're looked up in the names table (the `names` of coco128.yaml) when the
+    detections are summarized.
+    """
+
+    # part of the prediction cache key, so cached entries of another format are never read
+    FORMAT = 'columnar-1'
+
+    def __init__(self, class_ids, boxes, confidences):
+        self.class_ids = np.asarray(class_ids, dtype=np.int64).reshape(-1)
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.confidences = np.asarray(confidences, dtype=np.float64).reshape(-1)
+
+    @classmethod
+    def from_xyxy(cls, det, img_shape):
+        """
+        From an Nx6 array of (x1, y1, x2, y2, confidence, class) in pixels of an image of shape `img_shape`.
+        """
+        det = np.asarray(det, dtype=np.float64).reshape(-1, 6)
+        height, width = img_shape[:2]
+        gain = np.array([width, height, width, height], dtype=np.float64)
+
+        x1, y1, x2, y2 = det[:, :4].T
+        boxes = np.stack([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], axis=1) / gain
+        return cls(det[:, 5], boxes, det[:, 4])
+
+    def __len__(self):
+        return len(self.class_ids)
+
+    def to_dict(self):
+        """
+        Compact JSON/BSON form, with the boxes flattened and rounded to 4 decimals and the confidences to 3.
+        """
+        return {
+            'class_ids': self.class_ids.tolist(),
+            'boxes': np.round(self.boxes, 4).ravel().tolist(),
+            'confidences': np.round(self.confidences, 3).tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['class_ids'], d['boxes'], d['confidences'])
+
+    def summarize(self, names):
+        """
+        Per class name: `count`, `mean_confidence`, `max_confidence` and `area` (the sum of the box areas, as a
+        fraction of the image), the most detected classes first.
+        """
+        if not len(self):
+            return {}
+
+        class_ids, inverse, counts = np.unique(self.class_ids, return_inverse=True, return_counts=True)
+        confidence_sums = np.bincount(inverse, weights=self.confidences)
+        max_confidences = np.zeros(len(class_ids))
+        np.maximum.at(max_confidences, inverse, self.confidences)
+        areas = np.bincount(inverse, weights=self.boxes[:, 2] * self.boxes[:, 3])
+
+        order = np.argsort(-counts, kind='stable')
+        return {
+            names[class_id]: {
+                'count': count,
+                'mean_confidence': round(confidence_sum / count, 3),
+                'max_confidence': round(max_confidence, 3),
+                'area': round(area, 4),
+            }
+            for class_id, count, confidence_sum, max_confidence, area in zip(
+                class_ids[order].tolist(), counts[order].tolist(), confidence_sums[order].tolist(),
+                max_confidences[order].tolist(), areas[order].tolist()
+            )
+        }
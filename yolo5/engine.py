@@ -0,0 +1,112 @@
+import hashlib
+import io
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+from loguru import logger
+from PIL import Image
+
+from detections import Detections
+from models.common import DetectMultiBackend
+from utils.augmentations import letterbox
+from utils.general import check_img_size, non_max_suppression, scale_boxes
+from utils.plots import Annotator, colors
+from utils.torch_utils import select_device
+
+
+class InferenceEngine:
+    """
+    YOLOv5 model loaded once and kept in memory, predicting on decoded images without touching the disk.
+    The defaults are the ones `detect.run` used.
+    """
+
+    def __init__(self, weights='yolov5s.pt', data='data/coco128.yaml', imgsz=640, conf_thres=0.25,
+                 iou_thres=0.45, max_det=1000, device=''):
+        start = time.perf_counter()
+
+        self.device = select_device(device)
+        self.model = DetectMultiBackend(weights, device=self.device, data=data)
+        self.names = self.model.names
+        self.imgsz = check_img_size((imgsz, imgsz), s=self.model.stride)
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.max_det = max_det
+
+        # identifies the weights and the settings the detections depend on, e.g. for caching them
+        weights_hash = hashlib.sha256(Path(weights).read_bytes()).hexdigest()[:12]
+        self.version = f'{Path(weights).stem}-{weights_hash}-{imgsz}-{conf_thres}-{iou_thres}-{max_det}'
+
+        self.model.warmup(imgsz=(1, 3, *self.imgsz))
+        self.cold_start_time = time.perf_counter() - start
+        logger.info(f'Model {weights} loaded and warmed up in {self.cold_start_time:.2f}s')
+
+    def decode(self, data):
+        """
+        Decodes an encoded image (as uploaded to S3) to BGR, scaled down by the largest of 2, 4 or 8 that keeps its
+        longer side at least the model input size. JPEG is scaled down while decoding, which is much cheaper than
+        decoding it in full for `preprocess` to shrink it, and the boxes are scaled back to the decoded image,
+        whose normalized coordinates are the same as the original's.
+        """
+        with Image.open(io.BytesIO(data)) as header:
+            longer_side = max(header.size)
+
+        factor = 1
+        while factor < 8 and longer_side // (factor * 2) >= max(self.imgsz):
+            factor *= 2
+        flags = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+                 8: cv2.IMREAD_REDUCED_COLOR_8}[factor]
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+    def preprocess(self, imgs, auto=True):
+        """
+        Letterboxes BGR images (as decoded by cv2) into a normalized Nx3xHxW model input tensor.
+        With `auto` the padding is the minimal one for the stride, which only fits a batch of one image,
+        otherwise every image is padded to the full input size.
+        """
+        batch = np.stack([letterbox(img, self.imgsz, stride=self.model.stride, auto=auto and self.model.pt)[0]
+                          for img in imgs])
+        batch = np.ascontiguousarray(batch.transpose((0, 3, 1, 2))[:, ::-1])  # NHWC to NCHW, BGR to RGB
+        im = torch.from_numpy(batch).to(self.model.device)
+        im = im.half() if self.model.fp16 else im.float()
+        im /= 255
+        return im
+
+    def predict(self, img):
+        """
+        Returns the detections of a BGR image as a Nx6 tensor of (x1, y1, x2, y2, confidence, class),
+        in pixels of `img`.
+        """
+        return self._predict([img], auto=True)[0]
+
+    def predict_batch(self, imgs):
+        """
+        `predict` for several images at once, in a single forward pass.
+        """
+        return self._predict(imgs, auto=len(imgs) == 1)
+
+    @torch.no_grad()
+    def _predict(self, imgs, auto):
+        im = self.preprocess(imgs, auto)
+        pred = self.model(im)
+        dets = non_max_suppression(pred, self.conf_thres, self.iou_thres, max_det=self.max_det)
+        for img, det in zip(imgs, dets):
+            det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], img.shape).round()
+        return dets
+
+    def detections(self, det, img_shape):
+        """
+        The detections of `predict` as columnar `Detections`, with the boxes normalized to `img_shape`.
+        """
+        return Detections.from_xyxy(det.cpu().numpy(), img_shape)
+
+    def annotate(self, img, det):
+        """
+        Returns a copy of `img` with the boxes, class names and confidences drawn on it, like detect.py saves.
+        """
+        annotator = Annotator(img.copy(), example=str(self.names))
+        for *xyxy, conf, cls in reversed(det.tolist()):
+            annotator.box_label(xyxy, f'{self.names[int(cls)]} {conf:.2f}', color=colors(int(cls), True))
+        return annotator.result()
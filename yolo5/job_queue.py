@@ -0,0 +1,185 @@
+"""
+Job queues between polybot and yolo5, with SQS like semantics: a received message is hidden from other
+consumers for a visibility timeout and comes back unless it's deleted before the timeout ends.
+
+The broker is chosen by URL (`create_broker`):
+- memory://                     queues inside the current process, shared by all its users (tests, local runs)
+- sqlite:////path/to/jobs.db    queues in a SQLite file, shared by the processes/containers mounting it
+
+This file is the same in polybot and yolo5.
+"""
+import collections
+import contextlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+PREDICTION_QUEUE = 'predictions'
+RESULT_QUEUE = 'prediction-results'
+
+Message = collections.namedtuple('Message', 'id body receipt receive_count')
+
+
+class Broker:
+
+    def send(self, queue, body):
+        """
+        Adds a message with the JSON serializable `body` to `queue`.
+        """
+        raise NotImplementedError()
+
+    def receive(self, queue, max_messages=1, visibility_timeout=30, wait_time=0):
+        """
+        Returns up to `max_messages` visible messages of `queue`, waiting up to `wait_time` seconds for one.
+        The messages stay hidden for `visibility_timeout` seconds.
+        """
+        raise NotImplementedError()
+
+    def delete(self, queue, receipt):
+        """
+        Acknowledges a received message. Does nothing if the visibility timeout ended and it was received again.
+        """
+        raise NotImplementedError()
+
+    def depth(self, queue):
+        """
+        Returns the number of visible and of in flight (received, not deleted) messages in `queue`.
+        """
+        raise NotImplementedError()
+
+
+class InMemoryBroker(Broker):
+
+    def __init__(self):
+        self._queues = collections.defaultdict(collections.OrderedDict)
+        self._changed = threading.Condition()
+
+    def send(self, queue, body):
+        message_id = str(uuid.uuid4())
+        with self._changed:
+            self._queues[queue][message_id] = {'body': json.dumps(body), 'visible_at': 0, 'receipt': None,
+                                               'receive_count': 0}
+            self._changed.notify_all()
+        return message_id
+
+    def receive(self, queue, max_messages=1, visibility_timeout=30, wait_time=0):
+        deadline = time.time() + wait_time
+        with self._changed:
+            while True:
+                now = time.time()
+                messages = []
+                for message_id, message in self._queues[queue].items():
+                    if len(messages) == max_messages:
+                        break
+                    if message['visible_at'] <= now:
+                        message.update(visible_at=now + visibility_timeout, receipt=str(uuid.uuid4()),
+                                       receive_count=message['receive_count'] + 1)
+                        messages.append(Message(message_id, json.loads(message['body']), message['receipt'],
+                                                message['receive_count']))
+
+                remaining = deadline - now
+                if messages or remaining <= 0:
+                    return messages
+                # wake up on new messages, or when a visibility timeout may have ended
+                self._changed.wait(min(remaining, 0.1))
+
+    def delete(self, queue, receipt):
+        with self._changed:
+            for message_id, message in self._queues[queue].items():
+                if message['receipt'] == receipt:
+                    del self._queues[queue][message_id]
+                    return
+
+    def depth(self, queue):
+        now = time.time()
+        with self._changed:
+            visible = sum(message['visible_at'] <= now for message in self._queues[queue].values())
+            return visible, len(self._queues[queue]) - visible
+
+
+class SQLiteBroker(Broker):
+
+    def __init__(self, path, poll_interval=0.1):
+        self.path = path
+        self.poll_interval = poll_interval
+        with contextlib.closing(self._connect()) as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    queue TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    visible_at REAL NOT NULL,
+                    receipt TEXT,
+                    receive_count INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            connection.execute('CREATE INDEX IF NOT EXISTS messages_queue ON messages (queue, visible_at)')
+
+    def _connect(self):
+        # a connection per call, so the broker can be shared by threads
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def send(self, queue, body):
+        with contextlib.closing(self._connect()) as connection:
+            cursor = connection.execute('INSERT INTO messages (queue, body, visible_at) VALUES (?, ?, 0)',
+                                        (queue, json.dumps(body)))
+            return str(cursor.lastrowid)
+
+    def receive(self, queue, max_messages=1, visibility_timeout=30, wait_time=0):
+        deadline = time.time() + wait_time
+        while True:
+            messages = self._receive(queue, max_messages, visibility_timeout)
+            if messages or time.time() >= deadline:
+                return messages
+            time.sleep(self.poll_interval)
+
+    def _receive(self, queue, max_messages, visibility_timeout):
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            rows = connection.execute(
+                'SELECT id, body, receive_count FROM messages WHERE queue = ? AND visible_at <= ? ORDER BY id LIMIT ?',
+                (queue, now, max_messages)
+            ).fetchall()
+            messages = []
+            for message_id, body, receive_count in rows:
+                receipt = str(uuid.uuid4())
+                connection.execute('UPDATE messages SET visible_at = ?, receipt = ?, receive_count = ? WHERE id = ?',
+                                   (now + visibility_timeout, receipt, receive_count + 1, message_id))
+                messages.append(Message(str(message_id), json.loads(body), receipt, receive_count + 1))
+            connection.execute('COMMIT')
+            return messages
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise
+        finally:
+            connection.close()
+
+    def delete(self, queue, receipt):
+        with contextlib.closing(self._connect()) as connection:
+            connection.execute('DELETE FROM messages WHERE queue = ? AND receipt = ?', (queue, receipt))
+
+    def depth(self, queue):
+        now = time.time()
+        with contextlib.closing(self._connect()) as connection:
+            visible, in_flight = connection.execute(
+                'SELECT COALESCE(SUM(visible_at <= ?), 0), COALESCE(SUM(visible_at > ?), 0) FROM messages WHERE queue = ?',
+                (now, now, queue)
+            ).fetchone()
+        return visible, in_flight
+
+
+_memory_broker = InMemoryBroker()
+
+
+def create_broker(url):
+    if url == 'memory://':
+        return _memory_broker
+    if url.startswith('sqlite:///'):
+        return SQLiteBroker(url[len('sqlite:///'):])
+    raise ValueError(f'Unsupported job queue URL: {url}')
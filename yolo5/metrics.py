@@ -0,0 +1,270 @@
+"""
+Prometheus style metrics, rendered in the text exposition format on the apps' /metrics route.
+
+Requests are traced by id (the prediction id, created by polybot and sent to yolo5 in the X-Trace-Id header or
+in the job): every `stage` of a traced request logs its duration with the id, so the logs of both services
+break a slow request down stage by stage, while the stage histograms show where time goes overall.
+
+This file is the same in polybot and yolo5.
+"""
+import bisect
+import contextlib
+import threading
+import time
+import uuid
+
+from loguru import logger
+
+TRACE_HEADER = 'X-Trace-Id'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def new_trace_id():
+    return str(uuid.uuid4())
+
+
+def _format_labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.label_names)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f'{self.name}{_format_labels(self.label_names, key)} {value}']
+
+    def drain(self):
+        """
+        Returns the values and resets them, see `Registry.drain`.
+        """
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def merge(self, values):
+        for key, value in values.items():
+            self.inc(value, **dict(zip(self.label_names, key)))
+
+
+class Gauge(_Metric):
+    """
+    The changes since the last drain are kept apart from the value, and are what a worker process hands over:
+    merged into the value of the process serving /metrics, a worker's stages in flight add up with its own.
+    """
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._changes = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._add(key, value - self._values.get(key, 0))
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._add(key, amount)
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _add(self, key, amount):
+        self._values[key] = self._values.get(key, 0) + amount
+        self._changes[key] = self._changes.get(key, 0) + amount
+
+    def drain(self):
+        """
+        Returns the changes since the last drain, the value stays.
+        """
+        with self._lock:
+            changes, self._changes = self._changes, {}
+        return changes
+
+    def merge(self, changes):
+        with self._lock:
+            for key, amount in changes.items():
+                self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def merge(self, values):
+        with self._lock:
+            for key, (counts, total) in values.items():
+                current_counts, current_total = self._values.get(key) or ([0] * len(counts), 0.0)
+                self._values[key] = ([a + b for a, b in zip(current_counts, counts)], current_total + total)
+
+    def snapshot(self, **labels):
+        """
+        The cumulative bucket counts, count and sum of the `labels` series, e.g. for a JSON stats route.
+        """
+        with self._lock:
+            counts, total = self._values.get(self._key(labels)) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts = list(counts)
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets + ['+Inf'], counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {'buckets': buckets, 'count': cumulative, 'sum': total}
+
+    def _samples(self, key, value):
+        counts, total = value
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + ['+Inf'], counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{_format_labels(self.label_names, key, le=bound)} {cumulative}')
+        labels = _format_labels(self.label_names, key)
+        lines.append(f'{self.name}_sum{labels} {total}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, documentation, labels=()):
+        return self._get_or_create(Counter, name, documentation, labels)
+
+    def gauge(self, name, documentation, labels=()):
+        return self._get_or_create(Gauge, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labels, buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+    def drain(self):
+        """
+        Returns the counters, histograms and gauge changes recorded since the last drain and resets them, for a
+        worker process to hand its metrics over to the process serving /metrics (`merge`).
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.drain() for metric in metrics}
+
+    def merge(self, drained):
+        with self._lock:
+            metrics = dict(self._metrics)
+        for name, values in drained.items():
+            if name in metrics:
+                metrics[name].merge(values)
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.histogram('stage_duration_seconds', 'Time spent in each stage of a request', ['stage'])
+STAGE_IN_FLIGHT = REGISTRY.gauge('stage_in_flight', 'Requests currently in each stage', ['stage'])
+STAGE_ERRORS = REGISTRY.counter('stage_errors_total', 'Stages that raised an exception', ['stage'])
+
+HTTP_DURATION = REGISTRY.histogram('http_request_duration_seconds', 'Time to answer HTTP requests', ['route'])
+HTTP_IN_FLIGHT = REGISTRY.gauge('http_requests_in_flight', 'HTTP requests being answered', ['route'])
+HTTP_RESPONSES = REGISTRY.counter('http_responses_total', 'HTTP responses by route and status', ['route', 'status'])
+
+
+@contextlib.contextmanager
+def stage(name, trace_id=None):
+    """
+    Times the block as stage `name` of the request `trace_id`, counting it in flight while it runs and as an
+    error if it raises.
+    """
+    STAGE_IN_FLIGHT.inc(stage=name)
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_IN_FLIGHT.dec(stage=name)
+        STAGE_DURATION.observe(duration, stage=name)
+        if trace_id:
+            logger.info(f'trace: {trace_id}. stage {name} took {duration * 1000:.1f}ms')
+
+
+def instrument(app):
+    """
+    Adds the /metrics route to a Flask app, and the HTTP request metrics of its other routes.
+    """
+    from flask import Response, request
+
+    def route():
+        # the endpoint name rather than the URL rule, which may hold a secret (polybot's webhook has the token)
+        return request.endpoint or 'unmatched'
+
+    @app.before_request
+    def start_timer():
+        request.metrics_start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc(route=route())
+
+    @app.after_request
+    def record(response):
+        HTTP_RESPONSES.inc(route=route(), status=response.status_code)
+        return response
+
+    @app.teardown_request
+    def stop_timer(exception):
+        if hasattr(request, 'metrics_start'):
+            HTTP_IN_FLIGHT.dec(route=route())
+            HTTP_DURATION.observe(time.perf_counter() - request.metrics_start, route=route())
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,100 @@
+import datetime
+import hashlib
+import threading
+from collections import OrderedDict
+
+from loguru import logger
+from pymongo.errors import PyMongoError
+
+
+class PredictionCache:
+    """
+    Detection results keyed by the SHA-256 of the image bytes and the model version, so the same photo sent
+    again (by anyone) skips the inference and the upload of its predicted image.
+
+    An in-process LRU of `max_entries` sits in front of a Mongo collection where entries expire after
+    `ttl_seconds` (TTL index on `created_at`). Mongo failures are logged and treated as misses.
+    """
+
+    def __init__(self, collection, model_version, max_entries=1024, ttl_seconds=7 * 24 * 3600):
+        self.collection = collection
+        self.model_version = model_version
+        self.max_entries = max_entries
+
+        self.memory_hits = 0
+        self.mongo_hits = 0
+        self.misses = 0
+        self.saved_inference_time = 0.0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.collection.create_index('created_at', expireAfterSeconds=ttl_seconds)
+
+    def key(self, data):
+        return f'{self.model_version}:{hashlib.sha256(data).hexdigest()}'
+
+    def get(self, key):
+        """
+        Returns the cached entry (`detections`, `predicted_img_path`, `inference_time`) of `key`, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                self.saved_inference_time += entry['inference_time']
+                return entry
+
+        try:
+            entry = self.collection.find_one({'_id': key}, {'_id': False, 'created_at': False})
+        except PyMongoError as e:
+            logger.warning(f'Prediction cache lookup failed: {e}')
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.mongo_hits += 1
+            self.saved_inference_time += entry['inference_time']
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key, detections, predicted_img_path, inference_time):
+        """
+        Caches the detections of `key` in their compact form (`Detections.to_dict`).
+        """
+        entry = {
+            'detections': detections,
+            'predicted_img_path': predicted_img_path,
+            'inference_time': inference_time,
+        }
+        with self._lock:
+            self._remember(key, entry)
+
+        try:
+            self.collection.replace_one(
+                {'_id': key},
+                {**entry, 'created_at': datetime.datetime.now(datetime.timezone.utc)},
+                upsert=True
+            )
+        except PyMongoError as e:
+            logger.warning(f'Failed to store the prediction in the cache: {e}')
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        hits = self.memory_hits + self.mongo_hits
+        lookups = hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'mongo_hits': self.mongo_hits,
+            'misses': self.misses,
+            'hit_ratio': hits / lookups if lookups else 0.0,
+            'saved_inference_seconds': self.saved_inference_time,
+        }
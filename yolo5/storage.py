@@ -0,0 +1,104 @@
+import threading
+import time
+
+from loguru import logger
+from pymongo.errors import BulkWriteError, PyMongoError
+
+try:
+    from yolo5.metrics import stage
+except ImportError:
+    # running from within the yolo5 directory (the service container)
+    from metrics import stage
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class PredictionWriter:
+    """
+    Buffers prediction summaries and writes them to `collection` with `insert_many`, once `max_batch` of them
+    are waiting or every `flush_interval` seconds.
+
+    Writes are at least once: a summary leaves the buffer only after Mongo acknowledged it (a retried batch
+    that was partly inserted before is fine, its inserted documents fail as duplicates of themselves), and
+    `close` flushes what is left before returning.
+    """
+
+    def __init__(self, collection, max_batch=50, flush_interval=1.0):
+        self.collection = collection
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='prediction-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, summary):
+        """
+        Queues a copy of `summary` (so the caller's dict doesn't get Mongo's `_id`) for the next flush.
+        """
+        with self._lock:
+            self._buffer.append(dict(summary))
+            if len(self._buffer) >= self.max_batch:
+                self._wakeup.set()
+
+    @property
+    def pending(self):
+        return len(self._buffer)
+
+    def flush(self):
+        """
+        Writes the buffered summaries, returns False (keeping them buffered) if Mongo failed.
+        """
+        with self._flush_lock:
+            with self._lock:
+                documents, self._buffer = self._buffer, []
+            if not documents:
+                return True
+
+            try:
+                # the writes are batched, so the stage has no trace id: its histogram counts batches
+                with stage('mongo_insert'):
+                    self.collection.insert_many(documents, ordered=False)
+                return True
+            except BulkWriteError as e:
+                errors = e.details['writeErrors']
+                duplicates = {error['index'] for error in errors if error['code'] == DUPLICATE_KEY_ERROR}
+                if e.details['nInserted'] + len(duplicates) == len(documents):
+                    failed = {error['index'] for error in errors} - duplicates
+                else:
+                    # not every document is accounted for, retry all but the ones known to be stored
+                    failed = set(range(len(documents))) - duplicates
+                retry = [document for index, document in enumerate(documents) if index in failed]
+                logger.warning(f'{len(retry)} of {len(documents)} predictions were not written: {e}')
+            except PyMongoError as e:
+                retry = documents
+                logger.warning(f'Failed to write {len(documents)} predictions: {e}')
+
+            with self._lock:
+                self._buffer[:0] = retry
+            return not retry
+
+    def _loop(self):
+        while not self._closed.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self, retries=3, retry_delay=1.0):
+        """
+        Stops the background flushes and writes what is left, retrying failed writes.
+        """
+        self._closed.set()
+        self._wakeup.set()
+        self._thread.join()
+
+        for attempt in range(retries + 1):
+            if self.flush():
+                return
+            if attempt < retries:
+                time.sleep(retry_delay)
+        logger.error(f'{len(self._buffer)} predictions were lost on shutdown: {self._buffer}')
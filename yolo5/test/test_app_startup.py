@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+yolo5_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# generous for slow CI machines, app.py imported in about 0.35s when this was written, the model and its
+# dependencies are loaded by `warm_up` after the server starts
+IMPORT_TIME_BUDGET = 1.5
+LAZY_MODULES = {'torch', 'cv2', 'models', 'utils', 'boto3', 'botocore', 'pymongo'}
+
+
+def import_profile(module, cwd, env):
+    """
+    Imports `module` in a new interpreter with `-X importtime`, returns the total import time in seconds
+    and the names of all the modules it imported.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=cwd,
+                            env={**os.environ, **env}, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    total, modules = 0, set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue  # the header
+        modules.add(name.strip())
+        if not name.startswith('  '):
+            total += int(cumulative)
+    return total / 1e6, modules
+
+
+class TestStartup(unittest.TestCase):
+
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.workdir = workdir.name
+        # app.py reads the class names from the yolov5 data directory it runs in
+        os.mkdir(os.path.join(self.workdir, 'data'))
+        with open(os.path.join(self.workdir, 'data', 'coco128.yaml'), 'w') as f:
+            f.write('names:\n  0: person\n')
+        self.env = {'BUCKET_NAME': 'bucket', 'MONGOLITE': 'mongodb://mongo', 'PYTHONPATH': yolo5_dir}
+
+    def test_import_time(self):
+        total, modules = import_profile('app', self.workdir, self.env)
+
+        self.assertFalse({name.split('.')[0] for name in modules} & LAZY_MODULES)
+        self.assertLess(total, IMPORT_TIME_BUDGET)
+
+    def test_metrics_while_warming_up(self):
+        # the app is imported without running `warm_up`
+        script = ('from app import app\n'
+                  'client = app.test_client()\n'
+                  'print(client.get("/metrics").status_code, client.post("/predict").status_code)\n')
+        result = subprocess.run([sys.executable, '-c', script], cwd=self.workdir, env={**os.environ, **self.env},
+                                stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        self.assertEqual(result.stdout.split()[-2:], ['200', '503'])
+
+if __name__ == '__main__':
+    unittest.main()
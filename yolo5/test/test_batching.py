@@ -0,0 +1,70 @@
+import unittest
+import threading
+import time
+from yolo5.batching import BatchScheduler
+from yolo5.metrics import REGISTRY
+
+
+class TestBatchScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+
+    def predict_batch(self, imgs):
+        self.batches.append(list(imgs))
+        return [img * 10 for img in imgs]
+
+    def predict_concurrently(self, scheduler, imgs):
+        results = {}
+
+        def predict(img):
+            results[img] = scheduler.predict(img, timeout=5)
+
+        threads = [threading.Thread(target=predict, args=(img,)) for img in imgs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_results_reach_their_callers(self):
+        scheduler = BatchScheduler(self.predict_batch, max_batch_size=4, max_wait_ms=50)
+        results = self.predict_concurrently(scheduler, range(10))
+        scheduler.close()
+
+        self.assertEqual(results, {img: img * 10 for img in range(10)})
+        self.assertTrue(all(len(batch) <= 4 for batch in self.batches))
+        self.assertLess(len(self.batches), 10)
+
+    def test_max_wait(self):
+        scheduler = BatchScheduler(self.predict_batch, max_batch_size=8, max_wait_ms=20)
+        single_batches = scheduler.stats()['batch_size']['buckets']['1']
+        start = time.perf_counter()
+        self.assertEqual(scheduler.predict(1, timeout=5), 10)
+        scheduler.close()
+
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(self.batches, [[1]])
+        self.assertEqual(scheduler.stats()['batch_size']['buckets']['1'], single_batches + 1)
+
+    def test_metrics(self):
+        scheduler = BatchScheduler(self.predict_batch, max_batch_size=4, max_wait_ms=50)
+        self.predict_concurrently(scheduler, range(4))
+        scheduler.close()
+
+        text = REGISTRY.render()
+        self.assertIn('prediction_batch_size_bucket{le="4"}', text)
+        self.assertIn('prediction_batch_queue_wait_seconds_count', text)
+
+    def test_failed_batch(self):
+        def failing_predict_batch(imgs):
+            raise RuntimeError('model failure')
+
+        scheduler = BatchScheduler(failing_predict_batch)
+        with self.assertRaises(RuntimeError):
+            scheduler.predict(1, timeout=5)
+        scheduler.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import json
+import unittest
+import numpy as np
+from yolo5.detections import Detections
+
+NAMES = {0: 'person', 16: 'dog', 2: 'car'}
+
+
+class TestDetections(unittest.TestCase):
+
+    def setUp(self):
+        # (x1, y1, x2, y2, confidence, class) in pixels of a 200x100 (width x height) image
+        self.det = np.array([
+            [0, 0, 100, 50, 0.9, 0],
+            [100, 50, 200, 100, 0.5, 16],
+            [50, 25, 150, 75, 0.7, 0],
+            [0, 0, 20, 10, 0.4, 0],
+        ])
+        self.detections = Detections.from_xyxy(self.det, (100, 200, 3))
+
+    def test_from_xyxy(self):
+        self.assertEqual(len(self.detections), 4)
+        np.testing.assert_array_equal(self.detections.class_ids, [0, 16, 0, 0])
+        np.testing.assert_allclose(self.detections.boxes[0], [0.25, 0.25, 0.5, 0.5])
+        np.testing.assert_allclose(self.detections.boxes[1], [0.75, 0.75, 0.5, 0.5])
+        np.testing.assert_allclose(self.detections.confidences, [0.9, 0.5, 0.7, 0.4])
+
+    def test_round_trip(self):
+        wire = json.loads(json.dumps(self.detections.to_dict()))
+        detections = Detections.from_dict(wire)
+
+        np.testing.assert_array_equal(detections.class_ids, self.detections.class_ids)
+        np.testing.assert_allclose(detections.boxes, self.detections.boxes, atol=1e-4)
+        np.testing.assert_allclose(detections.confidences, self.detections.confidences, atol=1e-3)
+
+    def test_summarize(self):
+        summary = self.detections.summarize(NAMES)
+
+        self.assertEqual(list(summary), ['person', 'dog'])
+        self.assertEqual(summary['person'], {'count': 3, 'mean_confidence': 0.667, 'max_confidence': 0.9,
+                                             'area': round(0.25 + 0.25 + 0.01, 4)})
+        self.assertEqual(summary['dog'], {'count': 1, 'mean_confidence': 0.5, 'max_confidence': 0.5, 'area': 0.25})
+
+    def test_summarize_matches_per_box_counting(self):
+        rng = np.random.default_rng(0)
+        class_ids = rng.integers(0, 80, 500)
+        detections = Detections(class_ids, rng.random((500, 4)), rng.random(500))
+        names = {class_id: f'class{class_id}' for class_id in range(80)}
+
+        counts = {}
+        for class_id in class_ids.tolist():
+            counts[names[class_id]] = counts.get(names[class_id], 0) + 1
+
+        self.assertEqual({name: info['count'] for name, info in detections.summarize(names).items()}, counts)
+
+    def test_empty(self):
+        detections = Detections.from_xyxy(np.zeros((0, 6)), (100, 200, 3))
+        self.assertEqual(len(detections), 0)
+        self.assertEqual(detections.summarize(NAMES), {})
+        self.assertEqual(Detections.from_dict(detections.to_dict()).boxes.shape, (0, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from yolo5.consumers import PredictionConsumerPool
+from yolo5.job_queue import PREDICTION_QUEUE, RESULT_QUEUE, InMemoryBroker, SQLiteBroker, create_broker
+
+
+class BrokerTests:
+
+    def test_send_receive_delete(self):
+        self.broker.send('jobs', {'imgName': 'a.jpeg'})
+        messages = self.broker.receive('jobs', visibility_timeout=30)
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0].body, {'imgName': 'a.jpeg'})
+        self.assertEqual(messages[0].receive_count, 1)
+        self.assertEqual(self.broker.depth('jobs'), (0, 1))
+
+        self.broker.delete('jobs', messages[0].receipt)
+        self.assertEqual(self.broker.depth('jobs'), (0, 0))
+        self.assertEqual(self.broker.receive('jobs'), [])
+
+    def test_visibility_timeout(self):
+        self.broker.send('jobs', {'imgName': 'a.jpeg'})
+        first = self.broker.receive('jobs', visibility_timeout=0.2)[0]
+        self.assertEqual(self.broker.receive('jobs'), [])
+
+        second = self.broker.receive('jobs', visibility_timeout=30, wait_time=2)[0]
+        self.assertEqual(second.id, first.id)
+        self.assertEqual(second.receive_count, 2)
+
+        # the first receipt is stale, deleting with it keeps the message
+        self.broker.delete('jobs', first.receipt)
+        self.assertEqual(self.broker.depth('jobs'), (0, 1))
+
+    def test_queues_are_separate(self):
+        self.broker.send('jobs', {'index': 0})
+        self.broker.send('results', {'index': 1})
+        self.assertEqual([message.body for message in self.broker.receive('results', max_messages=10)],
+                         [{'index': 1}])
+
+    def test_receive_order(self):
+        for index in range(5):
+            self.broker.send('jobs', {'index': index})
+        messages = self.broker.receive('jobs', max_messages=3)
+        self.assertEqual([message.body['index'] for message in messages], [0, 1, 2])
+
+    def test_wait_for_message(self):
+        threading.Timer(0.2, self.broker.send, args=('jobs', {'index': 0})).start()
+        messages = self.broker.receive('jobs', wait_time=5)
+        self.assertEqual(len(messages), 1)
+
+
+class TestInMemoryBroker(BrokerTests, unittest.TestCase):
+
+    def setUp(self):
+        self.broker = InMemoryBroker()
+
+
+class TestSQLiteBroker(BrokerTests, unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.broker = SQLiteBroker(os.path.join(self.tempdir.name, 'jobs.db'), poll_interval=0.01)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_shared_between_brokers(self):
+        other = create_broker(f'sqlite:///{self.broker.path}')
+        self.broker.send('jobs', {'index': 0})
+        self.assertEqual(other.receive('jobs')[0].body, {'index': 0})
+
+
+class FlakyBroker(InMemoryBroker):
+    """
+    Raises once from each of the methods named in `failures`, like a locked SQLite database.
+    """
+
+    def __init__(self, *failures):
+        super().__init__()
+        self.failures = list(failures)
+
+    def _fail(self, method):
+        if method in self.failures:
+            self.failures.remove(method)
+            raise sqlite3.OperationalError('database is locked')
+
+    def receive(self, queue, *args, **kwargs):
+        if queue == PREDICTION_QUEUE:
+            self._fail('receive')
+        return super().receive(queue, *args, **kwargs)
+
+    def send(self, queue, body):
+        if queue == RESULT_QUEUE:
+            self._fail('send')
+        return super().send(queue, body)
+
+    def depth(self, queue):
+        self._fail('depth')
+        return super().depth(queue)
+
+
+class TestPredictionConsumerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.broker = InMemoryBroker()
+
+    def results(self, count, timeout=5):
+        results = []
+        deadline = time.time() + timeout
+        while len(results) < count and time.time() < deadline:
+            for message in self.broker.receive(RESULT_QUEUE, max_messages=10, wait_time=0.1):
+                results.append(message.body)
+                self.broker.delete(RESULT_QUEUE, message.receipt)
+        return results
+
+    def test_results(self):
+        pool = PredictionConsumerPool(self.broker, lambda job: {'labels': [job['imgName']]}, wait_time=0.1)
+        pool.start()
+        try:
+            for index in range(5):
+                self.broker.send(PREDICTION_QUEUE, {'chat_id': index, 'imgName': f'{index}.jpeg'})
+            results = self.results(5)
+        finally:
+            pool.stop()
+
+        self.assertEqual(sorted(result['chat_id'] for result in results), list(range(5)))
+        for result in results:
+            self.assertEqual(result['summary'], {'labels': [result['imgName']]})
+        self.assertEqual(self.broker.depth(PREDICTION_QUEUE), (0, 0))
+
+    def test_failed_job_is_retried(self):
+        attempts = []
+
+        def handle_job(job):
+            attempts.append(job)
+            if len(attempts) == 1:
+                raise RuntimeError('yolo5 crashed')
+            return {'labels': []}
+
+        pool = PredictionConsumerPool(self.broker, handle_job, visibility_timeout=0.2, wait_time=0.1)
+        pool.start()
+        try:
+            self.broker.send(PREDICTION_QUEUE, {'chat_id': 1, 'imgName': 'a.jpeg'})
+            results = self.results(1)
+        finally:
+            pool.stop()
+
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(results, [{'chat_id': 1, 'imgName': 'a.jpeg', 'summary': {'labels': []}}])
+
+    def test_max_receives(self):
+        def handle_job(job):
+            raise RuntimeError('yolo5 crashed')
+
+        pool = PredictionConsumerPool(self.broker, handle_job, visibility_timeout=0.1, max_receives=2,
+                                      wait_time=0.1)
+        pool.start()
+        try:
+            self.broker.send(PREDICTION_QUEUE, {'chat_id': 1, 'imgName': 'a.jpeg'})
+            results = self.results(1)
+        finally:
+            pool.stop()
+
+        self.assertEqual(results[0]['summary'], {'error': 'Prediction failed'})
+        self.assertEqual(self.broker.depth(PREDICTION_QUEUE), (0, 0))
+
+    def test_broker_errors(self):
+        self.broker = FlakyBroker('receive', 'send')
+        # the same consumer handles both jobs, the scaler doesn't run to replace it
+        pool = PredictionConsumerPool(self.broker, lambda job: {'labels': []}, visibility_timeout=0.2,
+                                      scale_interval=60, wait_time=0.1)
+        pool.start()
+        try:
+            self.broker.send(PREDICTION_QUEUE, {'chat_id': 1, 'imgName': 'a.jpeg'})
+            results = self.results(1)
+            self.broker.send(PREDICTION_QUEUE, {'chat_id': 2, 'imgName': 'b.jpeg'})
+            results += self.results(1)
+        finally:
+            pool.stop()
+
+        self.assertEqual(self.broker.failures, [])
+        self.assertEqual([result['chat_id'] for result in results], [1, 2])
+        self.assertEqual(self.broker.depth(PREDICTION_QUEUE), (0, 0))
+
+    def test_scaler_survives_broker_errors(self):
+        self.broker = FlakyBroker()
+        pool = PredictionConsumerPool(self.broker, lambda job: {}, min_consumers=1, scale_interval=0.05,
+                                      wait_time=0.1)
+        pool.start()
+        try:
+            self.broker.failures.append('depth')
+            stop, consumer = pool._consumers[0]
+            stop.set()
+            consumer.join()
+            # the dead consumer is replaced once the scaler runs again
+            for _ in range(100):
+                if not self.broker.failures and any(thread.is_alive() for _, thread in pool._consumers):
+                    break
+                time.sleep(0.05)
+            scaler_alive = pool._scaler.is_alive()
+            consumers_alive = [thread.is_alive() for _, thread in pool._consumers]
+        finally:
+            pool.stop()
+
+        self.assertEqual(self.broker.failures, [])
+        self.assertTrue(scaler_alive)
+        self.assertEqual(consumers_alive, [True])
+
+    def test_scaling(self):
+        pool = PredictionConsumerPool(self.broker, lambda job: {}, min_consumers=1, max_consumers=3,
+                                      jobs_per_consumer=2)
+        self.assertEqual(pool.desired_consumers(), 1)
+        for index in range(5):
+            self.broker.send(PREDICTION_QUEUE, {'chat_id': index, 'imgName': f'{index}.jpeg'})
+        self.assertEqual(pool.desired_consumers(), 3)
+        for index in range(5):
+            self.broker.send(PREDICTION_QUEUE, {'chat_id': index, 'imgName': f'{index}.jpeg'})
+        self.assertEqual(pool.desired_consumers(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
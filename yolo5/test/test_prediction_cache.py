@@ -0,0 +1,57 @@
+import unittest
+import mongomock
+from yolo5.prediction_cache import PredictionCache
+
+DETECTIONS = {'class_ids': [0], 'boxes': [0.5, 0.5, 0.2, 0.4], 'confidences': [0.9]}
+NO_DETECTIONS = {'class_ids': [], 'boxes': [], 'confidences': []}
+
+
+class TestPredictionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = mongomock.MongoClient()['mongo1']['Yolo5PredictionCache']
+        self.cache = PredictionCache(self.collection, 'yolov5s-test', max_entries=2)
+
+    def test_key_depends_on_bytes_and_model(self):
+        other_model_cache = PredictionCache(self.collection, 'yolov5m-test')
+
+        self.assertEqual(self.cache.key(b'image'), self.cache.key(b'image'))
+        self.assertNotEqual(self.cache.key(b'image'), self.cache.key(b'other image'))
+        self.assertNotEqual(self.cache.key(b'image'), other_model_cache.key(b'image'))
+
+    def test_memory_hit(self):
+        key = self.cache.key(b'image')
+        self.assertIsNone(self.cache.get(key))
+
+        self.cache.put(key, DETECTIONS, 'predicted_file_1.jpg', 0.25)
+        entry = self.cache.get(key)
+
+        self.assertEqual(entry['detections'], DETECTIONS)
+        self.assertEqual(entry['predicted_img_path'], 'predicted_file_1.jpg')
+        self.assertEqual(self.cache.stats(), {'memory_hits': 1, 'mongo_hits': 0, 'misses': 1, 'hit_ratio': 0.5,
+                                              'saved_inference_seconds': 0.25})
+
+    def test_mongo_hit_after_eviction(self):
+        keys = [self.cache.key(bytes([i])) for i in range(3)]
+        for key in keys:
+            self.cache.put(key, DETECTIONS, f'predicted_{key}.jpg', 0.1)
+
+        entry = self.cache.get(keys[0])
+
+        self.assertEqual(entry['predicted_img_path'], f'predicted_{keys[0]}.jpg')
+        self.assertEqual(self.cache.mongo_hits, 1)
+
+    def test_shared_between_processes(self):
+        key = self.cache.key(b'image')
+        self.cache.put(key, NO_DETECTIONS, 'predicted_file_1.jpg', 0.1)
+
+        other_process_cache = PredictionCache(self.collection, 'yolov5s-test')
+        self.assertEqual(other_process_cache.get(key)['detections'], NO_DETECTIONS)
+
+    def test_ttl_index(self):
+        index = self.collection.index_information()['created_at_1']
+        self.assertEqual(index['expireAfterSeconds'], 7 * 24 * 3600)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import mongomock
+from pymongo.errors import AutoReconnect
+from yolo5.storage import PredictionWriter
+
+
+class FlakyCollection:
+    """
+    Wraps a collection, failing the first `failures` calls to insert_many after inserting half of the batch.
+    """
+
+    def __init__(self, collection, failures):
+        self.collection = collection
+        self.failures = failures
+
+    def insert_many(self, documents, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            self.collection.insert_many(documents[:len(documents) // 2], ordered=ordered)
+            raise AutoReconnect('connection reset')
+        return self.collection.insert_many(documents, ordered=ordered)
+
+
+def summary(index):
+    return {'prediction_id': str(index), 'labels': [{'class': 'person'}]}
+
+
+class TestPredictionWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = mongomock.MongoClient()['mongo1']['Yolo5']
+
+    def test_flush_on_batch_size(self):
+        writer = PredictionWriter(self.collection, max_batch=3, flush_interval=60)
+        for index in range(3):
+            writer.write(summary(index))
+
+        for _ in range(100):
+            if self.collection.count_documents({}) == 3:
+                break
+            writer._thread.join(0.01)
+        self.assertEqual(self.collection.count_documents({}), 3)
+        writer.close()
+
+    def test_flush_on_interval(self):
+        writer = PredictionWriter(self.collection, max_batch=100, flush_interval=0.05)
+        writer.write(summary(0))
+        writer._thread.join(0.5)
+
+        self.assertEqual(self.collection.count_documents({}), 1)
+        writer.close()
+
+    def test_write_does_not_change_summary(self):
+        writer = PredictionWriter(self.collection, max_batch=1, flush_interval=60)
+        prediction_summary = summary(0)
+        writer.write(prediction_summary)
+        writer.close()
+
+        self.assertEqual(prediction_summary, summary(0))
+
+    def test_close_writes_every_summary_once(self):
+        writer = PredictionWriter(FlakyCollection(self.collection, failures=2), max_batch=100, flush_interval=60)
+        for index in range(10):
+            writer.write(summary(index))
+
+        self.assertFalse(writer.flush())
+        writer.close(retry_delay=0)
+
+        self.assertEqual(writer.pending, 0)
+        ids = sorted(document['prediction_id'] for document in self.collection.find())
+        self.assertEqual(ids, sorted(str(index) for index in range(10)))
+
+
+if __name__ == '__main__':
+    unittest.main()